@@ -0,0 +1 @@
+# Empty __init__.py file
\ No newline at end of file
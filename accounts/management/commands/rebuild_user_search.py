@@ -0,0 +1,34 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts import search
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the user search index (accounts.search) from the user table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of users indexed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        indexed = 0
+        last_id = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            indexed += search.rebuild_range(last_id, user_ids[-1])
+            last_id = user_ids[-1]
+        # Entries of deleted users past the last one left
+        search.rebuild_range(last_id, sys.maxsize)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} users for search.'))
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:18
+
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Copies of accounts.search as it was when this was written, so later
+# changes there don't change what this migration does
+USERNAME = 0
+NAME = 1
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(char for char in text if not unicodedata.combining(char)).split())
+
+
+def search_terms(username, first_name, last_name):
+    terms = {(USERNAME, normalize(username))}
+    name = normalize(f'{first_name} {last_name}')
+    if name:
+        terms.add((NAME, name))
+        terms.update((NAME, word) for word in name.split())
+    return sorted(terms)
+
+
+def trigram_text(username, first_name, last_name):
+    return normalize(f'{username} {first_name} {last_name}')
+
+
+def create_user_search(apps, schema_editor):
+    User = apps.get_model('accounts', 'CustomUser')
+    UserSearchTerm = apps.get_model('accounts', 'UserSearchTerm')
+    db_alias = schema_editor.connection.alias
+    # FTS5 is SQLite only; elsewhere search matches prefixes alone
+    trigrams = schema_editor.connection.vendor == 'sqlite'
+    if trigrams:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE accounts_user_trigram USING fts5(text, tokenize = 'trigram', detail = 'none')"
+        )
+
+    users = User.objects.using(db_alias).order_by('pk').values_list('pk', 'username', 'first_name', 'last_name')
+    UserSearchTerm.objects.using(db_alias).bulk_create((
+        UserSearchTerm(user_id=pk, kind=kind, term=term)
+        for pk, *names in users.iterator()
+        for kind, term in search_terms(*names)
+    ), batch_size=1000)
+    if trigrams:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO accounts_user_trigram (rowid, text) VALUES (%s, %s)',
+                ((pk, trigram_text(*names)) for pk, *names in users.iterator())
+            )
+
+
+def drop_user_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS accounts_user_trigram')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'Username'), (1, 'Name')])),
+                ('term', models.CharField(max_length=301)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='user_search_prefix_idx')],
+            },
+        ),
+        migrations.RunPython(create_user_search, drop_user_search, hints={'model_name': 'customuser'}),
+    ]
@@ -8,3 +8,24 @@ class CustomUser(AbstractUser):
     
     def __str__(self):
         return self.username
+
+class UserSearchTerm(models.Model):
+    """
+    A user's normalized username, full name or name word, found by prefix
+    through the (kind, term) index. Maintained by accounts.signals; see
+    accounts.search.
+    """
+    USERNAME = 0
+    NAME = 1
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='search_terms')
+    kind = models.PositiveSmallIntegerField(choices=[(USERNAME, 'Username'), (NAME, 'Name')])
+    term = models.CharField(max_length=301)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='user_search_prefix_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.term}"
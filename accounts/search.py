@@ -0,0 +1,167 @@
+"""
+Indexed user search for the search page and its autocomplete.
+
+Usernames and names can't be searched with icontains at scale: a
+leading-wildcard LIKE reads the whole user table on every keystroke.
+Instead each user has two index entries, kept in sync by
+accounts.signals:
+
+* UserSearchTerm rows holding their normalized username, full name and
+  each word of it, searched by prefix with a range scan over
+  ``(kind, term)``;
+* a row in ``accounts_user_trigram``, an SQLite FTS5 table with the
+  trigram tokenizer, matching the query anywhere in the username or name
+  once it has three characters.
+
+Results are ranked username prefixes first, then name prefixes, then
+other matches, and cached per normalized query for
+USER_SEARCH_CACHE_TIMEOUT seconds to absorb autocomplete bursts, so a
+rename shows up once that expires. Other databases have no trigram
+table and only match prefixes.
+
+``manage.py rebuild_user_search`` refills both after bulk writes.
+"""
+import hashlib
+import unicodedata
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections, router, transaction
+
+from .models import UserSearchTerm
+
+User = get_user_model()
+
+TRIGRAM_TABLE = 'accounts_user_trigram'
+# The trigram tokenizer can't look up anything shorter
+TRIGRAM_MIN_LENGTH = 3
+# End of the range holding every string that starts with a prefix
+PREFIX_END = '\U0010ffff'
+GLOB_SPECIAL = str.maketrans('', '', '*?[]')
+
+
+def normalize(text):
+    """Casefolded, without accents, with runs of whitespace collapsed."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(char for char in text if not unicodedata.combining(char)).split())
+
+
+def search_terms(username, first_name, last_name):
+    """The ``(kind, term)`` pairs a user is found by."""
+    terms = {(UserSearchTerm.USERNAME, normalize(username))}
+    name = normalize(f'{first_name} {last_name}')
+    if name:
+        terms.add((UserSearchTerm.NAME, name))
+        terms.update((UserSearchTerm.NAME, word) for word in name.split())
+    return sorted(terms)
+
+
+def trigram_text(username, first_name, last_name):
+    return normalize(f'{username} {first_name} {last_name}')
+
+
+def trigrams_available(using=None):
+    return connections[using or router.db_for_write(User)].vendor == 'sqlite'
+
+
+def cache_key(query, limit):
+    # Hashed: queries may hold spaces and characters memcached rejects
+    return f'user-search:{limit}:{hashlib.sha1(query.encode()).hexdigest()}'
+
+
+def search_users(query, limit=10, exclude=None):
+    """Up to ``limit`` users matching ``query``, best first, leaving out the user id ``exclude``."""
+    query = normalize(query)
+    if not query:
+        return []
+    # Shared by every viewer, with one spare so the list is still full
+    # once ``exclude`` is dropped
+    key = cache_key(query, limit)
+    ids = cache.get(key)
+    if ids is None:
+        ids = matching_ids(query, limit + 1)
+        cache.set(key, ids, getattr(settings, 'USER_SEARCH_CACHE_TIMEOUT', 30))
+    ids = [user_id for user_id in ids if user_id != exclude][:limit]
+    users = User.objects.in_bulk(ids)
+    return [users[user_id] for user_id in ids if user_id in users]
+
+
+def matching_ids(query, limit):
+    ids = []
+    for kind in (UserSearchTerm.USERNAME, UserSearchTerm.NAME):
+        if len(ids) >= limit:
+            break
+        # A range rather than startswith, which SQLite runs as a LIKE no index serves
+        ids.extend(
+            UserSearchTerm.objects.filter(kind=kind, term__gte=query, term__lt=query + PREFIX_END)
+            .exclude(user_id__in=ids).order_by('term').values_list('user_id', flat=True)[:limit * 2]
+        )
+        ids = list(dict.fromkeys(ids))
+
+    using = router.db_for_read(User)
+    pattern = query.translate(GLOB_SPECIAL)
+    if len(ids) < limit and len(pattern) >= TRIGRAM_MIN_LENGTH and trigrams_available(using):
+        with connections[using].cursor() as cursor:
+            # GLOB, not LIKE: the text is already lowercase, and _ in a
+            # username would be a LIKE wildcard
+            cursor.execute(
+                f'SELECT rowid FROM {TRIGRAM_TABLE} WHERE text GLOB %s LIMIT %s',
+                [f'*{pattern}*', limit * 2]
+            )
+            ids.extend(row[0] for row in cursor.fetchall())
+    return list(dict.fromkeys(ids))[:limit]
+
+
+def index_user(user, using=None):
+    using = using or router.db_for_write(User)
+    with transaction.atomic(using=using):
+        UserSearchTerm.objects.using(using).filter(user=user).delete()
+        UserSearchTerm.objects.using(using).bulk_create([
+            UserSearchTerm(user=user, kind=kind, term=term)
+            for kind, term in search_terms(user.username, user.first_name, user.last_name)
+        ])
+        if trigrams_available(using):
+            with connections[using].cursor() as cursor:
+                cursor.execute(f'DELETE FROM {TRIGRAM_TABLE} WHERE rowid = %s', [user.pk])
+                cursor.execute(
+                    f'INSERT INTO {TRIGRAM_TABLE} (rowid, text) VALUES (%s, %s)',
+                    [user.pk, trigram_text(user.username, user.first_name, user.last_name)]
+                )
+
+
+def unindex_user(user_id, using=None):
+    # UserSearchTerm rows go with the user
+    using = using or router.db_for_write(User)
+    if trigrams_available(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TRIGRAM_TABLE} WHERE rowid = %s', [user_id])
+
+
+def rebuild_range(first_id, last_id, using=None):
+    """
+    Re-index the users with ids in ``(first_id, last_id]``, dropping
+    entries left behind by users that are gone. Returns the users indexed.
+    """
+    using = using or router.db_for_write(User)
+    users = list(
+        User.objects.using(using).filter(pk__gt=first_id, pk__lte=last_id)
+        .values_list('pk', 'username', 'first_name', 'last_name')
+    )
+    with transaction.atomic(using=using):
+        UserSearchTerm.objects.using(using).filter(user_id__gt=first_id, user_id__lte=last_id).delete()
+        UserSearchTerm.objects.using(using).bulk_create([
+            UserSearchTerm(user_id=pk, kind=kind, term=term)
+            for pk, *names in users
+            for kind, term in search_terms(*names)
+        ], batch_size=1000)
+        if trigrams_available(using):
+            with connections[using].cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {TRIGRAM_TABLE} WHERE rowid > %s AND rowid <= %s', [first_id, last_id]
+                )
+                cursor.executemany(
+                    f'INSERT INTO {TRIGRAM_TABLE} (rowid, text) VALUES (%s, %s)',
+                    [(pk, trigram_text(*names)) for pk, *names in users]
+                )
+    return len(users)
@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+
+User = get_user_model()
+
+SEARCHED_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields, using, **kwargs):
+    # Logins save last_login alone; nothing searched changes then
+    if update_fields is not None and not SEARCHED_FIELDS & set(update_fields):
+        return
+    search.index_user(instance, using)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, using, **kwargs):
+    search.unindex_user(instance.pk, using)
@@ -1,3 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .search import search_users
+
+User = get_user_model()
+
+
+class UserSearchTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.ada = User.objects.create(username='ada_l', email='ada@example.com', first_name='Ada', last_name='Lovelace')
+        self.alan = User.objects.create(username='turing', email='alan@example.com', first_name='Alan', last_name='Turing')
+        self.zoe = User.objects.create(username='zoe', email='zoe@example.com', first_name='Zoë', last_name='Adams')
+
+    def search(self, query, **kwargs):
+        return [user.username for user in search_users(query, **kwargs)]
+
+    def test_username_prefixes_rank_before_name_prefixes(self):
+        self.assertEqual(self.search('ad'), ['ada_l', 'zoe'])
+
+    def test_matches_any_word_of_the_name_without_accents_or_case(self):
+        self.assertEqual(self.search('ZOE'), ['zoe'])
+        self.assertEqual(self.search('lovel'), ['ada_l'])
+        self.assertEqual(self.search('alan turing'), ['turing'])
+
+    def test_matches_inside_names_with_trigrams(self):
+        self.assertEqual(self.search('velac'), ['ada_l'])
+        # An underscore is matched literally, not as a wildcard
+        self.assertEqual(self.search('a_l'), ['ada_l'])
+        self.assertEqual(self.search('*[?'), [])
+
+    def test_leaves_out_the_searching_user(self):
+        self.assertEqual(self.search('ad', exclude=self.ada.pk), ['zoe'])
+
+    def test_follows_renames_and_deletes(self):
+        self.ada.username = 'countess'
+        self.ada.save()
+        self.zoe.delete()
+        self.assertEqual(self.search('count'), ['countess'])
+        self.assertEqual(self.search('ada'), ['countess'])
+        self.assertEqual(self.search('zo'), [])
+
+    def test_autocomplete_returns_json(self):
+        response = self.client.get('/accounts/search/', {'q': 'tur'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['users'], [
+            {'username': 'turing', 'full_name': 'Alan Turing', 'profile_url': '/profiles/profile/turing/'}
+        ])
@@ -1,11 +1,12 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate, get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Q
 from django.core.paginator import Paginator
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, UserSearchForm
+from .search import search_users
 
 User = get_user_model()
 
@@ -64,24 +65,39 @@ def user_search(request):
     if request.method == 'GET' and 'q' in request.GET:
         query = request.GET.get('q', '').strip()
         if query:
-            users = User.objects.filter(
-                Q(username__icontains=query) | 
-                Q(first_name__icontains=query) | 
-                Q(last_name__icontains=query)
-            ).exclude(id=request.user.id if request.user.is_authenticated else None)[:10]
+            # Indexed and cached; the autocomplete calls this on every keystroke
+            users = search_users(query, limit=10, exclude=request.user.id)
     
     # AJAX request
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        users_data = []
-        for user in users:
-            users_data.append({
-                'username': user.username,
-                'full_name': f'{user.first_name} {user.last_name}' if user.first_name else user.username,
-                'profile_url': f'/profiles/profile/{user.username}/'
-            })
-        return JsonResponse({'users': users_data})
+        return JsonResponse({'users': serialize_users(users)})
     
     return render(request, 'accounts/user_search.html', {
         'users': users,
         'query': query
     })
+
+async def auser_search(request):
+    # user_search under ASGI (see quizhub.asgi_urls): the autocomplete's
+    # JSON. The page's templates load request.user synchronously, so it is
+    # left to user_search
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return await sync_to_async(user_search)(request)
+    
+    users = []
+    if request.method == 'GET' and 'q' in request.GET:
+        query = request.GET.get('q', '').strip()
+        if query:
+            user = await request.auser()
+            users = await sync_to_async(search_users)(query, limit=10, exclude=user.id)
+    return JsonResponse({'users': serialize_users(users)})
+
+def serialize_users(users):
+    return [
+        {
+            'username': user.username,
+            'full_name': f'{user.first_name} {user.last_name}' if user.first_name else user.username,
+            'profile_url': f'/profiles/profile/{user.username}/'
+        }
+        for user in users
+    ]
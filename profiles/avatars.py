@@ -0,0 +1,141 @@
+"""
+Profile picture variants, rendered off the request path.
+
+Saving a profile with a new picture only stores the upload and flags the
+profile ``avatar_pending``; ``manage.py process_avatars`` picks flagged
+profiles up and renders their pictures in a pool of worker processes.
+Other profile edits don't touch the picture at all.
+
+Each picture is rendered as square variants in AVATARS['SIZES'], encoded
+as AVATARS['FORMAT'], and stored under a hash of the source image's
+content and the rendering settings, e.g.
+``avatars/3f/3f9c…e1-120.webp``. A variant's URL therefore always means
+the same bytes and can be served with a far-future, immutable
+Cache-Control, and a picture that was rendered before (the same file
+uploaded again, or by someone else) is only hashed, not re-encoded.
+Until its variants are ready a profile shows the uploaded file itself.
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .models import UserProfile
+
+logger = logging.getLogger('quizhub.avatars')
+
+DEFAULTS = {
+    # Widths rendered: the 80px and 120px avatar at 1x, 2x and 3x
+    'SIZES': (80, 120, 160, 240, 360),
+    # Any format Pillow can write; AVIF is smaller still but slower to encode
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+    # Seconds process_avatars waits between polls when nothing is pending
+    'POLL_INTERVAL': 2.0,
+    'BATCH_SIZE': 50,
+}
+
+DIRECTORY = 'avatars'
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'AVATARS', {})}
+
+
+def extension(options):
+    return options['FORMAT'].lower()
+
+
+def content_hash(data, options):
+    """The name variants of an image with bytes ``data`` are stored under."""
+    digest = hashlib.sha256()
+    # Rendering settings are part of the name, so changing them renders anew
+    digest.update(f"{options['FORMAT']}:{options['QUALITY']}:{','.join(map(str, options['SIZES']))}\n".encode())
+    digest.update(data)
+    return digest.hexdigest()[:32]
+
+
+def variant_name(digest, size, options=None):
+    options = options or config()
+    return f'{DIRECTORY}/{digest[:2]}/{digest}-{size}.{extension(options)}'
+
+
+def variant_url(digest, size):
+    """The URL of the smallest variant at least ``size`` wide."""
+    sizes = sorted(config()['SIZES'])
+    size = next((rendered for rendered in sizes if rendered >= size), sizes[-1])
+    return default_storage.url(variant_name(digest, size))
+
+
+def srcset(digest):
+    return ', '.join(f'{variant_url(digest, size)} {size}w' for size in config()['SIZES'])
+
+
+def render(name, options=None):
+    """
+    Render the variants of the stored picture ``name`` unless they exist
+    already. Returns their hash, or None when the file is missing or isn't
+    an image Pillow can read. Touches storage only, so it can run in a
+    worker process.
+    """
+    options = options or config()
+    try:
+        with default_storage.open(name, 'rb') as source:
+            data = source.read()
+    except (FileNotFoundError, ValueError):
+        return None
+    digest = content_hash(data, options)
+    missing = [size for size in options['SIZES'] if not default_storage.exists(variant_name(digest, size, options))]
+    if not missing:
+        return digest
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    # Crop once at the largest size and scale that down, rather than
+    # resampling the whole upload for every variant
+    square = ImageOps.fit(image, (max(options['SIZES']),) * 2, Image.Resampling.LANCZOS)
+    for size in missing:
+        variant = square if size == square.width else square.resize((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, options['FORMAT'], quality=options['QUALITY'])
+        path = variant_name(digest, size, options)
+        # Another worker may have rendered the same picture meanwhile;
+        # saving again would store a copy under a suffixed name
+        if not default_storage.exists(path):
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+    return digest
+
+
+def process_pending(batch_size, pool=None):
+    """
+    Render the pictures of up to ``batch_size`` pending profiles, with
+    ``pool`` if given. Returns ``(processed, failed)``.
+    """
+    options = config()
+    pending = list(
+        UserProfile.objects.filter(avatar_pending=True).exclude(profile_picture='')
+        .values_list('pk', 'profile_picture')[:batch_size]
+    )
+    work = [(name, options) for _, name in pending]
+    digests = pool.starmap(render, work) if pool else [render(*item) for item in work]
+
+    failed = 0
+    for (pk, name), digest in zip(pending, digests):
+        if digest is None:
+            failed += 1
+            logger.warning('Could not render the avatar of profile %s from %s', pk, name)
+        # Only if the picture is still the one rendered: a newer upload
+        # stays pending for the next batch
+        UserProfile.objects.filter(pk=pk, avatar_pending=True, profile_picture=name).update(
+            avatar_hash=digest or '', avatar_pending=False
+        )
+    return len(pending), failed
@@ -0,0 +1,62 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+
+from profiles import avatars
+from profiles.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Render the pending profile pictures into sized, content-addressed variants (see profiles.avatars)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes rendering pictures in parallel (0 = one per CPU)')
+        parser.add_argument('--interval', type=float,
+                            help='Seconds to wait when nothing is pending (defaults to POLL_INTERVAL)')
+        parser.add_argument('--batch-size', type=int, help='Profiles claimed per batch (defaults to BATCH_SIZE)')
+        parser.add_argument('--once', action='store_true', help='Render what is pending and exit instead of running forever')
+        parser.add_argument('--requeue', action='store_true',
+                            help='First mark every profile with a picture pending, e.g. after changing AVATARS')
+
+    def handle(self, *args, **options):
+        config = avatars.config()
+        interval = options['interval'] if options['interval'] is not None else config['POLL_INTERVAL']
+        batch_size = options['batch_size'] or config['BATCH_SIZE']
+        workers = options['workers'] or multiprocessing.cpu_count()
+        if options['requeue']:
+            queued = UserProfile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True).update(
+                avatar_pending=True
+            )
+            self.stdout.write(f'Queued {queued} pictures.')
+
+        processed = failed = 0
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            while True:
+                started = time.perf_counter()
+                count, errors = avatars.process_pending(batch_size, pool)
+                if count:
+                    processed += count
+                    failed += errors
+                    self.stdout.write(
+                        f'Rendered {count - errors} pictures ({errors} unreadable) '
+                        f'in {(time.perf_counter() - started) * 1000:.1f}ms'
+                    )
+                # A full batch means more is waiting
+                if count >= batch_size:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Nothing is in flight between batches; an interrupted batch is
+            # rendered again by the next run
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} pictures, {failed} unreadable.'))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_followers(apps, schema_editor):
+    UserProfile = apps.get_model('profiles', 'UserProfile')
+    Follow = apps.get_model('social', 'Follow')
+    followers = Follow.objects.filter(following=OuterRef('user')).order_by().values('following').annotate(
+        total=Count('id')
+    ).values('total')
+    UserProfile.objects.update(followers_count=Coalesce(Subquery(followers), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_alter_userprofile_profile_picture'),
+        ('social', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_followers, migrations.RunPython.noop),
+    ]
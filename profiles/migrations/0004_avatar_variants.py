@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def queue_existing_pictures(apps, schema_editor):
+    # Render variants of the pictures uploaded so far (manage.py process_avatars)
+    UserProfile = apps.get_model('profiles', 'UserProfile')
+    UserProfile.objects.using(schema_editor.connection.alias).exclude(
+        profile_picture=''
+    ).exclude(profile_picture__isnull=True).update(avatar_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_userprofile_followers_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('avatar_pending', True)), fields=['id'], name='profile_avatar_pending_idx'),
+        ),
+        migrations.RunPython(queue_existing_pictures, migrations.RunPython.noop, hints={'model_name': 'userprofile'}),
+    ]
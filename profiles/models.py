@@ -1,6 +1,7 @@
-from django.db import models
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.contrib.auth import get_user_model
-from PIL import Image
 
 User = get_user_model()
 
@@ -13,41 +14,94 @@ class UserProfile(models.Model):
     github_url = models.URLField(blank=True)
     linkedin_url = models.URLField(blank=True)
     total_upvotes = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Rendered variants of profile_picture (see profiles.avatars): the hash
+    # they are stored under, and whether a newer upload awaits rendering
+    avatar_hash = models.CharField(max_length=32, blank=True, editable=False)
+    avatar_pending = models.BooleanField(default=False, editable=False)
+    
+    class Meta:
+        indexes = [
+            # The queue process_avatars polls
+            models.Index(fields=['id'], condition=models.Q(avatar_pending=True), name='profile_avatar_pending_idx'),
+        ]
+    
+    # Denormalized counts kept up to date by social.signals:
+    # field -> (counted model, its foreign key to the user)
+    COUNTERS = {
+        'total_upvotes': ('social.Upvote', 'upvoted_user'),
+        'followers_count': ('social.Follow', 'following'),
+    }
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
     
     def save(self, *args, **kwargs):
+        # A file assigned since loading hasn't been written to storage yet;
+        # it is rendered later by process_avatars, off the request path
+        picture = self.profile_picture
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'profile_picture' in update_fields:
+            if picture and not picture._committed:
+                self.avatar_pending = True
+            elif not picture:
+                self.avatar_hash = ''
+                self.avatar_pending = False
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'avatar_hash', 'avatar_pending'}
         super().save(*args, **kwargs)
-        
-        # Resize image if it's too large
-        if self.profile_picture and hasattr(self.profile_picture, 'path'):
+    
+    @property
+    def avatar_ready(self):
+        return bool(self.profile_picture and self.avatar_hash and not self.avatar_pending)
+    
+    @property
+    def avatar_url(self):
+        """The 120px variant, or the uploaded picture until its variants are rendered."""
+        if not self.avatar_ready:
+            return self.profile_picture.url if self.profile_picture else ''
+        from .avatars import variant_url
+        return variant_url(self.avatar_hash, 120)
+    
+    @property
+    def avatar_srcset(self):
+        if not self.avatar_ready:
+            return ''
+        from .avatars import srcset
+        return srcset(self.avatar_hash)
+    
+    @classmethod
+    def adjust_counter(cls, user_id, field, delta):
+        """
+        Apply ``delta`` to one of the COUNTERS with an atomic UPDATE and
+        return its new value. Meant to run in the same transaction as the
+        insert or delete it accounts for.
+        """
+        updated = cls.objects.filter(user_id=user_id).update(**{field: F(field) + delta})
+        if not updated:
+            if delta < 0:
+                return 0
             try:
-                img = Image.open(self.profile_picture.path)
-                if img.height > 300 or img.width > 300:
-                    output_size = (300, 300)
-                    img.thumbnail(output_size)
-                    img.save(self.profile_picture.path)
-            except (IOError, ValueError):
-                # Handle cases where the image file doesn't exist or is invalid
-                pass
+                with transaction.atomic():
+                    # No profile yet: start from the true count, which includes this row
+                    profile = cls.objects.create(user_id=user_id, **{field: cls.count_for(user_id, field)})
+                    return getattr(profile, field)
+            except IntegrityError:
+                return cls.adjust_counter(user_id, field, delta)
+        return cls.objects.filter(user_id=user_id).values_list(field, flat=True).get()
+    
+    @classmethod
+    def count_for(cls, user_id, field):
+        model_label, user_field = cls.COUNTERS[field]
+        return apps.get_model(model_label).objects.filter(**{user_field: user_id}).count()
     
     def get_quiz_stats(self):
-        from quizzes.models import QuizAttempt
-        attempts = QuizAttempt.objects.filter(user=self.user)
-        if attempts.exists():
-            total_attempts = attempts.count()
-            avg_score = attempts.aggregate(avg_score=models.Avg('score'))['avg_score']
-            best_score = attempts.aggregate(max_score=models.Max('score'))['max_score']
-            return {
-                'total_attempts': total_attempts,
-                'average_score': round(avg_score, 2) if avg_score else 0,
-                'best_score': best_score or 0
-            }
+        from .stats import get_profile_stats
+        stats = get_profile_stats(self.user_id)
         return {
-            'total_attempts': 0,
-            'average_score': 0,
-            'best_score': 0
+            'total_attempts': stats['total_attempts'],
+            'average_score': stats['average_score'],
+            'best_score': stats['best_score']
         }
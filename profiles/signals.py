@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from quizzes.models import QuizAttempt
+from social.models import Comment
+
+from .stats import invalidate_profile_stats
+
+
+@receiver(post_save, sender=QuizAttempt)
+@receiver(post_delete, sender=QuizAttempt)
+def attempt_changed(sender, instance, using, **kwargs):
+    # Attempts may be written to a database of their own
+    invalidate_profile_stats(instance.user_id, using=using)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, created=True, **kwargs):
+    # Edits don't change any count
+    if created:
+        invalidate_profile_stats(instance.profile_owner_id)
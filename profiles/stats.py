@@ -0,0 +1,61 @@
+"""
+Per-user profile statistics, read in one query and cached.
+
+The quiz figures come from the denormalized UserQuizStats row and the
+comment count from a subquery, so a cache miss costs a single query.
+Entries are dropped by profiles.signals whenever the user completes or
+deletes an attempt, or gains or loses a comment. Upvotes and followers
+need no invalidation: their totals are stored on UserProfile, which is
+read fresh with the user.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from social.models import Comment
+
+User = get_user_model()
+
+
+def cache_key(user_id):
+    return f'profile-stats:{user_id}'
+
+
+def count_for(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(total=Count('*')).values('total')
+    ), 0)
+
+
+def compute_profile_stats(user_id):
+    row = User.objects.filter(pk=user_id).annotate(
+        comment_count=count_for(Comment, 'profile_owner'),
+    ).values(
+        'quiz_stats__attempts', 'quiz_stats__average_score', 'quiz_stats__best_score',
+        'comment_count',
+    ).first() or {}
+    average_score = row.get('quiz_stats__average_score')
+    return {
+        'total_attempts': row.get('quiz_stats__attempts') or 0,
+        'average_score': round(average_score, 2) if average_score else 0,
+        'best_score': row.get('quiz_stats__best_score') or 0,
+        'comments': row.get('comment_count', 0),
+    }
+
+
+def get_profile_stats(user_id):
+    stats = cache.get(cache_key(user_id))
+    if stats is None:
+        stats = compute_profile_stats(user_id)
+        cache.set(cache_key(user_id), stats, getattr(settings, 'PROFILE_STATS_CACHE_TIMEOUT', 3600))
+    return stats
+
+
+def invalidate_profile_stats(user_id, using=None):
+    # After commit, so a concurrent request can't re-cache the old figures
+    # between the delete and the write becoming visible
+    transaction.on_commit(lambda: cache.delete(cache_key(user_id)), using=using)
@@ -1,3 +1,272 @@
-from django.test import TestCase
+import base64
+import io
+import shutil
+import tempfile
+from contextlib import ExitStack
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, router
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from quizhub.pagination import InvalidCursor, decode_cursor, encode_cursor
+from quizhub.routers import attempt_databases
+from quizzes.models import Quiz, QuizAttempt
+from social.models import Comment
+
+from . import avatars, stats
+from .models import UserProfile
+
+User = get_user_model()
+
+
+class KeysetPaginationTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create(username='taker', email='taker@example.com')
+        author = User.objects.create(username='author', email='author@example.com')
+        quizzes = [Quiz.objects.create(title=f'Quiz {index}', language='python', created_by=author) for index in range(7)]
+        start = timezone.now().replace(microsecond=123456)
+        for index, quiz in enumerate(quizzes):
+            QuizAttempt.objects.create(user=self.user, quiz=quiz, score=index, total_questions=1, correct_answers=0)
+        # The last four share a timestamp, so the id breaks the tie
+        for index, attempt in enumerate(QuizAttempt.objects.order_by('id')):
+            QuizAttempt.objects.filter(pk=attempt.pk).update(completed_at=start + timedelta(seconds=min(index, 3)))
+        self.newest_first = list(
+            QuizAttempt.objects.order_by('-completed_at', '-id').values_list('id', flat=True)
+        )
+
+    def get(self, path, **params):
+        return self.client.get(f'/profiles/profile/taker/{path}/', params)
+
+    def walk(self, size):
+        ids, pages, cursor = [], 0, None
+        while True:
+            params = {'size': size, **({'cursor': cursor} if cursor else {})}
+            data = self.get('attempts', **params).json()
+            ids += [attempt['id'] for attempt in data['attempts']]
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids, pages
+
+    def test_pages_cover_every_attempt_once_across_tied_timestamps(self):
+        self.assertEqual(self.walk(size=2), (self.newest_first, 4))
+        self.assertEqual(self.walk(size=3), (self.newest_first, 3))
+
+    def test_exactly_full_last_page_has_no_cursor(self):
+        self.assertEqual(self.walk(size=7), (self.newest_first, 1))
+        data = self.get('attempts', size=6).json()
+        last = self.get('attempts', size=6, cursor=data['next_cursor']).json()
+        self.assertEqual([attempt['id'] for attempt in last['attempts']], self.newest_first[6:])
+        self.assertIsNone(last['next_cursor'])
+
+    def test_cursor_keeps_microseconds(self):
+        attempt = QuizAttempt.objects.get(pk=self.newest_first[0])
+        cursor = encode_cursor([attempt.completed_at, attempt.pk])
+        self.assertEqual(decode_cursor(cursor, QuizAttempt, ('completed_at', 'id')), [attempt.completed_at, attempt.pk])
+
+    def test_invalid_cursors_are_rejected(self):
+        def encoded(raw):
+            return base64.urlsafe_b64encode(raw.encode()).decode()
+
+        for cursor in ['not base64!', encoded('{"a": 1}'), encoded('["2024-01-01T00:00:00"]'),
+                       encoded('["yesterday", 5]'), encoded('["2024-01-01T00:00:00", "five"]')]:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(cursor, QuizAttempt, ('completed_at', 'id'))
+                response = self.get('attempts', cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['success'], False)
+
+        self.assertEqual(self.get('attempts', size='many').status_code, 400)
+
+    def test_profile_page_falls_back_to_the_first_page(self):
+        response = self.client.get('/profiles/profile/taker/', {'attempts_after': 'garbage', 'comments_after': '!!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([attempt.id for attempt in response.context['quiz_attempts']], self.newest_first)
+
+    def test_comments(self):
+        commenter = User.objects.create(username='commenter', email='commenter@example.com')
+        comments = [
+            Comment.objects.create(commenter=commenter, profile_owner=self.user, content=f'Comment {index}')
+            for index in range(3)
+        ]
+        Comment.objects.update(created_at=timezone.now())
+
+        first = self.get('comments', size=2).json()
+        rest = self.get('comments', size=2, cursor=first['next_cursor']).json()
+
+        self.assertEqual(
+            [comment['id'] for comment in first['comments'] + rest['comments']],
+            [comment.pk for comment in reversed(comments)]
+        )
+        self.assertIsNone(rest['next_cursor'])
+
+
+@override_settings(AVATARS={'SIZES': (8, 16), 'FORMAT': 'PNG', 'QUALITY': 80})
+class AvatarTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.user = User.objects.create_user(username='taker', email='taker@example.com', password='secret')
+        self.client.force_login(self.user)
+
+    def picture(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), color).save(buffer, 'PNG')
+        return SimpleUploadedFile('me.png', buffer.getvalue(), content_type='image/png')
+
+    def edit(self, user, **data):
+        self.client.force_login(user)
+        response = self.client.post(f'/profiles/profile/{user.username}/edit/', data)
+        self.assertEqual(response.status_code, 302)
+        return UserProfile.objects.get(user=user)
+
+    def variants(self):
+        return sorted(
+            f'{directory}/{name}'
+            for directory in default_storage.listdir(avatars.DIRECTORY)[0]
+            for name in default_storage.listdir(f'{avatars.DIRECTORY}/{directory}')[1]
+        )
+
+    def test_uploads_are_rendered_off_the_request(self):
+        profile = self.edit(self.user, profile_picture=self.picture('red'))
+        self.assertTrue(profile.avatar_pending)
+        self.assertEqual(profile.avatar_hash, '')
+        self.assertEqual(profile.avatar_url, profile.profile_picture.url)
+
+        self.assertEqual(avatars.process_pending(10), (1, 0))
+
+        profile.refresh_from_db()
+        self.assertFalse(profile.avatar_pending)
+        self.assertEqual(profile.avatar_url, default_storage.url(avatars.variant_name(profile.avatar_hash, 16)))
+        with default_storage.open(avatars.variant_name(profile.avatar_hash, 8)) as variant:
+            self.assertEqual(Image.open(variant).size, (8, 8))
+        self.assertEqual(avatars.process_pending(10), (0, 0))
+
+    def test_identical_uploads_share_their_variants(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.edit(self.user, profile_picture=self.picture('red'))
+        self.edit(other, profile_picture=self.picture('red'))
+
+        self.assertEqual(avatars.process_pending(10), (2, 0))
+
+        mine, theirs = UserProfile.objects.get(user=self.user), UserProfile.objects.get(user=other)
+        self.assertNotEqual(mine.profile_picture.name, theirs.profile_picture.name)
+        self.assertEqual(mine.avatar_hash, theirs.avatar_hash)
+        self.assertEqual(len(self.variants()), 2)
+
+    def test_other_edits_leave_the_picture_alone(self):
+        self.edit(self.user, profile_picture=self.picture('red'))
+        avatars.process_pending(10)
+        rendered = UserProfile.objects.get(user=self.user).avatar_hash
+
+        profile = self.edit(self.user, bio='Writes Python')
+
+        self.assertEqual(profile.bio, 'Writes Python')
+        self.assertFalse(profile.avatar_pending)
+        self.assertEqual(profile.avatar_hash, rendered)
+
+    def test_a_newer_upload_isnt_overwritten_by_a_stale_render(self):
+        self.edit(self.user, profile_picture=self.picture('red'))
+
+        class Pool:
+            """Renders, then sees a new picture uploaded before the results are stored."""
+
+            def starmap(pool, func, work):
+                digests = [func(*item) for item in work]
+                self.edit(self.user, profile_picture=self.picture('blue'))
+                return digests
+
+        self.assertEqual(avatars.process_pending(10, Pool()), (1, 0))
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertTrue(profile.avatar_pending)
+        self.assertEqual(profile.avatar_hash, '')
+
+        avatars.process_pending(10)
+        profile.refresh_from_db()
+        self.assertFalse(profile.avatar_pending)
+        with default_storage.open(profile.profile_picture.name, 'rb') as picture:
+            self.assertEqual(profile.avatar_hash, avatars.content_hash(picture.read(), avatars.config()))
+
+    def test_unreadable_pictures_are_cleared_from_the_queue(self):
+        profile = UserProfile(user=self.user, profile_picture=ContentFile(b'not an image', name='broken.png'))
+        profile.save()
+
+        with self.assertLogs('quizhub.avatars', 'WARNING'):
+            self.assertEqual(avatars.process_pending(10), (1, 1))
+
+        profile.refresh_from_db()
+        self.assertFalse(profile.avatar_pending)
+        self.assertEqual(profile.avatar_hash, '')
+        self.assertEqual(profile.avatar_url, profile.profile_picture.url)
+
+
+class ProfileStatsTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create(username='taker', email='taker@example.com')
+        author = User.objects.create(username='author', email='author@example.com')
+        self.quiz = Quiz.objects.create(title='Loops', language='python', created_by=author)
+
+    def attempt(self, score=50):
+        # Stats are dropped once the attempt commits, on whichever database holds it
+        with self.captureOnCommitCallbacks(using=router.db_for_write(QuizAttempt), execute=True):
+            QuizAttempt.objects.create(
+                user=self.user, quiz=self.quiz, score=score, total_questions=2, correct_answers=score // 50
+            )
+
+    def view(self):
+        response = self.client.get('/profiles/profile/taker/')
+        self.assertEqual(response.status_code, 200)
+        return response.context['profile_stats']
+
+    def test_repeat_views_are_served_from_the_cache(self):
+        self.attempt()
+        with mock.patch.object(stats, 'compute_profile_stats', wraps=stats.compute_profile_stats) as compute:
+            first, second = self.view(), self.view()
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(cache.get(stats.cache_key(self.user.pk)), first)
+
+    def test_attempts_and_comments_invalidate(self):
+        self.assertEqual(self.view()['total_attempts'], 0)
+
+        self.attempt(100)
+        self.assertIsNone(cache.get(stats.cache_key(self.user.pk)))
+        self.assertEqual(self.view()['best_score'], 100)
+
+        commenter = User.objects.create(username='commenter', email='commenter@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(commenter=commenter, profile_owner=self.user, content='Nice')
+        self.assertEqual(self.view()['comments'], 1)
+
+    def test_query_count_doesnt_grow_with_attempts(self):
+        for score in (0, 50, 100):
+            self.attempt(score)
+        for _ in range(12):
+            # Past the first page of the history
+            self.attempt()
+            cache.clear()
+            with ExitStack() as stack:
+                # The user, their stats, a page of comments and one of
+                # attempts, whose quizzes are joined or, from a database
+                # of their own, fetched in one more query
+                stack.enter_context(self.assertNumQueries(4))
+                for alias in attempt_databases():
+                    if alias != DEFAULT_DB_ALIAS:
+                        stack.enter_context(self.assertNumQueries(1, using=alias))
+                self.view()
@@ -6,5 +6,7 @@ app_name = 'profiles'
 urlpatterns = [
     path('profile/<str:username>/', views.profile_view, name='profile'),
     path('profile/<str:username>/edit/', views.edit_profile, name='edit_profile'),
+    path('profile/<str:username>/attempts/', views.profile_attempts, name='profile_attempts'),
+    path('profile/<str:username>/comments/', views.profile_comments, name='profile_comments'),
     path('my-profile/', views.my_profile, name='my_profile'),
 ]
\ No newline at end of file
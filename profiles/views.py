@@ -2,32 +2,43 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 from django.contrib import messages
-from django.core.paginator import Paginator
+from django import forms
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.urls import reverse
 from .models import UserProfile
+from .stats import get_profile_stats
+from quizhub.pagination import InvalidCursor, keyset_page
+from quizhub.routers import attempt_databases, join_or_prefetch
 from quizzes.models import QuizAttempt
 from social.models import Comment, Upvote
 
 User = get_user_model()
 
+MAX_PICTURE_SIZE = 5 * 1024 * 1024
+
 def profile_view(request, username):
-    user = get_object_or_404(User, username=username)
-    profile, created = UserProfile.objects.get_or_create(user=user)
+    user = get_object_or_404(User.objects.select_related('profile'), username=username)
+    try:
+        profile = user.profile
+    except UserProfile.DoesNotExist:
+        # Don't write on a read; edit_profile creates the row when needed
+        profile = UserProfile(user=user)
+    stats = get_profile_stats(user.id)
     
-    # Get quiz attempts with pagination
-    quiz_attempts_list = QuizAttempt.objects.filter(user=user).select_related('quiz').order_by('-completed_at')
-    attempts_paginator = Paginator(quiz_attempts_list, 10)  # Show 10 attempts per page
-    attempts_page_number = request.GET.get('attempts_page')
-    quiz_attempts = attempts_paginator.get_page(attempts_page_number)
-    
-    # Get comments with pagination
-    comments_list = Comment.objects.filter(profile_owner=user).select_related('commenter').order_by('-created_at')
-    comments_paginator = Paginator(comments_list, 5)  # Show 5 comments per page
-    comments_page_number = request.GET.get('comments_page')
-    comments = comments_paginator.get_page(comments_page_number)
+    # Cursor-paginated history and comments; a bad cursor falls back to the first page
+    try:
+        quiz_attempts = attempts_page(user, request.GET.get('attempts_after'))
+    except InvalidCursor:
+        quiz_attempts = attempts_page(user)
+    try:
+        comments = comments_page(user, request.GET.get('comments_after'))
+    except InvalidCursor:
+        comments = comments_page(user)
     
     # Check if current user has upvoted this profile
     has_upvoted = False
-    if request.user.is_authenticated:
+    if request.user.is_authenticated and request.user != user:
         has_upvoted = Upvote.objects.filter(upvoter=request.user, upvoted_user=user).exists()
     
     context = {
@@ -36,10 +47,70 @@ def profile_view(request, username):
         'quiz_attempts': quiz_attempts,
         'comments': comments,
         'has_upvoted': has_upvoted,
-        'quiz_stats': profile.get_quiz_stats()
+        'profile_stats': stats
     }
     return render(request, 'profiles/profile.html', context)
 
+def attempts_page(user, cursor=None, size=10):
+    attempts = join_or_prefetch(QuizAttempt.objects.filter(user=user), 'quiz')
+    return keyset_page(attempts, cursor, per_page=size, fields=('completed_at', 'id'), databases=attempt_databases())
+
+def comments_page(user, cursor=None, size=5):
+    comments = Comment.objects.filter(profile_owner=user).select_related('commenter')
+    return keyset_page(comments, cursor, per_page=size, fields=('created_at', 'id'))
+
+def page_size(request, default):
+    return min(100, max(1, int(request.GET.get('size', default))))
+
+def profile_attempts(request, username):
+    user = get_object_or_404(User, username=username)
+    try:
+        page = attempts_page(user, request.GET.get('cursor'), page_size(request, 10))
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'success': False, 'message': 'Invalid cursor or size'}, status=400)
+    
+    can_view_results = request.user == user or request.user.is_staff
+    return JsonResponse({
+        'success': True,
+        'attempts': [
+            {
+                'id': attempt.id,
+                'quiz_id': attempt.quiz_id,
+                'quiz_title': attempt.quiz.title,
+                'language': attempt.quiz.language,
+                'score': attempt.score,
+                'correct_answers': attempt.correct_answers,
+                'total_questions': attempt.total_questions,
+                'completed_at': attempt.completed_at.isoformat(),
+                'result_url': reverse('quizzes:quiz_result', args=[attempt.quiz_id, attempt.id]) if can_view_results else None
+            }
+            for attempt in page
+        ],
+        'next_cursor': page.next_cursor
+    })
+
+def profile_comments(request, username):
+    user = get_object_or_404(User, username=username)
+    try:
+        page = comments_page(user, request.GET.get('cursor'), page_size(request, 5))
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'success': False, 'message': 'Invalid cursor or size'}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'comments': [
+            {
+                'id': comment.id,
+                'content': comment.content,
+                'commenter_username': comment.commenter.username,
+                'created_at': comment.created_at.isoformat(),
+                'is_edited': comment.is_edited
+            }
+            for comment in page
+        ],
+        'next_cursor': page.next_cursor
+    })
+
 @login_required
 def my_profile(request):
     return redirect('profiles:profile', username=request.user.username)
@@ -65,6 +136,19 @@ def edit_profile(request, username):
         profile.website = website
         profile.github_url = github_url
         profile.linkedin_url = linkedin_url
+        
+        picture = request.FILES.get('profile_picture')
+        if picture:
+            if picture.size > MAX_PICTURE_SIZE:
+                messages.error(request, 'Profile pictures can be at most 5MB.')
+                return redirect('profiles:edit_profile', username=username)
+            try:
+                # Checks it is an image Pillow can read; resizing happens
+                # later, in process_avatars
+                profile.profile_picture = forms.ImageField().clean(picture)
+            except ValidationError:
+                messages.error(request, 'Upload a valid image for your profile picture.')
+                return redirect('profiles:edit_profile', username=username)
         profile.save()
         
         messages.success(request, 'Profile updated successfully!')
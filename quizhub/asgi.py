@@ -2,15 +2,89 @@
 ASGI config for quizhub project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it (e.g. ``uvicorn quizhub.asgi:application``) for the leaderboard's
+live event stream, which WSGI doesn't stream. Requests served here are
+routed by quizhub.asgi_urls, which answers the busiest JSON endpoints
+with async views.
+
+Django runs each request's sync code, its queries included, on a thread
+of its own. So that a burst of requests doesn't become a burst of threads
+and connections, at most ``ASGI_REQUESTS['MAX_CONCURRENT']`` are handled
+at once per event loop, each on one of as many lanes whose threads, and
+so connections, last from one request to the next; the rest wait in the
+loop, holding neither. Streams hold their connection for as long as a
+page is open while barely using their thread, so they aren't counted.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
+import weakref
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import SyncToAsync, ThreadSensitiveContext
+from django.conf import settings
+from django.core.handlers import asgi
+from django.urls import Resolver404, resolve
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quizhub.settings')
 
-application = get_asgi_application()
+DEFAULTS = {
+    'MAX_CONCURRENT': 32,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'ASGI_REQUESTS', {})}
+
+
+class ASGIRequest(asgi.ASGIRequest):
+    urlconf = 'quizhub.asgi_urls'
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    request_class = ASGIRequest
+
+    def __init__(self):
+        super().__init__()
+        # Event loop -> (semaphore, free lanes), as semaphores can't be
+        # shared between loops
+        self.lanes = weakref.WeakKeyDictionary()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self.is_stream(scope):
+            return await super().__call__(scope, receive, send)
+        loop = asyncio.get_running_loop()
+        if loop not in self.lanes:
+            size = config()['MAX_CONCURRENT']
+            self.lanes[loop] = asyncio.Semaphore(size), [ThreadSensitiveContext() for _ in range(size)]
+        # The semaphore lets waiters in in the order they came, and frees a lane for each
+        slots, free = self.lanes[loop]
+        async with slots:
+            lane = free.pop()
+            # Django's own ThreadSensitiveContext defers to one already set,
+            # so the request's sync code runs on the lane's thread, which
+            # keeps its connections from one request to the next
+            token = SyncToAsync.thread_sensitive_context.set(lane)
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                SyncToAsync.thread_sensitive_context.reset(token)
+                free.append(lane)
+
+    def is_stream(self, scope):
+        # It imports the views, so only once the apps are loaded
+        from .asgi_urls import STREAMING_VIEWS
+
+        try:
+            match = resolve(scope['path'].removeprefix(scope.get('root_path', '')), ASGIRequest.urlconf)
+        except Resolver404:
+            return False
+        return match.view_name in STREAMING_VIEWS
+
+
+# What get_asgi_application() does, with the handler above
+django.setup(set_prefix=False)
+application = ASGIHandler()
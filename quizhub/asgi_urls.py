@@ -0,0 +1,52 @@
+"""
+URL configuration for requests served over ASGI (see quizhub.asgi).
+
+The project's URLs, with the busiest JSON endpoints answered by async
+views. Under WSGI an async view runs in an event loop started for the
+request, which costs more than it saves, so quizhub.urls keeps the sync
+ones. Under ASGI the async views wait for the database without holding a
+thread of their own for the whole request.
+"""
+from django.urls import URLPattern, URLResolver
+
+from accounts import views as accounts_views
+from quizzes import views as quizzes_views
+from social import views as social_views
+
+from . import urls
+
+ASYNC_VIEWS = {
+    'quizzes:submit_quiz': quizzes_views.asubmit_quiz,
+    'social:toggle_upvote': social_views.atoggle_upvote,
+    'social:toggle_follow': social_views.atoggle_follow,
+    'social:add_comment': social_views.aadd_comment,
+    'accounts:user_search': accounts_views.auser_search,
+}
+
+# Views that stream for as long as a page is open (see quizhub.asgi)
+STREAMING_VIEWS = {'quizzes:leaderboard_stream'}
+
+
+def with_views(patterns, views, namespace=''):
+    """
+    Copies of ``patterns`` routing each URL named in ``views`` (by its
+    namespaced name) to the view it maps to, so URLs reverse the same.
+    """
+    swapped = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            prefix = f'{namespace}{pattern.namespace}:' if pattern.namespace else namespace
+            if any(name.startswith(prefix) for name in views):
+                pattern = URLResolver(
+                    pattern.pattern, with_views(pattern.url_patterns, views, prefix),
+                    pattern.default_kwargs, pattern.app_name, pattern.namespace
+                )
+        elif f'{namespace}{pattern.name}' in views:
+            pattern = URLPattern(
+                pattern.pattern, views[f'{namespace}{pattern.name}'], pattern.default_args, pattern.name
+            )
+        swapped.append(pattern)
+    return swapped
+
+
+urlpatterns = with_views(urls.urlpatterns, ASYNC_VIEWS)
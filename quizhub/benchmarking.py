@@ -0,0 +1,136 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks never touch the real database: they run against a throwaway,
+freshly migrated copy created with Django's test database machinery.
+"""
+import json
+import sqlite3
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+PROFILES = ('default', 'production')
+
+
+@contextmanager
+def isolated_database(verbosity=0):
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity)
+
+
+@contextmanager
+def database_profile(profile):
+    """
+    Point new connections to every database at ``profile``: the stock
+    settings (rollback journal, deferred transactions, a connection per
+    request, no write retries) or the production ones from settings.
+    """
+    keys = ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')
+    saved = {alias: {key: connections[alias].settings_dict.get(key) for key in keys} for alias in connections}
+    if profile == 'production':
+        changes = {'OPTIONS': settings.SQLITE_PRODUCTION_OPTIONS, 'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True}
+        retry = {}
+    else:
+        changes = {'OPTIONS': {}, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}
+        retry = {'ATTEMPTS': 1}
+    for alias in connections:
+        connections[alias].settings_dict.update(changes)
+        connections[alias].close()
+        # The journal mode is stored in the database file, so set it either way
+        with connections[alias].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = {}'.format('WAL' if profile == 'production' else 'DELETE'))
+    try:
+        with override_settings(SQLITE_WRITE_RETRY=retry):
+            yield
+    finally:
+        for alias in connections:
+            connections[alias].settings_dict.update(saved[alias])
+            connections[alias].close()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(func, iterations=1):
+    """
+    Call ``func`` ``iterations`` times and return ``(timings_ms, queries)``,
+    where ``queries`` is the fewest statements a single call ran, summed
+    over every configured database. Some calls of a write take an extra
+    statement (an attempt moving its stats to another rank bucket), so the
+    fewest is the count that repeats from one run to the next.
+    """
+    timings = []
+    counts = []
+    counter = QueryCounter()
+    for _ in range(iterations):
+        counter.count = 0
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        counts.append(counter.count)
+    return timings, min(counts, default=0)
+
+
+def calibrate(rounds=5):
+    """
+    Milliseconds this machine takes for a fixed mix of SQLite and Python
+    work like a request's, the median of ``rounds`` runs. Latencies
+    recorded on one machine are scaled by the ratio of two calibrations to
+    be compared on another.
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        with sqlite3.connect(':memory:') as db:
+            db.execute('CREATE TABLE rows (id INTEGER PRIMARY KEY, grp INTEGER, score REAL, label TEXT)')
+            db.executemany(
+                'INSERT INTO rows (grp, score, label) VALUES (?, ?, ?)',
+                ((index % 50, index * 7 % 101, f'row {index}') for index in range(5000))
+            )
+            db.execute('CREATE INDEX rows_grp ON rows (grp, score)')
+            for group in range(50):
+                rows = db.execute(
+                    'SELECT id, score, label FROM rows WHERE grp = ? ORDER BY score DESC LIMIT 20', [group]
+                ).fetchall()
+                json.dumps([{'id': id, 'score': score, 'label': label} for id, score, label in rows])
+            db.execute('SELECT grp, AVG(score) FROM rows GROUP BY grp ORDER BY 2').fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 2)
+
+
+def peak_memory(func):
+    """Peak bytes allocated by Python while running ``func`` once."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class QueryCounter:
+    """An execute wrapper that counts statements without keeping them."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
@@ -0,0 +1,150 @@
+"""
+In-process publish/subscribe for server-sent event streams.
+
+A stream subscribes to topics on the event loop serving it and waits on a
+queue of its own; a publisher, on any thread, encodes an event once and
+hands the same bytes to every subscriber of its topic. Streams waiting on
+their queues hold no thread, database connection or query, so an idle
+viewer costs a queue and a keepalive timer.
+
+Each queue holds at most QUEUE_SIZE events. A client reading slower than
+events arrive (a stalled tab, a slow link) doesn't buffer without bound:
+once its queue is full the backlog is dropped for a single ``resync``
+event, and further events are skipped until it has read that. The client
+then refetches the current state.
+
+The broker is chosen by LIVE_UPDATES['BROKER']. LocalBroker only reaches
+streams served by the process that publishes, which suits a single ASGI
+process; with several, configure a class with the same four methods
+(subscribe, unsubscribe, publish, has_subscribers) that relays events
+between them.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BROKER': 'quizhub.broker.LocalBroker',
+    # Events buffered per client before it is sent a resync instead
+    'QUEUE_SIZE': 100,
+    # Seconds of silence before a stream sends a comment, so proxies keep
+    # the connection open and a closed one is noticed
+    'KEEPALIVE': 15.0,
+    # Milliseconds a browser waits before reconnecting a dropped stream
+    'RETRY': 3000,
+    # Ranks pushed to the leaderboard page (see quizzes.live)
+    'TOP': 20,
+}
+
+KEEPALIVE = b': keepalive\n\n'
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'LIVE_UPDATES', {})}
+
+
+def encode(name, data):
+    """An event in the text/event-stream format."""
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+RESYNC = encode('resync', {})
+
+
+class Subscription:
+    """One stream's queue of encoded events, fed on the loop it was created on."""
+
+    def __init__(self, topics, size):
+        self.topics = topics
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+        self.resyncing = False
+
+    def deliver(self, message):
+        # Runs on self.loop
+        if self.resyncing:
+            return
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.resyncing = True
+            return
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        """The next event, or asyncio.TimeoutError after ``timeout`` seconds without one."""
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        if message is RESYNC:
+            self.resyncing = False
+        return message
+
+
+class LocalBroker:
+    """Delivers events to the streams of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, *topics):
+        """Subscribe the calling stream to ``topics``; call from its event loop."""
+        subscription = Subscription(topics, config()['QUEUE_SIZE'])
+        with self.lock:
+            for topic in topics:
+                self.subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for topic in subscription.topics:
+                subscribers = self.subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscribers[topic]
+
+    def has_subscribers(self, topic):
+        """Cheap enough to ask before computing an event nobody would get."""
+        return bool(self.subscribers.get(topic))
+
+    def publish(self, topic, name, data):
+        """Send event ``name`` with the JSON-serializable ``data``; callable from any thread."""
+        with self.lock:
+            subscriptions = list(self.subscribers.get(topic, ()))
+        if not subscriptions:
+            return
+        message = encode(name, data)
+        by_loop = defaultdict(list)
+        for subscription in subscriptions:
+            by_loop[subscription.loop].append(subscription)
+        # One wakeup per loop rather than per subscriber
+        for loop, batch in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(deliver_all, batch, message)
+            except RuntimeError:
+                # The loop has closed without its streams unsubscribing
+                for subscription in batch:
+                    self.unsubscribe(subscription)
+
+
+def deliver_all(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    """The configured broker, one instance per process."""
+    path = config()['BROKER']
+    with _brokers_lock:
+        if path not in _brokers:
+            _brokers[path] = import_string(path)()
+        return _brokers[path]
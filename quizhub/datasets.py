@@ -0,0 +1,245 @@
+"""
+Row generators for the synthetic load-testing dataset (see the
+``generate_dataset`` management command).
+
+Everything here is plain Python with no Django imports, so chunks can be
+generated in worker processes whatever the multiprocessing start method.
+Every BLOCK rows get their own RNG seeded from (seed, group, block start),
+which keeps the output identical for a given seed whatever the chunk size
+and whether it is generated in one process or many. Timestamps are laid out over the year before the run, so
+week and month leaderboards always have current data. Rows are tuples in
+the field order given by FIELDS.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+SCALES = {
+    'small': {'users': 200, 'quizzes': 20, 'questions': 10, 'attempts': 2_000,
+              'follows': 5, 'upvotes': 3, 'comments': 500},
+    'medium': {'users': 10_000, 'quizzes': 250, 'questions': 10, 'attempts': 100_000,
+               'follows': 10, 'upvotes': 5, 'comments': 20_000},
+    'large': {'users': 500_000, 'quizzes': 5_000, 'questions': 10, 'attempts': 2_000_000,
+              'follows': 20, 'upvotes': 10, 'comments': 1_000_000},
+}
+
+FIELDS = {
+    'accounts.CustomUser': (
+        'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+        'is_staff', 'is_active', 'date_joined', 'is_verified',
+    ),
+    'profiles.UserProfile': (
+        'id', 'user_id', 'bio', 'location', 'website', 'github_url', 'linkedin_url',
+        'total_upvotes', 'followers_count', 'created_at', 'updated_at', 'avatar_hash', 'avatar_pending',
+    ),
+    'quizzes.Quiz': (
+        'id', 'title', 'description', 'language', 'difficulty', 'created_by_id', 'created_at',
+        'updated_at', 'is_active', 'time_limit', 'question_count', 'attempt_count',
+    ),
+    'quizzes.Question': (
+        'id', 'quiz_id', 'question_text', 'option_a', 'option_b', 'option_c', 'option_d',
+        'correct_answer', 'explanation', 'created_at',
+    ),
+    'quizzes.QuizAttempt': (
+        'id', 'user_id', 'quiz_id', 'score', 'total_questions', 'correct_answers', 'time_taken',
+        'completed_at', 'answer_layout_id', 'packed_answers',
+    ),
+    'quizzes.UserAnswer': ('attempt_id', 'question_id', 'selected_answer', 'is_correct'),
+    'social.Follow': ('follower_id', 'following_id', 'created_at'),
+    'social.Upvote': ('upvoter_id', 'upvoted_user_id', 'created_at'),
+    'social.Comment': ('commenter_id', 'profile_owner_id', 'content', 'created_at', 'updated_at', 'is_edited'),
+}
+
+LANGUAGES = ('python', 'javascript', 'java', 'cpp', 'go', 'c', 'php', 'ruby')
+DIFFICULTIES = ('beginner', 'intermediate', 'advanced')
+FIRST_NAMES = ('Ada', 'Alan', 'Grace', 'Linus', 'Guido', 'Barbara', 'Ken', 'Margaret', 'Dennis', 'Radia', '')
+LAST_NAMES = ('Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Rossum', 'Liskov', 'Thompson', 'Hamilton', '')
+LOCATIONS = ('Berlin', 'Bangalore', 'Lagos', 'Lima', 'Seoul', 'Toronto', '', '', '')
+COMMENTS = (
+    'Great work on the leaderboard!',
+    'Thanks for the help with that quiz.',
+    'Your Python scores are impressive.',
+    'Keep it up!',
+    'Nice profile, following you now.',
+)
+SPAN = timedelta(days=365)
+# Rows per RNG stream; chunks are always a whole number of blocks
+BLOCK = 1000
+
+
+class DatasetPlan:
+    """Sizes, seed and id ranges for one generation run; picklable."""
+
+    def __init__(self, seed, users, quizzes, questions, attempts, follows, upvotes, comments,
+                 password, prefix, id_bases, compact=False, layout_ids=None):
+        self.seed = seed
+        self.users = users
+        self.quizzes = quizzes
+        self.questions = questions
+        self.attempts = attempts
+        self.follows = follows
+        self.upvotes = upvotes
+        self.comments = comments
+        self.password = password
+        self.prefix = prefix
+        # First id to use for each model label, so runs can append to a populated database
+        self.id_bases = id_bases
+        self.compact = compact
+        # quiz index -> AnswerLayout id, only needed for compact storage
+        self.layout_ids = layout_ids or {}
+        # Naive UTC, which is how Django stores datetimes with USE_TZ, so
+        # rows can go to the driver without per-value conversion
+        self.end = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+        self.start = self.end - SPAN
+
+    def user_id(self, index):
+        return self.id_bases['accounts.CustomUser'] + index
+
+    def quiz_id(self, index):
+        return self.id_bases['quizzes.Quiz'] + index
+
+    def question_id(self, quiz_index, position):
+        return self.id_bases['quizzes.Question'] + quiz_index * self.questions + position
+
+    def moment(self, index, total):
+        # Spread rows evenly over the span, in id order, so ids and
+        # timestamps increase together as they would in production
+        return self.start + SPAN * (index / max(total, 1))
+
+
+def correct_option(question_id):
+    return 'ABCD'[(question_id * 2654435761 >> 7) & 3]
+
+
+def skewed(rng, n, exponent=3):
+    """An index in range(n) heavily biased towards 0: a few popular, a long tail."""
+    return min(n - 1, int(n * rng.random() ** exponent))
+
+
+def skill(user_index):
+    # Stable per user, so the same user scores consistently across attempts
+    return 0.3 + 0.65 * ((user_index * 2654435761) % 1000) / 1000
+
+
+def generate_users(plan, rng, lo, hi):
+    users, profiles = [], []
+    for index in range(lo, hi):
+        user_id = plan.user_id(index)
+        joined = plan.moment(index, plan.users)
+        users.append((
+            user_id, plan.password, False, f'{plan.prefix}{user_id}',
+            rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f'{plan.prefix}{user_id}@example.com',
+            False, True, joined, rng.random() < 0.3,
+        ))
+        profiles.append((
+            plan.id_bases['profiles.UserProfile'] + index, user_id, '', rng.choice(LOCATIONS),
+            '', '', '', 0, 0, joined, joined, '', False,
+        ))
+    return {'accounts.CustomUser': users, 'profiles.UserProfile': profiles}
+
+
+def generate_quizzes(plan, rng, lo, hi):
+    quizzes, questions = [], []
+    for index in range(lo, hi):
+        quiz_id = plan.quiz_id(index)
+        language = LANGUAGES[skewed(rng, len(LANGUAGES), 2)]
+        created = plan.moment(index, plan.quizzes)
+        quizzes.append((
+            quiz_id, f'{language.title()} quiz #{quiz_id}', 'Generated for load testing.', language,
+            rng.choice(DIFFICULTIES), plan.user_id(skewed(rng, plan.users)), created, created,
+            True, rng.choice((10, 15, 30)), plan.questions, 0,
+        ))
+        for position in range(plan.questions):
+            question_id = plan.question_id(index, position)
+            questions.append((
+                question_id, quiz_id, f'Question {position + 1} of quiz {quiz_id}?',
+                'Option A', 'Option B', 'Option C', 'Option D',
+                correct_option(question_id), '', created,
+            ))
+    return {'quizzes.Quiz': quizzes, 'quizzes.Question': questions}
+
+
+def generate_attempts(plan, rng, lo, hi):
+    attempts, answers = [], []
+    for index in range(lo, hi):
+        attempt_id = plan.id_bases['quizzes.QuizAttempt'] + index
+        user_index = skewed(rng, plan.users, 2)
+        quiz_index = skewed(rng, plan.quizzes)
+        user_skill = skill(user_index)
+        correct_count = 0
+        packed = []
+
+        for position in range(plan.questions):
+            question_id = plan.question_id(quiz_index, position)
+            correct = correct_option(question_id)
+            if rng.random() < user_skill:
+                selected = correct
+            elif rng.random() < 0.1:
+                selected = ''
+            else:
+                selected = rng.choice([option for option in 'ABCD' if option != correct])
+            is_correct = selected == correct
+            correct_count += is_correct
+            if plan.compact:
+                packed.append(selected or '-')
+            else:
+                answers.append((attempt_id, question_id, selected, is_correct))
+
+        score = int(round(correct_count / plan.questions * 100, 2)) if plan.questions else 0
+        attempts.append((
+            attempt_id, plan.user_id(user_index), plan.quiz_id(quiz_index), score, plan.questions,
+            correct_count, timedelta(seconds=rng.randint(60, 1800)), plan.moment(index, plan.attempts),
+            plan.layout_ids.get(quiz_index) if plan.compact else None, ''.join(packed),
+        ))
+    return {'quizzes.QuizAttempt': attempts, 'quizzes.UserAnswer': answers}
+
+
+def generate_social(plan, rng, lo, hi):
+    follows, upvotes, comments = [], [], []
+    comment_rate = plan.comments / max(plan.users, 1)
+
+    for index in range(lo, hi):
+        user_id = plan.user_id(index)
+        joined = plan.moment(index, plan.users)
+        # Out-degree follows an exponential spread, targets favour popular users
+        for rows, average in ((follows, plan.follows), (upvotes, plan.upvotes)):
+            targets = set()
+            for _ in range(min(int(rng.expovariate(1 / average)) if average else 0, plan.users - 1)):
+                target = skewed(rng, plan.users)
+                if target != index:
+                    targets.add(target)
+            for target in sorted(targets):
+                rows.append((user_id, plan.user_id(target), joined + (plan.end - joined) * rng.random()))
+
+        for _ in range(int(rng.expovariate(1 / comment_rate)) if comment_rate else 0):
+            created = joined + (plan.end - joined) * rng.random()
+            comments.append((
+                user_id, plan.user_id(skewed(rng, plan.users)), rng.choice(COMMENTS),
+                created, created, False,
+            ))
+    return {'social.Follow': follows, 'social.Upvote': upvotes, 'social.Comment': comments}
+
+
+GROUPS = {
+    'users': (generate_users, 'users'),
+    'quizzes': (generate_quizzes, 'quizzes'),
+    'attempts': (generate_attempts, 'attempts'),
+    'social': (generate_social, 'users'),
+}
+
+
+def chunks(plan, group, chunk_size):
+    """The (plan, group, lo, hi) work items for one group."""
+    total = getattr(plan, GROUPS[group][1])
+    chunk_size = max(BLOCK, chunk_size - chunk_size % BLOCK)
+    return [(plan, group, lo, min(lo + chunk_size, total)) for lo in range(0, total, chunk_size)]
+
+
+def generate_chunk(work):
+    plan, group, lo, hi = work
+    generate = GROUPS[group][0]
+    rows = {}
+    for start in range(lo, hi, BLOCK):
+        rng = random.Random(f'{plan.seed}:{group}:{start}')
+        for label, block in generate(plan, rng, start, min(start + BLOCK, hi)).items():
+            rows.setdefault(label, []).extend(block)
+    return rows
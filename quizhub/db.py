@@ -0,0 +1,98 @@
+"""
+Retrying writes that lose the race for SQLite's write lock.
+
+SQLite allows one writer at a time. With the production profile a writer
+waits up to ``busy_timeout`` for the lock, but a long burst can still end
+in "database is locked", and a deferred transaction that read before
+writing fails at once rather than wait. retry_on_locked re-runs the whole
+write after a short, growing, jittered pause.
+
+Only outermost transactions are retried: inside an enclosing atomic block
+the failed statement has already broken the outer transaction, so the
+error is left for its owner.
+
+Async views run their transactions, which the async ORM can't, through
+awrite; it lets one at a time per database out of each event loop.
+Every request served over ASGI has a thread and a connection of its
+own, so a burst of them would otherwise all wait on SQLite's lock at
+once, polling it until busy_timeout runs out; queued in the loop
+instead, they find the lock free. Single statements go straight through
+the async ORM.
+"""
+import asyncio
+import functools
+import json
+import logging
+import random
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+logger = logging.getLogger('quizhub.db')
+
+DEFAULTS = {
+    # Total tries, including the first
+    'ATTEMPTS': 5,
+    # Seconds before the first retry; doubles on each one, up to MAX_DELAY
+    'BASE_DELAY': 0.05,
+    'MAX_DELAY': 1.0,
+}
+
+# Event loop -> {alias: lock}, as asyncio locks can't be shared between loops
+write_locks = weakref.WeakKeyDictionary()
+
+LOCKED_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def is_locked_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc) for message in LOCKED_MESSAGES)
+
+
+def retry_on_locked(func=None, using=DEFAULT_DB_ALIAS):
+    """
+    Decorate a function that writes in its own transaction to retry it on
+    lock errors. ``using`` is the transaction's database alias, or a
+    function returning it when that is only known at call time.
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        config = {**DEFAULTS, **getattr(settings, 'SQLITE_WRITE_RETRY', {})}
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if (
+                    not is_locked_error(exc)
+                    or attempt >= config['ATTEMPTS']
+                    or connections[using() if callable(using) else using].in_atomic_block
+                ):
+                    raise
+                delay = min(config['MAX_DELAY'], config['BASE_DELAY'] * 2 ** (attempt - 1))
+                logger.info(json.dumps({
+                    'event': 'write_retry', 'function': func.__qualname__, 'attempt': attempt, 'max_delay': delay,
+                }))
+                # Full jitter, so writers that collided don't collide again
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+
+    return wrapper
+
+
+async def awrite(func, *args, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Run ``func``, a sync function that writes, from async code once the
+    writes to the same database already started in this event loop have
+    finished. ``using`` is the database's alias, or a function returning
+    it, as for retry_on_locked.
+    """
+    alias = using() if callable(using) else using
+    locks = write_locks.setdefault(asyncio.get_running_loop(), {})
+    async with locks.setdefault(alias, asyncio.Lock()):
+        return await sync_to_async(func)(*args, **kwargs)
@@ -0,0 +1,251 @@
+"""
+Per-request database instrumentation and replica routing.
+
+QueryInstrumentationMiddleware counts the statements a request runs, per
+database alias, the time spent in them and how often the same statement
+repeats, which is how N+1 patterns show up (one query per row of a
+template loop). Results are written as one JSON log line on the
+``quizhub.queries`` logger: a warning when a statement repeats
+DUPLICATE_THRESHOLD times or more, at DEBUG level otherwise, so only
+flagged requests show at the default INFO level. They are also added as
+response headers when DEBUG is on or the user is staff, as they tell any
+client how a page queries the database. Requests are sampled, 1% by default, so the middleware can stay
+on in production; unsampled requests pay for a single random() call.
+
+ReplicaRoutingMiddleware serves read-only requests from the read replicas
+(see quizhub.routers).
+
+Both run natively under ASGI as well, so an async view isn't handed to a
+thread for the length of the request. Async code runs its queries on the
+thread sync_to_async gives the request, which has connections of its own,
+so that is where the async path installs its execute wrappers.
+"""
+import json
+import logging
+import math
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import auser, get_user
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from .routers import areplica_reads, current_replica, primary_reads, read_replicas, replica_reads
+
+logger = logging.getLogger('quizhub.queries')
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Fraction of requests to instrument
+    'SAMPLE_RATE': 0.01,
+    # Send the results as headers, in DEBUG or to staff users only
+    'HEADERS': True,
+    # Flag a request when one statement repeats at least this many times
+    'DUPLICATE_THRESHOLD': 5,
+}
+
+# "IN (%s, %s, %s)" and "IN (%s)" are the same query for duplicate detection
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def fingerprint(sql):
+    return _PLACEHOLDER_LIST.sub('%s', sql)
+
+
+class QueryStats:
+    """An execute wrapper that tallies the statements of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.by_alias = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+            self.by_alias[context['connection'].alias] += 1
+
+    def repeated(self):
+        """Statements run more than once, as (fingerprint, count), most repeated first."""
+        fingerprints = Counter()
+        for sql, count in self.statements.items():
+            fingerprints[fingerprint(sql)] += count
+        return [(sql, count) for sql, count in fingerprints.most_common() if count > 1]
+
+
+def watch_queries(stack, stats):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(stats))
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = {**DEFAULTS, **getattr(settings, 'QUERY_INSTRUMENTATION', {})}
+        if not self.config['ENABLED'] or self.config['SAMPLE_RATE'] <= 0:
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.config['SAMPLE_RATE']:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            watch_queries(stack, stats)
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        headers = self.config['HEADERS'] and (
+            settings.DEBUG or (hasattr(request, 'user') and request.user.is_staff)
+        )
+        return self.report(request, response, stats, elapsed, headers)
+
+    async def __acall__(self, request):
+        if random.random() >= self.config['SAMPLE_RATE']:
+            return await self.get_response(request)
+
+        stats = QueryStats()
+        start = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(watch_queries)(stack, stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        elapsed = time.perf_counter() - start
+        headers = self.config['HEADERS'] and (
+            settings.DEBUG or (hasattr(request, 'auser') and (await request.auser()).is_staff)
+        )
+        return self.report(request, response, stats, elapsed, headers)
+
+    def report(self, request, response, stats, elapsed, headers):
+        repeated = stats.repeated()
+        duplicates = sum(count - 1 for _, count in repeated)
+        if headers:
+            response['X-DB-Query-Count'] = str(stats.count)
+            response['X-DB-Query-Time-Ms'] = f'{stats.duration * 1000:.2f}'
+            response['X-DB-Duplicate-Queries'] = str(duplicates)
+            response['X-DB-Queries-By-Alias'] = ','.join(
+                f'{alias}={count}' for alias, count in sorted(stats.by_alias.items())
+            )
+
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': stats.count,
+            'queries_by_alias': dict(stats.by_alias),
+            'sql_ms': round(stats.duration * 1000, 2),
+            'duplicates': duplicates,
+            'duration_ms': round(elapsed * 1000, 2),
+        }
+        if repeated and repeated[0][1] >= self.config['DUPLICATE_THRESHOLD']:
+            sql, count = repeated[0]
+            record['repeated_query'] = {'sql': sql[:300], 'count': count}
+            logger.warning(json.dumps(record))
+        else:
+            logger.debug(json.dumps(record))
+        return response
+
+
+PIN_COOKIE = 'quizhub_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve safe requests from a read replica. A client that writes, with an
+    unsafe method or a write during a safe one, gets a cookie pinning its
+    reads to the primary for REPLICA_PIN_SECONDS, so it reads its own
+    writes while the replicas catch up. The signed-in user is still read
+    from the primary, so a lagging replica can't sign anyone out.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not read_replicas():
+            raise MiddlewareNotUsed
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            wrote = True
+        elif self.pinned(request):
+            response = self.get_response(request)
+            wrote = False
+        else:
+            read_user_from_primary(request)
+            with replica_reads():
+                response = self.get_response(request)
+                wrote = current_replica() is None
+        return self.pin(response) if wrote else response
+
+    async def __acall__(self, request):
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            wrote = True
+        elif self.pinned(request):
+            response = await self.get_response(request)
+            wrote = False
+        else:
+            read_user_from_primary(request)
+            async with areplica_reads():
+                response = await self.get_response(request)
+                wrote = current_replica() is None
+        return self.pin(response) if wrote else response
+
+    def pin(self, response):
+        response.set_cookie(
+            PIN_COOKIE, f'{time.time() + self.pin_seconds:.3f}',
+            max_age=math.ceil(self.pin_seconds), httponly=True, samesite='Lax'
+        )
+        return response
+
+    def pinned(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+
+def read_user_from_primary(request):
+    """Keep AuthenticationMiddleware's lazy user, but load it from the primary."""
+    def load():
+        with primary_reads():
+            return get_user(request)
+
+    async def aload():
+        with primary_reads():
+            return await auser(request)
+
+    request.user = SimpleLazyObject(load)
+    request.auser = aload
@@ -0,0 +1,88 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of LIMIT/OFFSET plus a COUNT, each page continues strictly after
+the last row of the previous one, ordered newest first by a timestamp with
+the primary key as tie-breaker. With an index on (filter column,
+timestamp, id) every page is a single index range scan, however deep.
+Cursors are opaque URL-safe strings encoding the last row's sort values.
+
+A table split over several databases (see quizhub.routers) is paged by
+running the same page query on each and merging the results, which stays
+correct as long as primary keys are unique across them.
+"""
+import base64
+import heapq
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(values):
+    # Full isoformat: DjangoJSONEncoder would round datetimes to milliseconds
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def keyset_page(queryset, cursor=None, per_page=10, fields=('created_at', 'id'), databases=None):
+    """
+    Return the page of ``queryset`` after ``cursor``, newest first by
+    ``fields``, merged from each of ``databases`` if given. Raises
+    InvalidCursor for a cursor that can't be decoded.
+    """
+    timestamp, pk = fields
+    if cursor:
+        after_timestamp, after_pk = decode_cursor(cursor, queryset.model, fields)
+        queryset = queryset.filter(
+            Q(**{f'{timestamp}__lt': after_timestamp})
+            | Q(**{timestamp: after_timestamp, f'{pk}__lt': after_pk})
+        )
+    # One extra row tells us whether there is a next page without a COUNT
+    queryset = queryset.order_by(f'-{timestamp}', f'-{pk}')
+    if databases and len(databases) > 1:
+        items = list(heapq.merge(
+            *[list(queryset.using(alias)[:per_page + 1]) for alias in databases],
+            key=lambda item: (getattr(item, timestamp), getattr(item, pk)), reverse=True
+        ))[:per_page + 1]
+    else:
+        items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, timestamp), getattr(last, pk)])
+    return KeysetPage(items, next_cursor)
@@ -0,0 +1,254 @@
+"""
+Database routing: quiz attempt data, and read replicas.
+
+QuizAttempt and UserAnswer are the write-heavy tables: every submission
+inserts into them. With an ``attempts`` database configured they live in
+their own SQLite file, so a submission only waits for other submissions
+and not for profile edits, toggles or quiz authoring on the main file.
+Everything else stays on ``default``.
+
+Older attempts can be moved further into archive databases, listed
+newest first in ``ATTEMPT_ARCHIVES`` (see ``manage.py move_attempt_data``).
+New attempts are always written to the current attempts database; reads
+that need a user's or a quiz's whole history fan out over
+attempt_databases().
+
+No database can join across files, so code reading attempts together
+with users or quizzes goes through join_or_prefetch(), and the foreign
+keys from attempt tables have no database constraint. The attempt tables
+are also created on ``default``, where they hold the rows from before the
+split until they are moved.
+
+Read-only requests can be served from replicas of ``default`` listed in
+``READ_REPLICAS``. Replica reads are opt-in per context: the request
+middleware enables them with replica_reads() for safe requests from
+clients that haven't written recently, and everything else, management
+commands included, reads the primary. The first write in a context
+switches its remaining reads back to the primary, so a request always
+reads its own writes.
+"""
+import heapq
+import random
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models import Max
+
+ATTEMPTS_DATABASE = 'attempts'
+ATTEMPT_MODELS = {('quizzes', 'quizattempt'), ('quizzes', 'useranswer')}
+
+
+def is_attempt_model(model):
+    return (model._meta.app_label, model._meta.model_name) in ATTEMPT_MODELS
+
+
+def attempts_database():
+    """The alias new attempts are written to."""
+    return ATTEMPTS_DATABASE if ATTEMPTS_DATABASE in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def attempt_databases():
+    """Every alias holding attempts: the current one, then the archives, newest first."""
+    return [attempts_database(), *getattr(settings, 'ATTEMPT_ARCHIVES', [])]
+
+
+def join_or_prefetch(queryset, *fields):
+    """
+    Load the related objects in ``fields`` with a join when they share the
+    queryset's database and with a separate query when they don't.
+    """
+    joined, prefetched = [], []
+    for name in fields:
+        related = queryset.model._meta.get_field(name).related_model
+        (joined if router.db_for_read(related) == queryset.db else prefetched).append(name)
+    if joined:
+        queryset = queryset.select_related(*joined)
+    if prefetched:
+        queryset = queryset.prefetch_related(*prefetched)
+    return queryset
+
+
+def newest_attempts(queryset, limit, fields=('completed_at', 'id')):
+    """
+    The ``limit`` newest rows of an attempt ``queryset`` across every
+    attempt database: the newest ``limit`` from each, merged.
+    """
+    ordering = [f'-{name}' for name in fields]
+    if len(attempt_databases()) == 1:
+        return list(queryset.order_by(*ordering)[:limit])
+    key = lambda attempt: tuple(getattr(attempt, name) for name in fields)
+    return list(heapq.merge(
+        *[list(queryset.using(alias).order_by(*ordering)[:limit]) for alias in attempt_databases()],
+        key=key, reverse=True
+    ))[:limit]
+
+
+def find_attempt(queryset, **lookup):
+    """Fetch one attempt from whichever attempt database has it, or None."""
+    for alias in attempt_databases():
+        attempt = queryset.using(alias).filter(**lookup).first()
+        if attempt is not None:
+            return attempt
+    return None
+
+
+def seed_attempt_ids(using):
+    """
+    Move the attempt id sequences of ``using`` past every id taken in the
+    other attempt databases, ``default`` included. Attempts keep their ids
+    when moved between databases, so ids must be unique across all of them.
+    """
+    connection = connections[using]
+    for app_label, model_name in sorted(ATTEMPT_MODELS):
+        model = apps.get_model(app_label, model_name)
+        table = model._meta.db_table
+        taken = max((
+            model._base_manager.using(alias).aggregate(max_id=Max('id'))['max_id'] or 0
+            for alias in {DEFAULT_DB_ALIAS, *attempt_databases()}
+            if table in connections[alias].introspection.table_names()
+        ), default=0)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 '
+                    'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                    [table, table]
+                )
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s', [taken, table, taken])
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    "GREATEST(%s, nextval(pg_get_serial_sequence(%s, 'id'))))",
+                    [table, taken, table]
+                )
+
+
+class AttemptsRouter:
+    """Send attempt models to the attempt databases and every other model to ``default``."""
+
+    def db_for_read(self, model, **hints):
+        if not is_attempt_model(model):
+            return DEFAULT_DB_ALIAS
+        # Follow an archived attempt to its answers
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in attempt_databases():
+            return instance._state.db
+        return attempts_database()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db != DEFAULT_DB_ALIAS and db in attempt_databases():
+            return (app_label, model_name) in ATTEMPT_MODELS
+        return None
+
+
+# Always read from the primary: a session written on login must be found
+# on the next request, however far behind the replica is
+PRIMARY_ONLY_APPS = {'sessions'}
+
+_replica = ContextVar('quizhub_replica', default=None)
+
+
+def read_replicas():
+    return getattr(settings, 'READ_REPLICAS', [])
+
+
+@contextmanager
+def replica_reads(alias=None):
+    """
+    Read main-database models from ``alias``, or a randomly chosen replica,
+    until the block exits or something is written.
+    """
+    token = _replica.set(choose_replica(alias))
+    try:
+        with ExitStack() as stack:
+            note_writes(stack)
+            yield
+    finally:
+        _replica.reset(token)
+
+
+@asynccontextmanager
+async def areplica_reads(alias=None):
+    """
+    replica_reads() for async code. Its queries run on the thread
+    sync_to_async gives the request, which has connections of its own, so
+    writes are watched for there.
+    """
+    token = _replica.set(choose_replica(alias))
+    stack = ExitStack()
+    try:
+        await sync_to_async(note_writes)(stack)
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+        _replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary within the block, even inside replica_reads()."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def choose_replica(alias=None):
+    replicas = read_replicas()
+    return alias or (random.choice(replicas) if replicas else None)
+
+
+def note_writes(stack):
+    """Watch this thread's connections to the primary databases for writes until ``stack`` closes."""
+    replicas = read_replicas()
+    for name in connections:
+        if name not in replicas:
+            stack.enter_context(connections[name].execute_wrapper(_note_write))
+
+
+def _note_write(execute, sql, params, many, context):
+    # Read your own writes for the rest of the context
+    if sql.lstrip()[:6].upper() != 'SELECT':
+        _replica.set(None)
+    return execute(sql, params, many, context)
+
+
+def current_replica():
+    """The replica reads go to in this context, or None for the primary."""
+    return _replica.get()
+
+
+class ReplicaRouter:
+    """
+    Send reads to the context's replica (see replica_reads), deferring to
+    the next router for everything else.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if (
+            alias is None
+            # Attempts are only replicated while they live on the main database
+            or (is_attempt_model(model) and attempts_database() != DEFAULT_DB_ALIAS)
+            or model._meta.app_label in PRIMARY_ONLY_APPS
+            # Reads inside a transaction on the primary belong to it
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return None
+        return alias
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary
+        if db in read_replicas():
+            return False
+        return None
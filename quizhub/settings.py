@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,11 +47,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'quizhub.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication, so it can have the signed-in user read from the primary
+    'quizhub.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,9 +86,77 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the default shared-cache in-memory database,
+        # which fails lock waits instantly instead of honouring the busy
+        # timeout, so tests with concurrent writers behave like production
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Quiz attempts and answers in their own SQLite file, so submissions don't
+# queue for the write lock behind every other write (see quizhub.routers).
+# Opt-in: set QUIZHUB_SPLIT_ATTEMPTS=1, run `manage.py migrate --database
+# attempts`, then move the existing rows with `manage.py move_attempt_data`.
+# QUIZHUB_ATTEMPT_ARCHIVES names archive files for older attempts, newest
+# first, e.g. "2024,2023" for attempts_2024.sqlite3 and attempts_2023.sqlite3.
+DATABASE_ROUTERS = ['quizhub.routers.ReplicaRouter', 'quizhub.routers.AttemptsRouter']
+ATTEMPT_ARCHIVES = []
+
+if os.environ.get('QUIZHUB_SPLIT_ATTEMPTS') == '1':
+    for name in ['attempts'] + [
+        f'attempts_{period}' for period in os.environ.get('QUIZHUB_ATTEMPT_ARCHIVES', '').split(',') if period
+    ]:
+        DATABASES[name] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'{name}.sqlite3',
+            'TEST': {'NAME': BASE_DIR / f'test_{name}.sqlite3'},
+        }
+        if name != 'attempts':
+            ATTEMPT_ARCHIVES.append(name)
+
+# Read replicas of the main database for safe requests (see
+# quizhub.routers.ReplicaRouter). QUIZHUB_READ_REPLICAS=2 adds replica_1 and
+# replica_2, SQLite copies refreshed by `manage.py snapshot_replicas`; tests
+# read the main database through them. After writing, a client reads the
+# primary for REPLICA_PIN_SECONDS, which should cover the replicas' lag.
+READ_REPLICAS = []
+REPLICA_PIN_SECONDS = 10
+
+for index in range(1, int(os.environ.get('QUIZHUB_READ_REPLICAS', '0')) + 1):
+    READ_REPLICAS.append(f'replica_{index}')
+    DATABASES[f'replica_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'replica_{index}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# SQLite tuned for concurrent requests. WAL lets reads proceed while a write
+# commits; synchronous=NORMAL is durable in WAL mode short of power loss;
+# IMMEDIATE transactions take the write lock up front and wait busy_timeout
+# ms for it instead of failing on a read-to-write upgrade. WAL is a property
+# of the database file, so this is opt-in: set QUIZHUB_DATABASE_PROFILE=production.
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRODUCTION_OPTIONS = {
+    'init_command': ''.join(f'PRAGMA {name} = {value};' for name, value in SQLITE_PRODUCTION_PRAGMAS.items()),
+    'transaction_mode': 'IMMEDIATE',
+}
+
+if os.environ.get('QUIZHUB_DATABASE_PROFILE') == 'production':
+    for database in DATABASES.values():
+        database.update({
+            'OPTIONS': SQLITE_PRODUCTION_OPTIONS,
+            # Reuse connections across requests, checking them before reuse
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -152,3 +224,125 @@ MESSAGE_TAGS = {
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Number of compiled quiz answer keys kept in memory per process
+ANSWER_KEY_CACHE_SIZE = 512
+
+# Store each attempt's selections packed onto the QuizAttempt row instead of
+# one UserAnswer row per question (see quizzes.grading)
+COMPACT_ANSWER_STORAGE = False
+
+# Per-request query counts, SQL time and N+1 detection (see quizhub.middleware).
+# Every request is sampled in DEBUG, 1% otherwise; flagged requests are logged
+# as warnings, the rest at DEBUG level (set quizhub.queries to DEBUG below to
+# see them). The X-DB-* headers are only sent in DEBUG or to staff users.
+QUERY_INSTRUMENTATION = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0 if DEBUG else 0.01,
+    'HEADERS': True,
+    'DUPLICATE_THRESHOLD': 5,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'quizhub.queries': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'quizhub.social': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'quizhub.db': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'quizhub.avatars': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Per-process memory cache. Profile stats are invalidated through it, so run
+# a shared backend (Redis, Memcached) once there is more than one process.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a user's cached profile stats live; writes invalidate them sooner
+PROFILE_STATS_CACHE_TIMEOUT = 3600
+
+# Seconds a user search's results are cached, shared by everyone typing
+# the same prefix; renames show up in search once they expire
+USER_SEARCH_CACHE_TIMEOUT = 30
+
+# Queue follow/upvote toggles in a local SQLite file and apply them in batches
+# with `manage.py flush_social_writes` (see social.writebehind). Only useful
+# when a flusher is running; the file is shared by processes on one host.
+SOCIAL_WRITE_BEHIND = {
+    'ENABLED': False,
+    'PATH': BASE_DIR / 'social_queue.sqlite3',
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 1000,
+}
+
+# Activity feeds (see social.feed): events are copied into the timelines of
+# up to FANOUT_LIMIT followers, each capped near TIMELINE_LENGTH entries;
+# accounts with more followers are read from on demand.
+SOCIAL_FEED = {
+    'TIMELINE_LENGTH': 500,
+    'FANOUT_LIMIT': 2000,
+    'TRIM_EVERY': 20,
+    'BACKFILL': 50,
+}
+
+# Profile picture variants, rendered by `manage.py process_avatars` (see
+# profiles.avatars). Variants are named by content hash: serve
+# MEDIA_URL/avatars/ with "Cache-Control: public, max-age=31536000, immutable".
+AVATARS = {
+    'SIZES': (80, 120, 160, 240, 360),
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+    'POLL_INTERVAL': 2.0,
+    'BATCH_SIZE': 50,
+}
+
+# Live leaderboard events (see quizhub.broker and quizzes.live), streamed by
+# /leaderboard/stream/ when served over ASGI. LocalBroker only reaches the
+# streams of the publishing process: run one ASGI process, or configure a
+# broker relaying between them.
+LIVE_UPDATES = {
+    'BROKER': 'quizhub.broker.LocalBroker',
+    'QUEUE_SIZE': 100,
+    'KEEPALIVE': 15.0,
+    'RETRY': 3000,
+    'TOP': 20,
+}
+
+# Requests quizhub.asgi handles at once per event loop, each on one of as
+# many reused threads; the rest wait in the loop. Leaderboard streams
+# aren't counted.
+ASGI_REQUESTS = {
+    'MAX_CONCURRENT': 32,
+}
+
+# Retries of writes that hit "database is locked" (see quizhub.db.retry_on_locked)
+SQLITE_WRITE_RETRY = {
+    'ATTEMPTS': 5,
+    'BASE_DELAY': 0.05,
+    'MAX_DELAY': 1.0,
+}
@@ -0,0 +1,210 @@
+import json
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from quizzes.models import Quiz
+
+from .db import retry_on_locked
+from .middleware import PIN_COOKIE, QueryInstrumentationMiddleware
+from .routers import current_replica, replica_reads
+
+User = get_user_model()
+
+
+class Queries:
+    """The statements each database ran within the block."""
+
+    def __init__(self, *aliases):
+        self.contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in aliases}
+
+    def __enter__(self):
+        for context in self.contexts.values():
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for context in self.contexts.values():
+            context.__exit__(*exc_info)
+
+    def sql(self, alias):
+        return ' '.join(query['sql'] for query in self.contexts[alias].captured_queries)
+
+    def count(self, alias):
+        return len(self.contexts[alias].captured_queries)
+
+
+@skipUnless(settings.READ_REPLICAS, 'needs QUIZHUB_READ_REPLICAS set')
+class ReplicaRoutingTests(TransactionTestCase):
+    """Reads from a replica mirroring the main test database."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.replica = settings.READ_REPLICAS[0]
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='secret')
+        Quiz.objects.create(title='Loops', language='python', created_by=self.user)
+
+    def get(self, path='/'):
+        with Queries(DEFAULT_DB_ALIAS, self.replica) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    def test_safe_requests_read_a_replica(self):
+        response, queries = self.get()
+
+        self.assertIn('quizzes_quiz', queries.sql(self.replica))
+        self.assertEqual(queries.count(DEFAULT_DB_ALIAS), 0)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.client.force_login(self.user)
+
+        response = self.client.post(f'/social/upvote/{other.username}/')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # Read your writes: the upvote is read back from the primary
+        response, queries = self.get(f'/profiles/profile/{other.username}/')
+        self.assertEqual(queries.count(self.replica), 0)
+        self.assertTrue(response.context['has_upvoted'])
+
+    def test_a_write_during_a_safe_request_pins(self):
+        with replica_reads(self.replica):
+            self.assertEqual(router.db_for_read(Quiz), self.replica)
+            Quiz.objects.filter(pk=0).update(title='Nothing')
+            self.assertIsNone(current_replica())
+            self.assertEqual(router.db_for_read(Quiz), DEFAULT_DB_ALIAS)
+
+    def test_sessions_and_the_signed_in_user_come_from_the_primary(self):
+        self.client.force_login(self.user)
+
+        response, queries = self.get()
+
+        self.assertEqual(response.context['user'], self.user)
+        self.assertIn('django_session', queries.sql(DEFAULT_DB_ALIAS))
+        self.assertIn('accounts_customuser', queries.sql(DEFAULT_DB_ALIAS))
+        self.assertNotIn('django_session', queries.sql(self.replica))
+        self.assertIn('quizzes_quiz', queries.sql(self.replica))
+
+
+@override_settings(QUERY_INSTRUMENTATION={'SAMPLE_RATE': 0.25, 'DUPLICATE_THRESHOLD': 3})
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='secret', is_staff=True
+        )
+
+    def request(self, user=None, lookups=1, sample=0.1):
+        """Run a view looking a user up ``lookups`` times, with random() returning ``sample``."""
+        def view(request):
+            for _ in range(lookups):
+                User.objects.filter(pk=self.staff.pk).exists()
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.user = user or self.staff
+        with mock.patch('quizhub.middleware.random.random', return_value=sample):
+            return QueryInstrumentationMiddleware(view)(request)
+
+    def test_requests_are_sampled(self):
+        with self.assertNoLogs('quizhub.queries'):
+            response = self.request(sample=0.25)
+        self.assertNotIn('X-DB-Query-Count', response)
+
+        with self.assertLogs('quizhub.queries', 'DEBUG') as logs:
+            response = self.request(sample=0.2)
+        self.assertEqual(response['X-DB-Query-Count'], '1')
+        self.assertEqual(response['X-DB-Queries-By-Alias'], 'default=1')
+        self.assertEqual([record.levelname for record in logs.records], ['DEBUG'])
+
+    @override_settings(QUERY_INSTRUMENTATION={'SAMPLE_RATE': 0})
+    def test_a_zero_sample_rate_leaves_the_middleware_out(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInstrumentationMiddleware(HttpResponse)
+
+    def test_only_staff_get_the_headers(self):
+        for user in (User(username='member'), AnonymousUser()):
+            with self.assertLogs('quizhub.queries', 'DEBUG'):
+                response = self.request(user)
+            self.assertFalse([header for header in response.headers if header.startswith('X-DB-')])
+
+    def test_repeated_statements_are_flagged(self):
+        with self.assertLogs('quizhub.queries', 'DEBUG') as logs:
+            response = self.request(lookups=2)
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '1')
+        self.assertEqual(logs.records[0].levelname, 'DEBUG')
+
+        with self.assertLogs('quizhub.queries', 'DEBUG') as logs:
+            response = self.request(lookups=3)
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '2')
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['repeated_query']['count'], 3)
+        self.assertIn('accounts_customuser', record['repeated_query']['sql'])
+
+
+class NoReplicaTests(TestCase):
+    @override_settings(READ_REPLICAS=[])
+    def test_reads_fall_back_to_the_primary(self):
+        with replica_reads():
+            self.assertIsNone(current_replica())
+            self.assertEqual(router.db_for_read(Quiz), DEFAULT_DB_ALIAS)
+
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+
+
+@override_settings(SQLITE_WRITE_RETRY={'ATTEMPTS': 3, 'BASE_DELAY': 0, 'MAX_DELAY': 0})
+class RetryOnLockedTests(TransactionTestCase):
+    def failing(self, *errors):
+        """A write raising each of ``errors`` in turn, then returning 'written'."""
+        calls = []
+
+        @retry_on_locked
+        def write():
+            calls.append(len(calls) + 1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'written'
+
+        return write, calls
+
+    def test_retries_while_the_database_is_locked(self):
+        write, calls = self.failing(
+            OperationalError('database is locked'), OperationalError('database table is locked')
+        )
+        with self.assertLogs('quizhub.db', 'INFO') as logs:
+            self.assertEqual(write(), 'written')
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual([json.loads(line.split(':', 2)[2])['attempt'] for line in logs.output], [1, 2])
+
+    def test_gives_up_after_the_configured_attempts(self):
+        write, calls = self.failing(*[OperationalError('database is locked')] * 3)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'), self.assertLogs('quizhub.db'):
+            write()
+        self.assertEqual(calls, [1, 2, 3])
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = self.failing(OperationalError('no such table: quizzes_quiz'))
+        with self.assertRaisesMessage(OperationalError, 'no such table'):
+            write()
+        self.assertEqual(calls, [1])
+
+    def test_not_retried_inside_an_enclosing_transaction(self):
+        write, calls = self.failing(OperationalError('database is locked'))
+        with self.assertRaises(OperationalError):
+            with transaction.atomic():
+                write()
+        self.assertEqual(calls, [1])
@@ -1,5 +1,39 @@
 from django.contrib import admin
-from .models import Quiz, Question, QuizAttempt, UserAnswer
+from django.contrib.auth import get_user_model
+from .models import Quiz, Question, QuizAttempt, UserAnswer, UserQuizStats, LeaderboardEntry
+from .grading import attempt_answers
+
+User = get_user_model()
+
+class AttemptDataAdmin(admin.ModelAdmin):
+    """
+    Admin for models that may live in the attempts database (see
+    quizhub.routers), where joins to users, quizzes and questions are
+    impossible: related objects are prefetched, and searches look up the
+    matching ids on the main database first.
+    """
+    list_select_related = ()
+    list_prefetch_related = ()
+    # Key on the model -> (related model, field searched on it)
+    related_search = {}
+    # Related objects matched per search, to keep the IN lists bounded
+    search_match_limit = 1000
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(*self.list_prefetch_related)
+    
+    def get_search_fields(self, request):
+        # Shows the search box; get_search_results does the searching
+        return [f'{key}__{field}' for key, (model, field) in self.related_search.items()]
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        matches = queryset.none()
+        for key, (model, field) in self.related_search.items():
+            ids = model.objects.filter(**{f'{field}__icontains': search_term}).values_list('pk', flat=True)
+            matches |= queryset.filter(**{f'{key}__in': list(ids[:self.search_match_limit])})
+        return matches, False
 
 class QuestionInline(admin.TabularInline):
     model = Question
@@ -32,21 +66,51 @@ class QuestionAdmin(admin.ModelAdmin):
         return form
 
 @admin.register(QuizAttempt)
-class QuizAttemptAdmin(admin.ModelAdmin):
+class QuizAttemptAdmin(AttemptDataAdmin):
     list_display = ('user', 'quiz', 'score', 'correct_answers', 'total_questions', 'completed_at')
-    list_filter = ('quiz__language', 'quiz', 'completed_at')
-    search_fields = ('user__username', 'quiz__title')
-    readonly_fields = ('user', 'quiz', 'score', 'correct_answers', 'total_questions', 'time_taken', 'completed_at')
+    list_filter = ('quiz', 'completed_at')
+    list_prefetch_related = ('user', 'quiz')
+    related_search = {'user': (User, 'username'), 'quiz': (Quiz, 'title')}
+    readonly_fields = ('user', 'quiz', 'score', 'correct_answers', 'total_questions', 'time_taken', 'completed_at', 'answers_review')
+    exclude = ('answer_layout', 'packed_answers')
     
     def has_add_permission(self, request):
         return False  # Prevent manual creation
+    
+    def answers_review(self, obj):
+        # Reads packed and row-stored answers alike
+        return ', '.join(
+            f"Q{answer.question_id}: {answer.selected_answer or '-'} {'✓' if answer.is_correct else '✗'}"
+            for answer in attempt_answers(obj)
+        )
+    answers_review.short_description = 'Answers'
 
 @admin.register(UserAnswer)
-class UserAnswerAdmin(admin.ModelAdmin):
+class UserAnswerAdmin(AttemptDataAdmin):
     list_display = ('attempt', 'question', 'selected_answer', 'is_correct')
     list_filter = ('is_correct', 'selected_answer')
-    search_fields = ('attempt__user__username', 'question__question_text')
+    list_prefetch_related = ('attempt__user', 'attempt__quiz', 'question__quiz')
+    related_search = {'attempt__user': (User, 'username'), 'question': (Question, 'question_text')}
     readonly_fields = ('attempt', 'question', 'selected_answer', 'is_correct')
     
     def has_add_permission(self, request):
         return False  # Prevent manual creation
+
+@admin.register(UserQuizStats)
+class UserQuizStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'attempts', 'average_score', 'best_score', 'last_activity')
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'attempts', 'score_sum', 'best_score', 'average_score', 'last_activity')
+    
+    def has_add_permission(self, request):
+        return False  # Maintained from quiz attempts
+
+@admin.register(LeaderboardEntry)
+class LeaderboardEntryAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'user', 'attempts', 'average_score', 'best_score', 'last_activity')
+    list_filter = ('scope',)
+    search_fields = ('scope', 'user__username')
+    readonly_fields = ('scope', 'user', 'attempts', 'score_sum', 'best_score', 'average_score', 'last_activity')
+    
+    def has_add_permission(self, request):
+        return False  # Maintained from quiz attempts
@@ -0,0 +1,80 @@
+"""
+In-process cache of compiled answer keys.
+
+Grading and result rendering only need each quiz's questions in order and
+their correct options, which almost never change. A compiled key is cached
+per process under ``(quiz id, version)`` where the version is the quiz's
+``updated_at``; the Question signals in ``quizzes.signals`` bump that
+timestamp, so a stale key is never looked up again by any process, and
+the local copy is dropped eagerly as well.
+
+Questions created with ``bulk_create`` or edited with ``update()`` bypass
+the signals; touch the quiz (or call ``answer_keys.invalidate``) afterwards.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Question
+
+
+class AnswerKey:
+    def __init__(self, quiz_id, version, questions):
+        self.quiz_id = quiz_id
+        self.version = version
+        self.questions = tuple(questions)
+        self.question_ids = tuple(question.id for question in self.questions)
+        self.correct_answers = {question.id: question.correct_answer for question in self.questions}
+        self._questions_by_id = {question.id: question for question in self.questions}
+
+    def __len__(self):
+        return len(self.questions)
+
+    def question(self, question_id):
+        return self._questions_by_id.get(question_id)
+
+
+class AnswerKeyCache:
+    """A small thread-safe LRU of compiled answer keys."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, quiz):
+        cache_key = (quiz.pk, quiz.updated_at)
+        with self._lock:
+            answer_key = self._keys.get(cache_key)
+            if answer_key is not None:
+                self._keys.move_to_end(cache_key)
+                return answer_key
+
+        # Compile outside the lock; a concurrent miss just compiles twice
+        answer_key = AnswerKey(quiz.pk, quiz.updated_at, Question.objects.filter(quiz_id=quiz.pk).order_by('id'))
+
+        with self._lock:
+            # Only one version per quiz is worth keeping
+            for stale in [key for key in self._keys if key[0] == quiz.pk]:
+                del self._keys[stale]
+            self._keys[cache_key] = answer_key
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+        return answer_key
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            for stale in [key for key in self._keys if key[0] == quiz_id]:
+                del self._keys[stale]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+answer_keys = AnswerKeyCache(maxsize=getattr(settings, 'ANSWER_KEY_CACHE_SIZE', 256))
+
+
+def get_answer_key(quiz):
+    return answer_keys.get(quiz)
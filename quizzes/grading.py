@@ -0,0 +1,153 @@
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+from quizhub.db import retry_on_locked
+from quizhub.routers import attempts_database
+
+from .answer_keys import get_answer_key
+from .models import AnswerLayout, QuizAttempt, UserAnswer
+
+VALID_OPTIONS = ('A', 'B', 'C', 'D')
+UNANSWERED = '-'
+
+
+class GradedSubmission:
+    """The result of scoring a submission in memory, before anything is written."""
+
+    def __init__(self, quiz, answer_key, answers, correct_count):
+        self.quiz = quiz
+        self.answer_key = answer_key
+        # List of (question, selected_answer, is_correct) in question order
+        self.answers = answers
+        self.correct_count = correct_count
+
+    @property
+    def total_questions(self):
+        return len(self.answers)
+
+    @property
+    def score_percentage(self):
+        if not self.answers:
+            return 0
+        return round((self.correct_count / self.total_questions) * 100, 2)
+
+    def packed(self):
+        return ''.join(selected_answer or UNANSWERED for _, selected_answer, _ in self.answers)
+
+
+def grade_submission(quiz, answers):
+    """
+    Score a submission against the quiz's cached answer key; the questions
+    table is only read when the key has to be compiled.
+
+    ``answers`` maps question ids (as strings, the way the take-quiz page
+    posts them) to the selected option letter.
+    """
+    answer_key = get_answer_key(quiz)
+    graded = []
+    correct_count = 0
+
+    for question in answer_key.questions:
+        selected_answer = answers.get(str(question.id), '')
+        if selected_answer not in VALID_OPTIONS:
+            selected_answer = ''
+        is_correct = selected_answer == question.correct_answer
+        if is_correct:
+            correct_count += 1
+        graded.append((question, selected_answer, is_correct))
+
+    return GradedSubmission(quiz, answer_key, graded, correct_count)
+
+
+def get_layout_id(answer_key):
+    layout_id = getattr(answer_key, 'layout_id', None)
+    if layout_id is None:
+        layout_id = AnswerLayout.for_questions(answer_key.quiz_id, answer_key.question_ids).id
+        # Only remember the layout on the shared key once it is committed
+        transaction.on_commit(lambda: setattr(answer_key, 'layout_id', layout_id))
+    return layout_id
+
+
+@retry_on_locked(using=attempts_database)
+def record_attempt(user, graded, time_taken_seconds=0, compact=None):
+    """
+    Persist a graded submission inside a single transaction so the write
+    lock is held for as short a time as possible.
+
+    In compact mode (``COMPACT_ANSWER_STORAGE``) the selections are packed
+    onto the attempt row itself; otherwise they are written as UserAnswer
+    rows with one bulk INSERT. The transaction runs on the attempts
+    database (see quizhub.routers), and one that loses the race for the
+    write lock is retried.
+    """
+    if compact is None:
+        compact = getattr(settings, 'COMPACT_ANSWER_STORAGE', False)
+
+    with transaction.atomic(using=attempts_database()):
+        attempt = QuizAttempt.objects.create(
+            user=user,
+            quiz=graded.quiz,
+            score=int(graded.score_percentage),
+            total_questions=graded.total_questions,
+            correct_answers=graded.correct_count,
+            time_taken=timedelta(seconds=time_taken_seconds),
+            answer_layout_id=get_layout_id(graded.answer_key) if compact else None,
+            packed_answers=graded.packed() if compact else ''
+        )
+        if not compact:
+            UserAnswer.objects.bulk_create([
+                UserAnswer(
+                    attempt=attempt,
+                    question=question,
+                    selected_answer=selected_answer,
+                    is_correct=is_correct
+                )
+                for question, selected_answer, is_correct in graded.answers
+            ])
+
+    return attempt
+
+
+@lru_cache(maxsize=1024)
+def layout_question_ids(layout_id):
+    # Layouts never change once written
+    return AnswerLayout.objects.get(pk=layout_id).get_question_ids()
+
+
+def unpack_answers(attempt, answer_key):
+    """
+    Build unsaved UserAnswer objects for a packed attempt. Correctness is
+    derived from the current answer key; questions deleted since the
+    attempt are skipped, as their UserAnswer rows would have been.
+    """
+    answers = []
+    question_ids = layout_question_ids(attempt.answer_layout_id)
+    for question_id, selected_answer in zip(question_ids, attempt.packed_answers):
+        question = answer_key.question(question_id)
+        if question is None:
+            continue
+        if selected_answer == UNANSWERED:
+            selected_answer = ''
+        answers.append(UserAnswer(
+            attempt=attempt,
+            question=question,
+            selected_answer=selected_answer,
+            is_correct=selected_answer == question.correct_answer
+        ))
+    return answers
+
+
+def attempt_answers(attempt, answer_key=None):
+    """An attempt's answers in question order, whichever way they are stored."""
+    answer_key = answer_key or get_answer_key(attempt.quiz)
+    if attempt.answer_layout_id:
+        return unpack_answers(attempt, answer_key)
+
+    # Questions come from the cached answer key instead of a join
+    user_answers = list(attempt.user_answers.order_by('question_id'))
+    for user_answer in user_answers:
+        user_answer.question = answer_key.question(user_answer.question_id)
+    return user_answers
@@ -0,0 +1,39 @@
+from .models import QuizScoreBucket
+
+
+class ScoreDistribution:
+    """A quiz's score histogram, read in one query from its buckets."""
+
+    def __init__(self, counts):
+        # counts[score] is the number of attempts that scored exactly score
+        self.counts = counts
+        self.total = sum(counts)
+
+    @classmethod
+    def for_quiz(cls, quiz):
+        counts = [0] * 101
+        for score, count in QuizScoreBucket.objects.filter(quiz=quiz).values_list('score', 'count'):
+            counts[score] = count
+        return cls(counts)
+
+    def percentile(self, score):
+        """Percentage of attempts that scored strictly lower than ``score``."""
+        if not self.total:
+            return 0
+        return round(sum(self.counts[:int(score)]) / self.total * 100)
+
+    def binned(self, width=10):
+        """Group the one-point buckets into ``width``-point bins; 100 joins the top bin."""
+        bins = []
+        for low in range(0, 100, width):
+            high = min(low + width, 100)
+            top = high + 1 if high == 100 else high
+            bins.append({
+                'min': low,
+                'max': high if high == 100 else high - 1,
+                'count': sum(self.counts[low:top]),
+            })
+        peak = max([b['count'] for b in bins] + [1])
+        for b in bins:
+            b['height'] = round(b['count'] / peak * 100)
+        return bins
@@ -0,0 +1,128 @@
+"""
+Ranked leaderboard queries.
+
+Every board is read from a table kept sorted by its ranking index
+(``UserQuizStats`` for the global board, ``LeaderboardEntry`` for scoped
+ones), so nothing here aggregates attempts. Ranking is by average score,
+then best score, then user id as a stable tie-break. A user's rank comes
+from the board's ``RankBucket`` histogram, and their neighbours are read
+by seeking the ranking index from their own entry, so neither walks the
+entries above them.
+"""
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import GLOBAL_SCOPE, LeaderboardEntry, Quiz, RankBucket, UserQuizStats
+
+WINDOWS = ('week', 'month')
+
+
+def scope_for(language=None, quiz_id=None, window=None, when=None):
+    """Build a scope key; a quiz wins over a language, which wins over a window."""
+    if quiz_id:
+        return f'quiz:{int(quiz_id)}'
+    if language:
+        if language not in dict(Quiz.LANGUAGE_CHOICES):
+            raise ValueError(f'Unknown language: {language}')
+        return f'language:{language}'
+    if window:
+        when = when or timezone.now()
+        if window == 'week':
+            iso_year, iso_week, _ = when.isocalendar()
+            return f'week:{iso_year}-W{iso_week:02d}'
+        if window == 'month':
+            return f'month:{when:%Y-%m}'
+        raise ValueError(f'Unknown window: {window}')
+    return GLOBAL_SCOPE
+
+
+def board(scope):
+    if scope == GLOBAL_SCOPE:
+        return UserQuizStats.objects.all()
+    return LeaderboardEntry.objects.filter(scope=scope)
+
+
+def top(scope, limit=20, offset=0):
+    return list(
+        board(scope).select_related('user').order_by(*UserQuizStats.RANKING)[offset:offset + limit]
+    )
+
+
+def rank_of(scope, user):
+    """Return ``(rank, entry)`` for ``user`` on the board, or ``(None, None)``."""
+    entry = board(scope).select_related('user').filter(user=user).first()
+    if entry is None:
+        return None, None
+    rank, _ = position(scope, entry)
+    return rank, entry
+
+
+def position(scope, entry):
+    """
+    Return ``(rank, size)``: ``entry``'s rank and the number of entries on
+    the board.
+
+    The rank is the number of entries strictly ahead plus one: the counts
+    of the board's higher rank buckets (at most 1000 rows), plus the
+    entries ahead within the entry's own bucket, counted over the slice
+    of the ranking index between the entry and the bucket's upper edge.
+    The cost is bounded by the bucket's size, not by the rank.
+    """
+    bucket = RankBucket.bucket_for(entry.score_sum, entry.attempts)
+    counts = RankBucket.objects.filter(scope=scope).aggregate(
+        above=Sum('count', filter=Q(bucket__gt=bucket)),
+        size=Sum('count')
+    )
+    # Entries of higher buckets average at least this
+    ceiling = (bucket + 1) / RankBucket.PER_POINT
+    average, best = entry.average_score, entry.best_score
+    ahead = board(scope).filter(average_score__gte=average, average_score__lt=ceiling).filter(
+        Q(average_score__gt=average)
+        | Q(best_score__gt=best)
+        | Q(best_score=best, user_id__lt=entry.user_id)
+    ).count()
+    return (counts['above'] or 0) + ahead + 1, counts['size'] or 0
+
+
+def neighbours(scope, entry, limit, ahead):
+    """
+    The ``limit`` entries ranked nearest above (``ahead``) or below
+    ``entry``, in ranking order. Each tier of the ranking key is one
+    seek into the ranking index from ``entry``'s position, read only as
+    far as needed, so no OFFSET walks the entries in between.
+    """
+    entries = board(scope).select_related('user')
+    average, best, user_id = entry.average_score, entry.best_score, entry.user_id
+    if ahead:
+        seeks = [
+            entries.filter(average_score=average, best_score=best, user_id__lt=user_id).order_by('-user_id'),
+            entries.filter(average_score=average, best_score__gt=best).order_by('best_score', '-user_id'),
+            entries.filter(average_score__gt=average).order_by('average_score', 'best_score', '-user_id'),
+        ]
+    else:
+        seeks = [
+            entries.filter(average_score=average, best_score=best, user_id__gt=user_id).order_by('user_id'),
+            entries.filter(average_score=average, best_score__lt=best).order_by(*UserQuizStats.RANKING[1:]),
+            entries.filter(average_score__lt=average).order_by(*UserQuizStats.RANKING),
+        ]
+    found = []
+    for queryset in seeks:
+        if len(found) == limit:
+            break
+        found.extend(queryset[:limit - len(found)])
+    return found[::-1] if ahead else found
+
+
+def around(scope, user, radius=5):
+    """
+    Return ``(rank, offset, entries)`` for the ``radius`` users either side
+    of ``user``; ``offset`` is the number of entries ranked above the window.
+    """
+    entry = board(scope).select_related('user').filter(user=user).first()
+    if entry is None:
+        return None, 0, []
+    rank, size = position(scope, entry)
+    # No seeks past either end of the board
+    above = neighbours(scope, entry, max(0, min(radius, rank - 1)), ahead=True)
+    below = neighbours(scope, entry, max(0, min(radius, size - rank)), ahead=False)
+    return rank, rank - 1 - len(above), [*above, entry, *below]
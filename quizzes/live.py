@@ -0,0 +1,54 @@
+"""
+Live leaderboard updates for the leaderboard page's event stream.
+
+Once an attempt's stats have committed, its user's new standing is pushed
+as a ``rank`` event on each board the attempt counts towards (global, its
+language, its quiz, the week and the month), if they are in the top
+LIVE_UPDATES['TOP'], and a score of HIGH_SCORE or more as a ``score``
+event. A board is only ranked when some stream is watching it, so with no
+viewers this adds no queries to submitting a quiz, and viewers add none
+however many there are.
+"""
+from quizhub.broker import config, get_broker
+
+from . import leaderboards
+from .models import LeaderboardEntry
+
+HIGH_SCORE = 80
+SCORES_TOPIC = 'scores'
+
+
+def board_topic(scope):
+    return f'leaderboard:{scope}'
+
+
+def attempt_recorded(attempt):
+    broker = get_broker()
+    if attempt.score >= HIGH_SCORE and broker.has_subscribers(SCORES_TOPIC):
+        broker.publish(SCORES_TOPIC, 'score', {
+            'username': attempt.user.username,
+            'quiz': attempt.quiz.title,
+            'language': attempt.quiz.get_language_display(),
+            'score': attempt.score,
+            'completed_at': attempt.completed_at.isoformat(),
+        })
+
+    scopes = [
+        leaderboards.GLOBAL_SCOPE,
+        *LeaderboardEntry.scopes_for(attempt.quiz.language, attempt.quiz_id, attempt.completed_at)
+    ]
+    for scope in scopes:
+        topic = board_topic(scope)
+        if not broker.has_subscribers(topic):
+            continue
+        rank, entry = leaderboards.rank_of(scope, attempt.user_id)
+        if rank is None or rank > config()['TOP']:
+            continue
+        broker.publish(topic, 'rank', {
+            'rank': rank,
+            'username': attempt.user.username,
+            'name': attempt.user.get_full_name(),
+            'attempts': entry.attempts,
+            'average_score': round(entry.average_score, 2),
+            'best_score': entry.best_score,
+        })
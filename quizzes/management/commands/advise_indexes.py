@@ -0,0 +1,251 @@
+import re
+from contextlib import ExitStack
+from io import StringIO
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from quizhub.benchmarking import isolated_database
+from quizhub.datasets import SCALES
+
+from .run_benchmarks import Scenario
+
+# Plan steps worth an index: reading a whole table, or sorting rows afterwards.
+# "SCAN t USING INDEX i" walks an index in order and is fine on its own.
+BARE_SCAN = re.compile(r'^SCAN (\w+)$')
+TEMP_SORT = 'TEMP B-TREE'
+
+CLAUSE_END = re.compile(r' (?:GROUP BY|HAVING|ORDER BY|LIMIT) ')
+ORDER_TERM = re.compile(r'^"(\w+)"\."(\w+)"(?: (ASC|DESC))?$')
+
+
+def variants(scenario):
+    """Requests the benchmarks don't make but whose filters need indexes too."""
+    client = scenario.client
+    language = scenario.quiz.language
+    return {
+        'home_view?language': lambda: client.get('/', {'language': language}),
+        'leaderboard?language': lambda: client.get('/leaderboard/', {'language': language}),
+    }
+
+
+def explain(alias, sql, params):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def problems(plan, tables):
+    """The plan steps that scan one of ``tables`` or sort into a temporary B-tree."""
+    found = []
+    for step in plan:
+        scan = BARE_SCAN.match(step)
+        if (scan and scan.group(1) in tables) or TEMP_SORT in step:
+            found.append(step)
+    return found
+
+
+class Proposal:
+    """An index guessed from one query's WHERE and ORDER BY clauses on one table."""
+
+    def __init__(self, model, sql, params):
+        self.model = model
+        self.notes = []
+        self.index = None
+        self.confirmed = False
+
+        table = model._meta.db_table
+        columns = {field.column: field for field in model._meta.concrete_fields}
+        column = rf'"{table}"\."(\w+)"'
+        where, ordering = self.clauses(sql)
+
+        for match in re.finditer(column + r' LIKE %s', where):
+            if str(self.param(sql, where, match, params)).startswith('%'):
+                self.notes.append(f'{match.group(1)} LIKE with a leading wildcard: no B-tree index can serve it')
+        if ' OR ' in where:
+            self.notes.append('OR between conditions: an index per branch at best')
+            return
+
+        equal = re.findall(column + r' (?:= %s|IN \()', where)
+        ranges = re.findall(column + r' (?:<|<=|>|>=) %s', where)
+        # Boolean fields are filtered as bare columns, which no equality
+        # column in an index can match; they make a partial index instead
+        condition = {}
+        for negated, name in re.findall(r'(NOT )?' + column + r'(?=\)| AND |$)', where):
+            if isinstance(columns.get(name), models.BooleanField):
+                condition[columns[name].name] = not negated
+
+        order = []
+        for term in ordering:
+            match = ORDER_TERM.match(term)
+            if not match or match.group(1) != table:
+                # Sorting on another table's columns; an index here can't help
+                order = []
+                break
+            order.append(('-' if match.group(3) == 'DESC' else '') + match.group(2))
+
+        # Equality columns first, then the sort order; a range condition
+        # is only worth a column when nothing is sorted
+        wanted = [*equal, *order] if order else [*equal, *ranges[:1]]
+        if not wanted:
+            return
+        fields = []
+        for name in wanted:
+            prefix, name = ('-', name[1:]) if name.startswith('-') else ('', name)
+            if name not in columns:
+                return
+            field = columns[name].name
+            if not any(existing.lstrip('-') == field for existing in fields):
+                fields.append(prefix + field)
+
+        self.index = models.Index(
+            fields=fields, condition=models.Q(**condition) if condition else None, name='advised_idx'
+        )
+        self.index.set_name_with_model(model)
+        if any(self.same(existing) for existing in model._meta.indexes):
+            self.notes.append(f'{self.describe()} already exists; the planner prefers another plan')
+            self.index = None
+
+    @staticmethod
+    def clauses(sql):
+        start = sql.find(' WHERE ')
+        where = ''
+        if start != -1:
+            rest = sql[start + 7:]
+            end = CLAUSE_END.search(rest)
+            where = rest[:end.start()] if end else rest
+        ordering = []
+        start = sql.rfind(' ORDER BY ')
+        if start != -1:
+            ordering = sql[start + 10:].split(' LIMIT ')[0].split(', ')
+        return where, ordering
+
+    @staticmethod
+    def param(sql, where, match, params):
+        position = sql.find(where) + match.start()
+        index = sql[:position].count('%s')
+        return params[index] if index < len(params) else ''
+
+    def same(self, other):
+        return (
+            list(other.fields) == list(self.index.fields)
+            and (other.condition or None) == (self.index.condition or None)
+        )
+
+    def describe(self):
+        if self.index is None:
+            return 'no index'
+        arguments = f'fields={self.index.fields!r}'
+        if self.index.condition:
+            condition = ', '.join(f'{key}={value!r}' for key, value in self.index.condition.children)
+            arguments += f', condition=Q({condition})'
+        return f'{self.model._meta.label}: models.Index({arguments})'
+
+
+class Command(BaseCommand):
+    help = ('Replay the benchmarked views against a generated dataset, run EXPLAIN QUERY PLAN on '
+            'their queries and propose indexes for the table scans and sorts found')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--views', nargs='+', help='Only replay these views')
+        parser.add_argument('--all', action='store_true', help='Also list the queries whose plans are fine')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            with isolated_database(), override_settings(QUERY_INSTRUMENTATION={'ENABLED': False}):
+                for alias in connections:
+                    if connections[alias].vendor != 'sqlite':
+                        raise CommandError(f'{alias} is not SQLite; the plans read here are SQLite specific.')
+                call_command('generate_dataset', scale=options['scale'], seed=options['seed'], stdout=StringIO())
+                cache.clear()
+                queries = self.capture(options['views'])
+                self.report(queries, options['all'])
+        finally:
+            teardown_test_environment()
+
+    def capture(self, names):
+        """Every distinct SELECT each view runs, keyed by database and SQL, with the views running it."""
+        scenario = Scenario()
+        cases = {**scenario.cases(), **variants(scenario)}
+        unknown = set(names or []) - set(cases)
+        if unknown:
+            raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}")
+
+        queries = {}
+        current = None
+
+        def record(execute, sql, params, many, context):
+            if not many and sql.lstrip()[:6].upper() == 'SELECT':
+                query = queries.setdefault((context['connection'].alias, sql), {'params': params, 'views': []})
+                if current not in query['views']:
+                    query['views'].append(current)
+            return execute(sql, params, many, context)
+
+        for name in names or cases:
+            # Warm up caches first, so the queries a cold cache adds don't mask the steady state
+            cases[name]()
+            current = name
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(record))
+                cases[name]()
+        return queries
+
+    def report(self, queries, show_all):
+        models_by_table = {model._meta.db_table: model for model in apps.get_models()}
+        confirmed = {}
+        flagged = 0
+        for (alias, sql), query in queries.items():
+            plan = explain(alias, sql, query['params'])
+            steps = problems(plan, models_by_table)
+            if not steps and not show_all:
+                continue
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{', '.join(query['views'])} [{alias}]"))
+            self.stdout.write(f'  {sql[:300]}{"..." if len(sql) > 300 else ""}')
+            for step in plan:
+                self.stdout.write(f"    {'!' if step in steps else ' '} {step}")
+            if not steps:
+                continue
+            flagged += 1
+
+            tables = [table for table in re.findall(r'FROM "(\w+)"', sql) if table in models_by_table]
+            scanned = [BARE_SCAN.match(step).group(1) for step in steps if BARE_SCAN.match(step)]
+            # A sort alone is on the table the query selects from
+            for table in dict.fromkeys(scanned or tables[:1]):
+                proposal = Proposal(models_by_table[table], sql, query['params'])
+                if proposal.index is not None:
+                    proposal.confirmed = self.confirm(alias, sql, query['params'], proposal, models_by_table, len(steps))
+                    if proposal.confirmed:
+                        confirmed.setdefault(proposal.describe(), []).extend(query['views'])
+                    status = 'confirmed' if proposal.confirmed else 'not used by the planner'
+                    self.stdout.write(f'    -> {proposal.describe()} ({status})')
+                for note in proposal.notes:
+                    self.stdout.write(f'    -- {note}')
+
+        self.stdout.write('')
+        self.stdout.write(f'{len(queries)} distinct queries, {flagged} with table scans or temporary sorts.')
+        if confirmed:
+            self.stdout.write(self.style.SUCCESS('Indexes that remove them:'))
+            for description, views in confirmed.items():
+                self.stdout.write(f"  {description}  # {', '.join(dict.fromkeys(views))}")
+
+    def confirm(self, alias, sql, params, proposal, tables, before):
+        """Whether the planner uses the proposed index and drops a scan or sort for it."""
+        connection = connections[alias]
+        with connection.schema_editor() as editor:
+            editor.add_index(proposal.model, proposal.index)
+        try:
+            plan = explain(alias, sql, params)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.remove_index(proposal.model, proposal.index)
+        used = any(proposal.index.name in step for step in plan)
+        return used and len(problems(plan, tables)) < before
@@ -0,0 +1,322 @@
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils.crypto import get_random_string
+
+from quizhub.asgi import ASGIHandler
+from quizhub.benchmarking import PROFILES, database_profile, isolated_database, percentile
+from quizhub.datasets import FIRST_NAMES, SCALES
+from quizzes.models import Quiz
+
+User = get_user_model()
+
+SERVERS = ('wsgi', 'asgi')
+
+
+class Workload:
+    """
+    Each client's requests to the JSON endpoints, as ``(method, path,
+    query, body, headers)``, sent with a session of its own user.
+    """
+
+    def __init__(self, clients, requests, seed):
+        users = list(User.objects.filter(is_active=True).order_by('id')[:clients + 1])
+        if len(users) < 2:
+            raise CommandError('The dataset needs at least 2 users.')
+        quizzes = Quiz.objects.filter(is_active=True).order_by('-attempt_count', 'id')[:5]
+        submissions = [
+            (quiz.id, json.dumps({
+                'answers': {str(question.id): question.correct_answer for question in quiz.questions.all()},
+                'time_taken': 60,
+            }).encode())
+            for quiz in quizzes
+        ]
+        # One session per user, shared by the clients acting as that user
+        cookies = {}
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            token = get_random_string(32)
+            cookies[user.pk] = (
+                f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; '
+                f'{settings.CSRF_COOKIE_NAME}={token}'
+            ).encode(), token.encode()
+
+        self.plans = []
+        for index in range(clients):
+            rng = random.Random(seed + index)
+            user = users[index % len(users)]
+            cookie, token = cookies[user.pk]
+            headers = [(b'cookie', cookie), (b'x-csrftoken', token), (b'x-requested-with', b'XMLHttpRequest')]
+            targets = [other.username for other in users if other.pk != user.pk]
+            plan = []
+            for _ in range(requests):
+                roll = rng.random()
+                if roll < 0.25:
+                    quiz_id, body = rng.choice(submissions)
+                    plan.append(('POST', f'/quiz/{quiz_id}/submit/', '', body,
+                                 headers + [(b'content-type', b'application/json')]))
+                elif roll < 0.5:
+                    kind = rng.choice(['upvote', 'follow'])
+                    plan.append(('POST', f'/social/{kind}/{rng.choice(targets)}/', '', b'', headers))
+                elif roll < 0.6:
+                    body = urlencode({'content': f'Nice work on quiz {rng.randrange(1000)}!'}).encode()
+                    plan.append(('POST', f'/social/comment/{rng.choice(targets)}/', '', body,
+                                 headers + [(b'content-type', b'application/x-www-form-urlencoded')]))
+                else:
+                    # What the autocomplete sends while a name is typed
+                    name = rng.choice(FIRST_NAMES).lower()
+                    query = urlencode({'q': name[:rng.randint(min(2, len(name)), len(name))]})
+                    plan.append(('GET', '/accounts/search/', query, b'', headers))
+            self.plans.append(plan)
+
+
+class Tally:
+    """Latencies, failures and the most requests in progress at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self, issued, status, body):
+        with self.lock:
+            self.in_flight -= 1
+            self.latencies.append((time.perf_counter() - issued) * 1000)
+            # The endpoints report failures, lock errors included, in the body
+            if status >= 400 or not json.loads(body).get('success', True):
+                self.errors += 1
+
+
+class ThreadSampler(threading.Thread):
+    """Samples the process's thread count until stopped."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the JSON endpoints with many simultaneous clients, served by a WSGI thread pool '
+        'and by the ASGI application'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='Simultaneous clients')
+        parser.add_argument('--requests', type=int, default=2, help='Requests per client, sent one after another')
+        parser.add_argument('--threads', type=int, default=16,
+                            help='WSGI worker threads, and requests the ASGI handler runs at once')
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--profile', choices=PROFILES, default='production',
+                            help='SQLite profile (see benchmark_contention)')
+        parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The database profiles used here are SQLite specific.')
+        setup_test_environment()
+        try:
+            with isolated_database(), override_settings(QUERY_INSTRUMENTATION={'ENABLED': False}):
+                call_command('generate_dataset', scale=options['scale'], seed=options['seed'], stdout=StringIO())
+                workload = Workload(options['clients'], options['requests'], options['seed'])
+                self.stdout.write(
+                    f"{options['clients']} clients x {options['requests']} requests (25% submissions, "
+                    f"25% toggles, 10% comments, 40% searches) on the {options['scale']} dataset, "
+                    f"{options['profile']} SQLite profile"
+                )
+                self.stdout.write(
+                    f"  {'server':<22} {'req/s':>7} {'errors':>6} {'in flight':>9} {'threads':>7} "
+                    f"{'p50 ms':>8} {'p99 ms':>8}"
+                )
+                for server in options['servers']:
+                    # The handlers load their middleware, so they're made
+                    # with the settings above
+                    with database_profile(options['profile']):
+                        if server == 'wsgi':
+                            label = f"wsgi, {options['threads']} threads"
+                            row = self.run_wsgi(WSGIHandler(), workload, options['threads'])
+                        else:
+                            label = f"asgi, {options['threads']} at once"
+                            with override_settings(ASGI_REQUESTS={'MAX_CONCURRENT': options['threads']}):
+                                row = asyncio.run(self.run_asgi(ASGIHandler(), workload))
+                    self.stdout.write(
+                        f"  {label:<22} {row['throughput']:>7.1f} {row['errors']:>6} {row['in_flight']:>9} "
+                        f"{row['threads']:>7} {row['p50']:>8.1f} {row['p99']:>8.1f}"
+                    )
+        finally:
+            teardown_test_environment()
+
+    def run_wsgi(self, application, workload, threads):
+        """
+        Every client sends its first request at once to a pool of
+        ``threads`` workers, as a threaded WSGI server would queue them;
+        latency counts the time spent waiting for a worker.
+        """
+        tally = Tally()
+        remaining = len(workload.plans)
+        done = threading.Event()
+
+        def handle(request):
+            tally.started()
+            method, path, query, body, headers = request
+            environ = {
+                'REQUEST_METHOD': method,
+                'PATH_INFO': path,
+                'QUERY_STRING': query,
+                'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'REMOTE_ADDR': '127.0.0.1',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body),
+                'wsgi.url_scheme': 'http',
+                'wsgi.errors': StringIO(),
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+                'wsgi.version': (1, 0),
+            }
+            for name, value in headers:
+                key = name.decode().upper().replace('-', '_')
+                environ[key if key == 'CONTENT_TYPE' else f'HTTP_{key}'] = value.decode()
+            statuses = []
+            result = application(environ, lambda status, response_headers, exc_info=None: statuses.append(status))
+            try:
+                content = b''.join(result)
+            finally:
+                result.close()
+            return int(statuses[0].split()[0]), content
+
+        def send(pool, plan, index):
+            issued = time.perf_counter()
+            future = pool.submit(handle, plan[index])
+
+            def answered(future):
+                nonlocal remaining
+                tally.finished(issued, *future.result())
+                if index + 1 < len(plan):
+                    send(pool, plan, index + 1)
+                    return
+                with tally.lock:
+                    remaining -= 1
+                    if not remaining:
+                        done.set()
+
+            future.add_done_callback(answered)
+
+        sampler = ThreadSampler()
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            for plan in workload.plans:
+                send(pool, plan, 0)
+            done.wait()
+            elapsed = time.perf_counter() - start
+            # Each worker holds connections of its own; the barrier makes
+            # every one of them run a close
+            closing = threading.Barrier(threads)
+
+            def close():
+                connections.close_all()
+                closing.wait()
+
+            for _ in range(threads):
+                pool.submit(close)
+        sampler.stopped.set()
+        return self.summary(tally, elapsed, sampler.peak)
+
+    async def run_asgi(self, application, workload):
+        """Every client sends its first request at once to the ASGI application, in this event loop."""
+        tally = Tally()
+
+        async def handle(request):
+            method, path, query, body, headers = request
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': method,
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': query.encode(),
+                'root_path': '',
+                'headers': [(b'host', b'testserver'), *headers],
+                'client': ('127.0.0.1', 0),
+                'server': ('testserver', 80),
+            }
+            incoming = [{'type': 'http.request', 'body': body, 'more_body': False}]
+            answered = asyncio.Event()
+            response = {'status': 500, 'body': []}
+
+            async def receive():
+                if incoming:
+                    return incoming.pop()
+                # The client stays connected until the whole response is in
+                await answered.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    response['status'] = message['status']
+                elif message['type'] == 'http.response.body':
+                    response['body'].append(message.get('body', b''))
+                    if not message.get('more_body'):
+                        answered.set()
+
+            await application(scope, receive, send)
+            return response['status'], b''.join(response['body'])
+
+        async def client(plan):
+            for request in plan:
+                issued = time.perf_counter()
+                tally.started()
+                tally.finished(issued, *await handle(request))
+
+        sampler = ThreadSampler()
+        sampler.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(client(plan) for plan in workload.plans))
+        elapsed = time.perf_counter() - start
+        sampler.stopped.set()
+        return self.summary(tally, elapsed, sampler.peak)
+
+    def summary(self, tally, elapsed, threads):
+        return {
+            'throughput': len(tally.latencies) / elapsed,
+            'errors': tally.errors,
+            'in_flight': tally.peak_in_flight,
+            'threads': threads,
+            'p50': percentile(tally.latencies, 50),
+            'p99': percentile(tally.latencies, 99),
+        }
@@ -0,0 +1,156 @@
+import json
+import logging
+import random
+import threading
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from quizhub.benchmarking import PROFILES, database_profile, isolated_database, percentile
+from quizhub.datasets import SCALES
+from quizzes.models import Quiz
+
+User = get_user_model()
+
+
+class RetryCounter(logging.Handler):
+    """Counts the retries quizhub.db logs instead of printing them."""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Workload:
+    """Per-thread request sequences: quiz submissions, social toggles and page reads."""
+
+    def __init__(self, threads, operations, seed):
+        self.users = list(User.objects.filter(is_active=True).order_by('id')[:threads + 10])
+        if len(self.users) < threads + 10:
+            raise CommandError(f'The dataset needs at least {threads + 10} users.')
+        # Everyone hammers the same few quizzes and profiles, like a live event
+        quizzes = Quiz.objects.filter(is_active=True).order_by('-attempt_count', 'id')[:5]
+        self.submissions = [
+            (quiz.id, json.dumps({
+                'answers': {str(question.id): question.correct_answer for question in quiz.questions.all()},
+                'time_taken': 60,
+            }))
+            for quiz in quizzes
+        ]
+        targets = [user.username for user in self.users[threads:]]
+
+        self.plans = []
+        for index in range(threads):
+            rng = random.Random(seed + index)
+            plan = []
+            for _ in range(operations):
+                roll = rng.random()
+                if roll < 0.4:
+                    quiz_id, body = rng.choice(self.submissions)
+                    plan.append(('write', 'post', f'/quiz/{quiz_id}/submit/', body))
+                elif roll < 0.7:
+                    kind = rng.choice(['upvote', 'follow'])
+                    plan.append(('write', 'post', f'/social/{kind}/{rng.choice(targets)}/', None))
+                else:
+                    quiz_id, _ = rng.choice(self.submissions)
+                    plan.append(('read', 'get', f'/quiz/{quiz_id}/', None))
+            self.plans.append(plan)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent submissions and social toggles under the default and production SQLite profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--operations', type=int, default=40, help='Requests per client')
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The database profiles compared here are SQLite specific.')
+        setup_test_environment()
+        try:
+            with isolated_database(), override_settings(QUERY_INSTRUMENTATION={'ENABLED': False}):
+                call_command('generate_dataset', scale=options['scale'], seed=options['seed'], stdout=StringIO())
+                workload = Workload(options['threads'], options['operations'], options['seed'])
+                self.stdout.write(
+                    f"{options['threads']} threads x {options['operations']} requests "
+                    f"(40% submissions, 30% toggles, 30% reads) on the {options['scale']} dataset"
+                )
+                self.stdout.write(
+                    f"  {'profile':<11} {'req/s':>7} {'errors':>6} {'retries':>7} "
+                    f"{'write p50':>9} {'write p95':>9} {'read p95':>8}"
+                )
+                for profile in options['profiles']:
+                    with database_profile(profile):
+                        row = self.run(workload)
+                    self.stdout.write(
+                        f"  {profile:<11} {row['throughput']:>7.1f} {row['errors']:>6} {row['retries']:>7} "
+                        f"{row['write_p50']:>9.1f} {row['write_p95']:>9.1f} {row['read_p95']:>8.1f}"
+                    )
+        finally:
+            teardown_test_environment()
+
+    def run(self, workload):
+        threads = len(workload.plans)
+        ready = threading.Barrier(threads + 1)
+        latencies = {'read': [], 'write': []}
+        errors = []
+        retries = RetryCounter()
+        retry_logger = logging.getLogger('quizhub.db')
+        saved_handlers = retry_logger.handlers
+        retry_logger.handlers = [retries]
+
+        def client_thread(index):
+            client = Client(raise_request_exception=False)
+            client.force_login(workload.users[index])
+            ready.wait()
+            try:
+                for kind, method, url, body in workload.plans[index]:
+                    start = time.perf_counter()
+                    if method == 'post':
+                        response = client.post(url, body, content_type='application/json')
+                    else:
+                        response = client.get(url)
+                    latencies[kind].append((time.perf_counter() - start) * 1000)
+                    # submit_quiz reports failures, lock errors included, in the body
+                    failed = response.status_code >= 400 or (
+                        response['Content-Type'] == 'application/json' and not response.json()['success']
+                    )
+                    if failed:
+                        errors.append(url)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=client_thread, args=(index,)) for index in range(threads)]
+        try:
+            for worker in workers:
+                worker.start()
+            ready.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            retry_logger.handlers = saved_handlers
+
+        requests = sum(len(plan) for plan in workload.plans)
+        return {
+            'throughput': requests / elapsed,
+            'errors': len(errors),
+            'retries': retries.count,
+            'write_p50': percentile(latencies['write'], 50),
+            'write_p95': percentile(latencies['write'], 95),
+            'read_p95': percentile(latencies['read'], 95),
+        }
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.contrib.auth import get_user_model
+
+from quizhub.benchmarking import isolated_database, measure, percentile
+from quizzes.grading import grade_submission, record_attempt
+from quizzes.models import Quiz, Question, QuizAttempt, UserAnswer
+
+User = get_user_model()
+
+
+def legacy_submit(user, quiz, answers):
+    """The original per-row submission path, kept for comparison."""
+    questions = quiz.questions.all()
+    if questions.count() == 0:
+        return None
+
+    correct_count = 0
+    total_questions = questions.count()
+    attempt = QuizAttempt.objects.create(
+        user=user,
+        quiz=quiz,
+        score=0,
+        total_questions=total_questions,
+        correct_answers=0,
+        time_taken=timedelta(seconds=60)
+    )
+    for question in questions:
+        selected_answer = answers.get(str(question.id), '')
+        is_correct = selected_answer == question.correct_answer
+        if is_correct:
+            correct_count += 1
+        UserAnswer.objects.create(
+            attempt=attempt,
+            question=question,
+            selected_answer=selected_answer,
+            is_correct=is_correct
+        )
+    attempt.correct_answers = correct_count
+    attempt.score = round((correct_count / total_questions) * 100, 2)
+    attempt.save()
+    return attempt
+
+
+def database_bytes():
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return page_count * cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark quiz submission: statement count, latency and storage per quiz size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 30, 200],
+                            help='Question counts to benchmark')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Submissions per quiz size')
+        parser.add_argument('--paths', nargs='+', choices=['legacy', 'rows', 'packed'],
+                            default=['legacy', 'rows', 'packed'],
+                            help='Submission paths to compare')
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            user = User.objects.create_user(username='bench', email='bench@example.com', password='bench')
+            paths = {
+                'legacy': lambda quiz, answers: legacy_submit(user, quiz, answers),
+                'rows': lambda quiz, answers: record_attempt(user, grade_submission(quiz, answers), 60, compact=False),
+                'packed': lambda quiz, answers: record_attempt(user, grade_submission(quiz, answers), 60, compact=True),
+            }
+
+            self.stdout.write(
+                f"{'questions':>9}  {'path':<8} {'queries':>7} {'p50 ms':>8} {'p95 ms':>8} {'bytes/attempt':>14}"
+            )
+            for size in options['sizes']:
+                quiz = self.create_quiz(user, size)
+                answers = {str(q.id): 'A' for q in quiz.questions.all()}
+
+                for label in options['paths']:
+                    submit = paths[label]
+                    # Warm the answer key and layout so only steady-state cost is measured
+                    submit(quiz, answers)
+                    size_before = database_bytes()
+                    timings, queries = measure(lambda: submit(quiz, answers), options['iterations'])
+                    bytes_per_attempt = (database_bytes() - size_before) / options['iterations']
+                    self.stdout.write(
+                        f'{size:>9}  {label:<8} {queries:>7} '
+                        f'{percentile(timings, 50):>8.2f} {percentile(timings, 95):>8.2f} {bytes_per_attempt:>14.0f}'
+                    )
+
+    def create_quiz(self, user, size):
+        quiz = Quiz.objects.create(
+            title=f'Benchmark quiz ({size} questions)',
+            language='python',
+            created_by=user
+        )
+        Question.objects.bulk_create([
+            Question(
+                quiz=quiz,
+                question_text=f'Question {i}',
+                option_a='a', option_b='b', option_c='c', option_d='d',
+                correct_answer='ABCD'[i % 4]
+            )
+            for i in range(size)
+        ])
+        return quiz
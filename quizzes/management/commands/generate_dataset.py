@@ -0,0 +1,271 @@
+import multiprocessing
+import time
+from argparse import BooleanOptionalAction
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from quizhub.datasets import FIELDS, SCALES, DatasetPlan, chunks, generate_chunk
+from quizzes import search
+from quizzes.models import AnswerLayout
+from profiles.models import UserProfile
+
+GROUPS = ('users', 'quizzes', 'attempts', 'social')
+# Fields the database driver can't take as plain Python values; datetimes
+# are generated as naive UTC and go through unconverted
+PREPARED_TYPES = ('DurationField',)
+
+
+class TableWriter:
+    """Inserts generated rows with one executemany per chunk, bypassing the ORM."""
+
+    def __init__(self, label, connection):
+        self.connection = connection
+        self.model = apps.get_model(label)
+        fields = [self.model._meta.get_field(name) for name in FIELDS[label]]
+        self.prepared = [
+            (position, field) for position, field in enumerate(fields)
+            if field.get_internal_type() in PREPARED_TYPES
+        ]
+        quote = connection.ops.quote_name
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(self.model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        self.rows = 0
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.prepared:
+            rows = [self.prepare(row) for row in rows]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(self.sql, rows)
+        self.rows += len(rows)
+
+    def prepare(self, row):
+        row = list(row)
+        for position, field in self.prepared:
+            row[position] = field.get_db_prep_save(row[position], self.connection)
+        return row
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, deterministic synthetic dataset for load and performance testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small',
+                            help='Preset sizes; the options below override individual counts')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--quizzes', type=int)
+        parser.add_argument('--questions', type=int, help='Questions per quiz')
+        parser.add_argument('--attempts', type=int, help='Quiz attempts; answers = attempts x questions')
+        parser.add_argument('--follows', type=int, help='Average follows per user')
+        parser.add_argument('--upvotes', type=int, help='Average upvotes given per user')
+        parser.add_argument('--comments', type=int, help='Total profile comments')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=10_000,
+                            help='Users, quizzes or attempts generated and inserted per transaction '
+                                 '(rounded down to a multiple of 1000)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating rows in parallel (0 = one per CPU)')
+        parser.add_argument('--compact', action=BooleanOptionalAction, default=None,
+                            help='Pack answers onto attempts (defaults to COMPACT_ANSWER_STORAGE)')
+        parser.add_argument('--prefix', default='loadtest_', help='Username and email prefix')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Skip rebuilding counters, stats, histograms and the search indexes afterwards')
+        parser.add_argument('--force', action='store_true',
+                            help='Add to a database that already has data; rows are then inserted '
+                                 'with indexes and durability settings left as they are')
+
+    def handle(self, *args, **options):
+        sizes = dict(SCALES[options['scale']])
+        for name in sizes:
+            if options[name] is not None:
+                sizes[name] = options[name]
+        compact = options['compact']
+        if compact is None:
+            compact = getattr(settings, 'COMPACT_ANSWER_STORAGE', False)
+        workers = options['workers'] or multiprocessing.cpu_count()
+        self.chunk_size = options['chunk_size']
+        plan = DatasetPlan(
+            seed=options['seed'],
+            password=make_password('password'),
+            prefix=options['prefix'],
+            id_bases={label: self.next_id(label) for label in FIELDS},
+            compact=compact,
+            **sizes
+        )
+        populated = sorted(label for label, base in plan.id_bases.items() if base > 1)
+        if populated and not options['force']:
+            raise CommandError(
+                f"The database already has data ({', '.join(populated)}); generate into an empty "
+                'database, or pass --force to add to it without the fast bulk load.'
+            )
+        # The wrappers themselves, as the django.db.connection proxy is slow
+        # to dereference once per prepared value; attempt tables may be in
+        # a database of their own (see quizhub.routers)
+        writers = {
+            label: TableWriter(label, connections[router.db_for_write(apps.get_model(label))])
+            for label in FIELDS
+        }
+        self.databases = defaultdict(list)
+        for writer in writers.values():
+            self.databases[writer.connection.alias].append(writer.model)
+        self.stdout.write(
+            f"Generating {options['scale']} dataset (seed {plan.seed}, {workers} worker(s)): "
+            + ', '.join(f'{count} {name}' for name, count in sizes.items())
+        )
+
+        started = time.perf_counter()
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            with ExitStack() as stack:
+                # Never drop indexes or skip fsync on a database holding real data
+                if not populated:
+                    for alias, models in self.databases.items():
+                        stack.enter_context(self.fast_inserts(connections[alias], models))
+                for group in GROUPS:
+                    if group == 'attempts' and compact:
+                        plan.layout_ids = self.create_layouts(plan)
+                    self.insert_group(plan, group, writers, pool, workers)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        for alias, models in self.databases.items():
+            self.reset_sequences(connections[alias], models)
+        total_rows = sum(writer.rows for writer in writers.values())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {total_rows} rows in {elapsed:.1f}s ({total_rows / elapsed:,.0f} rows/s).'
+        ))
+
+        if not options['skip_derived']:
+            self.rebuild_derived(plan)
+
+    def insert_group(self, plan, group, writers, pool, workers):
+        work = chunks(plan, group, self.chunk_size)
+        started = time.perf_counter()
+        before = {label: writer.rows for label, writer in writers.items()}
+
+        for rows_by_label in self.generate(work, pool, workers):
+            with ExitStack() as stack:
+                for alias in self.databases:
+                    stack.enter_context(transaction.atomic(using=alias))
+                for label, rows in rows_by_label.items():
+                    writers[label].write(rows)
+
+        elapsed = time.perf_counter() - started
+        inserted = {label: writer.rows - before[label] for label, writer in writers.items()}
+        rows = sum(inserted.values())
+        detail = ', '.join(
+            f'{label}: {inserted[label]}'
+            for label, writer in writers.items() if inserted[label]
+        )
+        self.stdout.write(
+            f'  {group:<9} {rows:>10} rows {elapsed:>7.1f}s {rows / max(elapsed, 1e-9):>10,.0f} rows/s  ({detail})'
+        )
+
+    def generate(self, work, pool, workers):
+        """Yield generated chunks in order, keeping at most a few in flight per worker."""
+        if pool is None:
+            yield from map(generate_chunk, work)
+            return
+        pending = deque()
+        for item in work:
+            pending.append(pool.apply_async(generate_chunk, (item,)))
+            if len(pending) > workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def next_id(self, label):
+        model = apps.get_model(label)
+        return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    def create_layouts(self, plan):
+        layout_ids = {}
+        with transaction.atomic():
+            for index in range(plan.quizzes):
+                question_ids = [plan.question_id(index, position) for position in range(plan.questions)]
+                layout_ids[index] = AnswerLayout.for_questions(plan.quiz_id(index), question_ids).id
+        return layout_ids
+
+    @contextmanager
+    def fast_inserts(self, connection, models):
+        """
+        On SQLite, skip fsync and foreign key checks, give the load a large
+        page cache and build secondary indexes once at the end instead of
+        row by row; only used on an empty database, as the data is then
+        disposable, and generated rows are consistent and unique by
+        construction.
+        """
+        if connection.vendor != 'sqlite':
+            yield
+            return
+        pragmas = {'synchronous': 'OFF', 'cache_size': '-262144'}
+        tables = [model._meta.db_table for model in models]
+        with connection.cursor() as cursor:
+            previous = {}
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}')
+                previous[name] = cursor.fetchone()[0]
+                cursor.execute(f'PRAGMA {name} = {value}')
+            # Indexes declared inline (sql IS NULL) can't be dropped and stay in place
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                "AND tbl_name IN ({})".format(', '.join(['%s'] * len(tables))),
+                tables
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        try:
+            with connection.constraint_checks_disabled():
+                yield
+        finally:
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                for _, sql in indexes:
+                    cursor.execute(sql)
+                for name, value in previous.items():
+                    cursor.execute(f'PRAGMA {name} = {value}')
+            self.stdout.write(f'  indexes   rebuilt {len(indexes)} in {time.perf_counter() - started:.1f}s')
+
+    def reset_sequences(self, connection, models):
+        # Rows were inserted with explicit ids; move PostgreSQL/Oracle sequences past them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def counted(self, model_label, user_field):
+        return apps.get_model(model_label).objects.filter(**{user_field: OuterRef('user')}).order_by().values(
+            user_field
+        ).annotate(total=Count('id')).values('total')
+
+    def rebuild_derived(self, plan):
+        started = time.perf_counter()
+        UserProfile.objects.filter(user_id__gte=plan.id_bases['accounts.CustomUser']).update(**{
+            field: Coalesce(Subquery(self.counted(model_label, user_field)), 0)
+            for field, (model_label, user_field) in UserProfile.COUNTERS.items()
+        })
+
+        call_command('reconcile_quiz_counters', stdout=self.stdout)
+        call_command('rebuild_user_stats', stdout=self.stdout)
+        call_command('rebuild_score_histograms', stdout=self.stdout)
+        call_command('rebuild_user_search', stdout=self.stdout)
+        if search.available():
+            call_command('rebuild_search_index', stdout=self.stdout)
+        self.stdout.write(f'Rebuilt derived data in {time.perf_counter() - started:.1f}s.')
@@ -0,0 +1,121 @@
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from quizhub.routers import attempt_databases, attempts_database, seed_attempt_ids
+from quizzes.models import QuizAttempt, UserAnswer
+
+
+class Command(BaseCommand):
+    help = 'Move quiz attempts and their answers between databases (see quizhub.routers), keeping their ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='source',
+                            help='Database to move from (defaults to default, or to the current attempts '
+                                 'database when moving into an archive)')
+        parser.add_argument('--to', dest='target',
+                            help='Database to move to (defaults to the current attempts database)')
+        parser.add_argument('--before', type=date.fromisoformat,
+                            help='Only move attempts completed before this date (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Attempts moved per transaction')
+
+    def handle(self, *args, **options):
+        current = attempts_database()
+        target = options['target'] or current
+        source = options['source'] or (DEFAULT_DB_ALIAS if target == current else current)
+        if target not in attempt_databases():
+            raise CommandError(f'{target} is not an attempt database; set QUIZHUB_SPLIT_ATTEMPTS=1 to add them.')
+        if source == target:
+            raise CommandError(f'Nothing to move: attempts are already read from and written to {source}.')
+        if target == current:
+            # In case the database was migrated before the ids were seeded
+            seed_attempt_ids(target)
+
+        attempts = QuizAttempt.objects.using(source).order_by('id')
+        if options['before']:
+            attempts = attempts.filter(
+                completed_at__lt=timezone.make_aware(datetime.combine(options['before'], time.min))
+            )
+
+        # Each batch is copied, then removed from the source. Rows already in
+        # the target with the same values (an interrupted run) are kept, so a
+        # run can simply be repeated; a different row under the same id stops
+        # the move before anything of its batch is removed. Both are plain SQL: bulk_create would stamp completed_at afresh,
+        # and post_delete would take the moved attempts off the derived stats.
+        moved = answers_moved = 0
+        last_id = 0
+        while True:
+            batch = list(attempts.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            ids = [attempt.id for attempt in batch]
+            answers = list(UserAnswer.objects.using(source).filter(attempt_id__in=ids))
+
+            with transaction.atomic(using=target):
+                self.copy(target, QuizAttempt, batch)
+                self.copy(target, UserAnswer, answers)
+            with transaction.atomic(using=source):
+                self.delete(source, UserAnswer, 'attempt_id', ids)
+                self.delete(source, QuizAttempt, 'id', ids)
+
+            moved += len(batch)
+            answers_moved += len(answers)
+            self.stdout.write(f'Moved {moved} attempts (up to id {last_id})')
+
+        self.reset_sequences(target)
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} attempts and {answers_moved} answers from {source} to {target}.'
+        ))
+
+    def copy(self, using, model, objs):
+        if not objs:
+            return
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        fields = model._meta.concrete_fields
+        values = lambda obj: [getattr(obj, field.attname) for field in fields]
+        existing = {
+            obj.pk: values(obj)
+            for obj in model._base_manager.using(using).filter(pk__in=[obj.pk for obj in objs])
+        }
+        for obj in objs:
+            if obj.pk in existing and existing[obj.pk] != values(obj):
+                raise CommandError(
+                    f'{model._meta.label} {obj.pk} is already in {using} with different data; '
+                    f'nothing from this batch was removed from {obj._state.db}.'
+                )
+        objs = [obj for obj in objs if obj.pk not in existing]
+        if not objs:
+            return
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(value, connection) for field, value in zip(fields, values(obj))]
+                for obj in objs
+            ])
+
+    def delete(self, using, model, column, ids):
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE {} IN ({})'.format(
+                    quote(model._meta.db_table), quote(column), ', '.join(['%s'] * len(ids))
+                ),
+                ids
+            )
+
+    def reset_sequences(self, using):
+        # Rows kept their ids; move PostgreSQL/Oracle sequences past them
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [QuizAttempt, UserAnswer]):
+                cursor.execute(sql)
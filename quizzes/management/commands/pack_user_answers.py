@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quizhub.routers import attempts_database
+from quizzes.grading import UNANSWERED
+from quizzes.models import AnswerLayout, QuizAttempt, UserAnswer
+
+
+class Command(BaseCommand):
+    help = 'Convert attempts stored as UserAnswer rows to compact packed answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of attempts converted per transaction')
+        parser.add_argument('--start-after', type=int, default=0,
+                            help='Only convert attempts with a higher id')
+        parser.add_argument('--database', help='Attempt database to convert (defaults to the current one)')
+
+    def handle(self, *args, **options):
+        # Each chunk commits on its own and converted attempts drop out of the
+        # queryset, so an interrupted run simply picks up where it stopped.
+        chunk_size = options['chunk_size']
+        last_id = options['start_after']
+        converted = rows_removed = 0
+        layouts = {}
+        using = options['database'] or attempts_database()
+
+        while True:
+            attempts = list(
+                QuizAttempt.objects.using(using).filter(id__gt=last_id, answer_layout__isnull=True)
+                .order_by('id').only('id', 'quiz_id')[:chunk_size]
+            )
+            if not attempts:
+                break
+            last_id = attempts[-1].id
+
+            selections = defaultdict(dict)
+            for attempt_id, question_id, selected_answer in UserAnswer.objects.using(using).filter(
+                attempt_id__in=[attempt.id for attempt in attempts]
+            ).values_list('attempt_id', 'question_id', 'selected_answer'):
+                selections[attempt_id][question_id] = selected_answer
+
+            packed = []
+            for attempt in attempts:
+                answers = selections.get(attempt.id)
+                if not answers:
+                    continue
+                # Row storage wrote one row per question, in question id order
+                question_ids = tuple(sorted(answers))
+                layout_key = (attempt.quiz_id, question_ids)
+                if layout_key not in layouts:
+                    layouts[layout_key] = AnswerLayout.for_questions(attempt.quiz_id, question_ids).id
+                attempt.answer_layout_id = layouts[layout_key]
+                attempt.packed_answers = ''.join(
+                    answers[question_id] or UNANSWERED for question_id in question_ids
+                )
+                packed.append(attempt)
+
+            with transaction.atomic(using=using):
+                QuizAttempt.objects.using(using).bulk_update(packed, ['answer_layout', 'packed_answers'])
+                deleted, _ = UserAnswer.objects.using(using).filter(
+                    attempt_id__in=[attempt.id for attempt in packed]
+                ).delete()
+
+            converted += len(packed)
+            rows_removed += deleted
+            self.stdout.write(f'Converted {converted} attempts (up to id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {converted} attempts and removed {rows_removed} UserAnswer rows.'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from quizzes.models import Quiz, QuizScoreBucket
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the per-quiz score histograms from QuizAttempt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Number of quizzes rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        quizzes = buckets = 0
+        last_id = 0
+
+        while True:
+            quiz_ids = list(
+                Quiz.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not quiz_ids:
+                break
+            last_id = quiz_ids[-1]
+            buckets += QuizScoreBucket.rebuild_for_quizzes(quiz_ids)
+            quizzes += len(quiz_ids)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt histograms for {quizzes} quizzes ({buckets} buckets).'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes import search
+
+
+class Command(BaseCommand):
+    help = 'Refill the quiz and question full-text search index (quizzes.search) from the quiz tables'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('The quiz search index needs SQLite with FTS5; other databases search without one.')
+        quizzes, questions = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {quizzes} quizzes and {questions} questions.'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+
+from quizzes.models import LeaderboardEntry, RankBucket, UserQuizStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the per-user and scoped leaderboard stats, and their rank buckets, from QuizAttempt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of users rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        users = rows = entries = 0
+        last_id = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            rows += UserQuizStats.rebuild_for_users(user_ids, rank_buckets=False)
+            entries += LeaderboardEntry.rebuild_for_users(user_ids, rank_buckets=False)
+            users += len(user_ids)
+        # Recounted once rather than moved row by row
+        buckets = RankBucket.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt stats for {users} users ({rows} with attempts, {entries} leaderboard entries, '
+            f'{buckets} rank buckets).'
+        ))
@@ -0,0 +1,60 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from quizhub.routers import attempt_databases
+from quizzes.models import Quiz, Question, QuizAttempt
+
+
+class Command(BaseCommand):
+    help = 'Repair drift in the denormalized question/attempt counters on Quiz'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of quizzes checked per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_id = 0
+
+        while True:
+            quizzes = list(
+                Quiz.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'question_count', 'attempt_count')[:batch_size]
+            )
+            if not quizzes:
+                break
+            last_id = quizzes[-1].id
+            ids = [quiz.id for quiz in quizzes]
+
+            question_counts = dict(
+                Question.objects.filter(quiz_id__in=ids).order_by()
+                .values_list('quiz_id').annotate(n=Count('id'))
+            )
+            attempt_counts = Counter()
+            for alias in attempt_databases():
+                attempt_counts.update(dict(
+                    QuizAttempt.objects.using(alias).filter(quiz_id__in=ids).order_by()
+                    .values_list('quiz_id').annotate(n=Count('id'))
+                ))
+
+            drifted = []
+            for quiz in quizzes:
+                question_count = question_counts.get(quiz.id, 0)
+                attempt_count = attempt_counts.get(quiz.id, 0)
+                if quiz.question_count != question_count or quiz.attempt_count != attempt_count:
+                    quiz.question_count = question_count
+                    quiz.attempt_count = attempt_count
+                    drifted.append(quiz)
+
+            if drifted:
+                with transaction.atomic():
+                    Quiz.objects.bulk_update(drifted, ['question_count', 'attempt_count'])
+
+            checked += len(quizzes)
+            repaired += len(drifted)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} quizzes, repaired {repaired}.'))
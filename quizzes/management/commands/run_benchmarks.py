@@ -0,0 +1,221 @@
+import json
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from quizhub.benchmarking import calibrate, isolated_database, measure, peak_memory, percentile
+from quizhub.datasets import SCALES
+from quizhub.pagination import encode_cursor
+from quizzes.models import Quiz, QuizAttempt, UserQuizStats
+
+User = get_user_model()
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'quizhub' / 'benchmark_baseline.json'
+LATENCIES = ('p50_ms', 'p95_ms')
+
+
+class Scenario:
+    """The users, quiz and attempt the benchmarked requests act on."""
+
+    def __init__(self):
+        # Generated datasets skew activity towards the lowest ids, so these
+        # are the busiest user, the most attempted quiz and a popular profile
+        self.viewer = User.objects.get(pk=QuizAttempt.objects.order_by('user_id').values_list('user_id', flat=True)[0])
+        self.quiz = Quiz.objects.order_by('-attempt_count', 'id').first()
+        self.target = User.objects.exclude(pk=self.viewer.pk).order_by('id').first()
+        self.attempt = QuizAttempt.objects.filter(user=self.viewer).order_by('-id').first()
+        self.answers = {str(question.id): question.correct_answer for question in self.quiz.questions.all()}
+        # A cursor near the end of the viewer's history, the worst case for OFFSET paging
+        history = QuizAttempt.objects.filter(user=self.viewer).order_by('-completed_at', '-id')
+        deep = history[max(0, history.count() - 20)]
+        self.deep_cursor = encode_cursor([deep.completed_at, deep.id])
+        # The last-ranked user, the worst case for counting ranks ahead
+        self.last_ranked = UserQuizStats.objects.order_by(*UserQuizStats.RANKING).last().user
+
+        self.client = Client()
+        self.client.force_login(self.viewer)
+        self.last_ranked_client = Client()
+        self.last_ranked_client.force_login(self.last_ranked)
+
+    def cases(self):
+        client = self.client
+        quiz_id = self.quiz.id
+        attempt_url = f'/quiz/{self.attempt.quiz_id}/result/{self.attempt.id}/'
+        submission = json.dumps({'answers': self.answers, 'time_taken': 120})
+
+        def toggle(url):
+            # On then off, so every iteration runs the same statements
+            def run():
+                client.post(url)
+                return client.post(url)
+            return run
+
+        return {
+            'home_view': lambda: client.get('/'),
+            'quiz_detail': lambda: client.get(f'/quiz/{quiz_id}/'),
+            'take_quiz': lambda: client.get(f'/quiz/{quiz_id}/take/'),
+            'submit_quiz': lambda: client.post(
+                f'/quiz/{quiz_id}/submit/', submission, content_type='application/json'
+            ),
+            'quiz_result': lambda: client.get(attempt_url),
+            'leaderboard': lambda: client.get('/leaderboard/'),
+            'leaderboard_deep_rank': lambda: self.last_ranked_client.get('/leaderboard/data/'),
+            'profile_view': lambda: client.get(f'/profiles/profile/{self.target.username}/'),
+            'profile_attempts': lambda: client.get(
+                f'/profiles/profile/{self.viewer.username}/attempts/', {'cursor': self.deep_cursor}
+            ),
+            'user_search': lambda: client.get('/accounts/search/', {'q': 'ada'}),
+            # Every generated quiz and question matches, the widest search there is
+            'quiz_search': lambda: client.get('/search/', {'q': 'quiz'}),
+            'toggle_upvote': toggle(f'/social/upvote/{self.target.username}/'),
+            'toggle_follow': toggle(f'/social/follow/{self.target.username}/'),
+        }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the main views against generated datasets and compare with the committed baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', choices=SCALES, default=['small', 'medium'],
+                            help='Dataset sizes to run against (large takes several minutes to generate)')
+        parser.add_argument('--views', nargs='+', help='Only benchmark these views')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per view')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE),
+                            help='Baseline JSON to compare against')
+        parser.add_argument('--margin', type=float, default=1.0,
+                            help='Allowed relative increase in latency over the baseline, once scaled to this machine')
+        parser.add_argument('--slack-ms', type=float, default=5.0,
+                            help='Latency allowed on top of the margin, for timer noise on fast views')
+        parser.add_argument('--memory-margin', type=float, default=0.5,
+                            help='Allowed relative increase in peak memory over the baseline')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Write these results as the new baseline instead of comparing')
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        results = {}
+        baseline_path = Path(options['baseline'])
+        baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        calibration = calibrate()
+        self.stdout.write(f'Calibration: {calibration:.2f} ms')
+        setup_test_environment()
+        try:
+            for scale in options['scales']:
+                results[scale] = self.run_scale(scale, options, calibration, baseline.get(scale, {}))
+        finally:
+            teardown_test_environment()
+
+        report = {
+            'generated_at': timezone.now().isoformat(), 'iterations': options['iterations'],
+            'calibration_ms': calibration, 'results': results,
+        }
+
+        if options['update_baseline']:
+            for scale, views in results.items():
+                baseline.setdefault(scale, {}).update(views)
+            baseline_path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+            regressions = []
+        else:
+            regressions = [
+                regression
+                for scale, views in results.items()
+                for view, row in views.items()
+                for regression in self.compare(scale, view, row, baseline.get(scale, {}).get(view), options)
+            ]
+        report['regressions'] = regressions
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2) + '\n')
+
+        if regressions:
+            for regression in regressions:
+                if regression['metric'] == 'queries':
+                    self.stderr.write('{scale} {view} queries: {value} != baseline {baseline}'.format(**regression))
+                else:
+                    self.stderr.write(
+                        '{scale} {view} {metric}: {value} > baseline {baseline} (limit {limit})'.format(**regression)
+                    )
+            raise CommandError(f'{len(regressions)} benchmark(s) regressed beyond the baseline.')
+
+    def run_scale(self, scale, options, calibration, baseline):
+        results = {}
+        with isolated_database(), override_settings(QUERY_INSTRUMENTATION={'ENABLED': False}):
+            call_command('generate_dataset', scale=scale, seed=options['seed'], stdout=StringIO())
+            # Ids repeat between scales, so nothing cached for the last one may survive
+            cache.clear()
+            cases = Scenario().cases()
+            names = options['views'] or list(cases)
+            unknown = set(names) - set(cases)
+            if unknown:
+                raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}")
+
+            self.stdout.write(f"{scale} ({SCALES[scale]['users']} users, {SCALES[scale]['attempts']} attempts)")
+            self.stdout.write(f"  {'view':<21} {'queries':>7} {'p50 ms':>8} {'p95 ms':>8} {'peak KB':>9}")
+            for name in names:
+                case = cases[name]
+                # Warm up caches (answer keys, templates) before timing
+                response = case()
+                if response.status_code >= 400:
+                    raise CommandError(f'{name} returned HTTP {response.status_code}')
+                timings, queries = measure(case, options['iterations'])
+                row = results[name] = {
+                    'queries': queries,
+                    'p50_ms': round(percentile(timings, 50), 2),
+                    'p95_ms': round(percentile(timings, 95), 2),
+                    'peak_kb': round(peak_memory(case) / 1024, 1),
+                    'calibration_ms': calibration,
+                }
+                slow = [
+                    regression for regression in self.compare(scale, name, row, baseline.get(name), options)
+                    if regression['metric'] in LATENCIES
+                ]
+                if slow and not options['update_baseline']:
+                    # A pause elsewhere on the machine can take a whole run
+                    # over; a regression is slow the second time too
+                    timings, _ = measure(case, options['iterations'])
+                    row['p50_ms'] = min(row['p50_ms'], round(percentile(timings, 50), 2))
+                    row['p95_ms'] = min(row['p95_ms'], round(percentile(timings, 95), 2))
+                self.stdout.write(
+                    f"  {name:<21} {row['queries']:>7} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['peak_kb']:>9.1f}"
+                )
+        return results
+
+    def compare(self, scale, view, row, expected, options):
+        """
+        The metrics of ``row`` beyond the baseline row ``expected``. Query
+        counts must match exactly: they don't depend on the machine, and a
+        drop is a change the baseline should record. Latencies are scaled
+        by the ratio of this machine's calibration to the one the baseline
+        was recorded with, then allowed ``--margin`` and ``--slack-ms`` over
+        that; peak memory is allowed ``--memory-margin``.
+        """
+        if not expected:
+            return []
+        regressions = []
+        if row['queries'] != expected['queries']:
+            regressions.append({
+                'scale': scale, 'view': view, 'metric': 'queries',
+                'value': row['queries'], 'baseline': expected['queries'], 'limit': expected['queries'],
+            })
+        speed = row['calibration_ms'] / expected.get('calibration_ms', row['calibration_ms'])
+        limits = {
+            metric: expected[metric] * speed * (1 + options['margin']) + options['slack_ms'] for metric in LATENCIES
+        }
+        limits['peak_kb'] = expected['peak_kb'] * (1 + options['memory_margin'])
+        for metric, limit in limits.items():
+            if row[metric] > limit:
+                regressions.append({
+                    'scale': scale, 'view': view, 'metric': metric,
+                    'value': row[metric], 'baseline': expected[metric], 'limit': round(limit, 2),
+                })
+        return regressions
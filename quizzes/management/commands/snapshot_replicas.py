@@ -0,0 +1,50 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from quizhub.routers import read_replicas
+
+
+class Command(BaseCommand):
+    help = 'Refresh the SQLite read replicas (READ_REPLICAS) with snapshots of the main database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds between snapshots; keep it below REPLICA_PIN_SECONDS')
+        parser.add_argument('--once', action='store_true', help='Take one snapshot and exit instead of running forever')
+
+    def handle(self, *args, **options):
+        replicas = read_replicas()
+        if not replicas:
+            raise CommandError('No read replicas are configured; set QUIZHUB_READ_REPLICAS.')
+        for alias in [DEFAULT_DB_ALIAS, *replicas]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias} is not SQLite; replicate it with its own database tools.')
+
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        try:
+            while True:
+                for alias in replicas:
+                    started = time.perf_counter()
+                    self.snapshot(source, connections[alias].settings_dict['NAME'])
+                    self.stdout.write(f'Snapshot to {alias} in {(time.perf_counter() - started) * 1000:.1f}ms')
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def snapshot(self, source, target):
+        # The online backup API copies a consistent snapshot of the source,
+        # holding off its writers meanwhile unless it is in WAL mode, and
+        # replaces the replica's pages in one transaction, so the replica's
+        # readers see either the old copy or the new one
+        origin = sqlite3.connect(source, timeout=30)
+        replica = sqlite3.connect(target, timeout=30)
+        try:
+            origin.backup(replica)
+        finally:
+            replica.close()
+            origin.close()
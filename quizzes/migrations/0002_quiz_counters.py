@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(quiz=OuterRef('pk')).order_by().values('quiz')
+            .annotate(n=Count('id')).values('n'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Quiz = apps.get_model('quizzes', 'Quiz')
+    Question = apps.get_model('quizzes', 'Question')
+    QuizAttempt = apps.get_model('quizzes', 'QuizAttempt')
+    db_alias = schema_editor.connection.alias
+    Quiz.objects.using(db_alias).update(question_count=count_of(Question), attempt_count=count_of(QuizAttempt))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='attempt_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='question_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['is_active', '-created_at'], name='quiz_active_created_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def backfill_stats(apps, schema_editor):
+    QuizAttempt = apps.get_model('quizzes', 'QuizAttempt')
+    UserQuizStats = apps.get_model('quizzes', 'UserQuizStats')
+    db_alias = schema_editor.connection.alias
+    totals = QuizAttempt.objects.using(db_alias).order_by().values('user_id').annotate(
+        n=Count('id'), total=Sum('score'), best=Max('score'), last=Max('completed_at')
+    )
+    UserQuizStats.objects.using(db_alias).bulk_create([
+        UserQuizStats(
+            user_id=row['user_id'],
+            attempts=row['n'],
+            score_sum=row['total'],
+            best_score=row['best'],
+            average_score=row['total'] / row['n'],
+            last_activity=row['last'],
+        )
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0002_quiz_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserQuizStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0)),
+                ('score_sum', models.IntegerField(default=0)),
+                ('best_score', models.IntegerField(default=0)),
+                ('average_score', models.FloatField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User quiz stats',
+                'indexes': [models.Index(fields=['-average_score', '-best_score'], name='stats_ranking_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0003_userquizstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0)),
+                ('score_sum', models.IntegerField(default=0)),
+                ('best_score', models.IntegerField(default=0)),
+                ('average_score', models.FloatField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('scope', models.CharField(max_length=40)),
+            ],
+            options={
+                'verbose_name_plural': 'Leaderboard entries',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='userquizstats',
+            name='stats_ranking_idx',
+        ),
+        migrations.AddIndex(
+            model_name='userquizstats',
+            index=models.Index(fields=['-average_score', '-best_score', 'user'], name='stats_ranking_idx'),
+        ),
+        migrations.AddField(
+            model_name='leaderboardentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['scope', '-average_score', '-best_score', 'user'], name='leaderboard_rank_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='leaderboardentry',
+            unique_together={('scope', 'user')},
+        ),
+    ]
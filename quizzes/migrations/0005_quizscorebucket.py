@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:47
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_buckets(apps, schema_editor):
+    QuizAttempt = apps.get_model('quizzes', 'QuizAttempt')
+    QuizScoreBucket = apps.get_model('quizzes', 'QuizScoreBucket')
+    db_alias = schema_editor.connection.alias
+    totals = QuizAttempt.objects.using(db_alias).order_by().values('quiz_id', 'score').annotate(n=Count('id'))
+    QuizScoreBucket.objects.using(db_alias).bulk_create([
+        QuizScoreBucket(quiz_id=row['quiz_id'], score=row['score'], count=row['n'])
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0004_leaderboard_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizScoreBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('count', models.IntegerField(default=0)),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_buckets', to='quizzes.quiz')),
+            ],
+            options={
+                'unique_together': {('quiz', 'score')},
+            },
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0005_quizscorebucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='packed_answers',
+            field=models.TextField(blank=True),
+        ),
+        migrations.CreateModel(
+            name='AnswerLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40)),
+                ('question_ids', models.TextField()),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_layouts', to='quizzes.quiz')),
+            ],
+            options={
+                'unique_together': {('quiz', 'digest')},
+            },
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='answer_layout',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='quizzes.answerlayout'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0006_packed_answers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['user', '-completed_at', '-id'], name='attempt_user_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+
+class AlterAttemptField(migrations.AlterField):
+    """
+    AlterField, only applied to the attempt databases. Their rows point at
+    users, quizzes and questions in another file, so constraints can't
+    hold there. In the main database they still hold, and dropping them
+    would make SQLite rebuild its two largest tables, split or not.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0007_attempt_user_recent_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AlterAttemptField(
+            model_name='quizattempt',
+            name='answer_layout',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='quizzes.answerlayout'),
+        ),
+        AlterAttemptField(
+            model_name='quizattempt',
+            name='quiz',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='quizzes.quiz'),
+        ),
+        AlterAttemptField(
+            model_name='quizattempt',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='quiz_attempts', to=settings.AUTH_USER_MODEL),
+        ),
+        AlterAttemptField(
+            model_name='useranswer',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='quizzes.question'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0008_attempt_keys_without_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='quiz',
+            name='quiz_active_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='quiz_active_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['language', '-created_at'], name='quiz_language_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['quiz', '-completed_at', '-id'], name='attempt_quiz_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['-completed_at', '-id'], name='attempt_recent_idx'),
+        ),
+    ]
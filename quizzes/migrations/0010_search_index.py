@@ -0,0 +1,49 @@
+from django.db import migrations
+
+# See quizzes.search
+CREATE = [
+    """
+    CREATE VIRTUAL TABLE quizzes_search USING fts5(
+        title, body, language, difficulty, quiz_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    # Rank titles above bodies; language and difficulty only filter
+    "INSERT INTO quizzes_search (quizzes_search, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0, 0.0, 0.0)')",
+    """
+    INSERT INTO quizzes_search (rowid, title, body, language, difficulty, quiz_id)
+    SELECT -id, title, description, language, difficulty, id FROM quizzes_quiz WHERE is_active
+    """,
+    """
+    INSERT INTO quizzes_search (rowid, title, body, language, difficulty, quiz_id)
+    SELECT question.id, '', question.question_text || char(10) || question.explanation,
+           quiz.language, quiz.difficulty, question.quiz_id
+    FROM quizzes_question question JOIN quizzes_quiz quiz ON quiz.id = question.quiz_id
+    WHERE quiz.is_active
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; search is unavailable elsewhere
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS quizzes_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0009_view_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index, hints={'model_name': 'quiz'}),
+    ]
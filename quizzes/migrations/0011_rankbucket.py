@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:00
+
+from django.db import migrations, models, router
+from django.db.models import Count, ExpressionWrapper, F
+
+# Tenth-of-a-point buckets, as RankBucket.PER_POINT when this was written
+PER_POINT = 10
+
+
+def backfill_buckets(apps, schema_editor):
+    RankBucket = apps.get_model('quizzes', 'RankBucket')
+    db_alias = schema_editor.connection.alias
+    # Attempt databases have no stats tables
+    if not router.allow_migrate_model(db_alias, RankBucket):
+        return
+    bucket = ExpressionWrapper(F('score_sum') * PER_POINT / F('attempts'), output_field=models.IntegerField())
+    rows = []
+    for model_name, scope in (('UserQuizStats', models.Value('global')), ('LeaderboardEntry', F('scope'))):
+        totals = apps.get_model('quizzes', model_name).objects.using(db_alias).order_by().annotate(
+            value=bucket, board=scope
+        ).values('board', 'value').annotate(n=Count('id'))
+        rows += [RankBucket(scope=row['board'], bucket=row['value'], count=row['n']) for row in totals]
+    RankBucket.objects.using(db_alias).bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=40)),
+                ('bucket', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('scope', 'bucket')},
+            },
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
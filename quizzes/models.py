@@ -1,7 +1,16 @@
-from django.db import models
+import hashlib
+import operator
+from collections import Counter
+from functools import reduce
+
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Q, Sum, Value
+from django.db.models.functions import Greatest, TruncMonth, TruncWeek
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from quizhub.routers import attempt_databases
+
 User = get_user_model()
 
 class Quiz(models.Model):
@@ -29,16 +38,29 @@ class Quiz(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     time_limit = models.IntegerField(default=30, help_text="Time limit in minutes")
+    # Denormalized counters, maintained by quizzes.signals
+    question_count = models.IntegerField(default=0, editable=False)
+    attempt_count = models.IntegerField(default=0, editable=False)
     
     class Meta:
         verbose_name_plural = "Quizzes"
         ordering = ['-created_at']
+        indexes = [
+            # The home page's listing, overall and per language. Active
+            # quizzes are filtered on a bare column, which only a partial
+            # index matches (see manage.py advise_indexes)
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='quiz_active_recent_idx'),
+            models.Index(
+                fields=['language', '-created_at'], condition=models.Q(is_active=True),
+                name='quiz_language_recent_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.language})"
     
     def get_total_questions(self):
-        return self.questions.count()
+        return self.question_count
 
 class Question(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
@@ -62,18 +84,61 @@ class Question(models.Model):
     def __str__(self):
         return f"Question {self.id} - {self.quiz.title}"
 
+class AnswerLayout(models.Model):
+    """
+    The ordered question ids a packed attempt's selections are aligned to.
+    A quiz only gets a new layout when its set of questions changes.
+    """
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='answer_layouts')
+    digest = models.CharField(max_length=40)
+    question_ids = models.TextField()
+    
+    class Meta:
+        unique_together = ['quiz', 'digest']
+    
+    def __str__(self):
+        return f"{self.quiz.title} layout {self.digest[:8]}"
+    
+    @classmethod
+    def for_questions(cls, quiz_id, question_ids):
+        joined = ','.join(str(question_id) for question_id in question_ids)
+        layout, created = cls.objects.get_or_create(
+            quiz_id=quiz_id,
+            digest=hashlib.sha1(joined.encode()).hexdigest(),
+            defaults={'question_ids': joined}
+        )
+        return layout
+    
+    def get_question_ids(self):
+        return tuple(int(question_id) for question_id in self.question_ids.split(',') if question_id)
+
 class QuizAttempt(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_attempts')
-    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='attempts')
+    # No database constraints on keys to tables outside the attempt
+    # databases (see quizhub.routers); deletes still cascade through the ORM
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_attempts', db_constraint=False)
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='attempts', db_constraint=False)
     score = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)])
     total_questions = models.IntegerField()
     correct_answers = models.IntegerField()
     time_taken = models.DurationField(null=True, blank=True)
     completed_at = models.DateTimeField(auto_now_add=True)
+    # Compact storage: one character per question ('-' when unanswered),
+    # aligned to answer_layout, instead of one UserAnswer row per question
+    answer_layout = models.ForeignKey(
+        AnswerLayout, on_delete=models.CASCADE, null=True, blank=True, db_constraint=False
+    )
+    packed_answers = models.TextField(blank=True)
     
     class Meta:
         ordering = ['-completed_at']
         unique_together = ['user', 'quiz', 'completed_at']
+        indexes = [
+            # Keyset pagination of a user's history (see quizhub.pagination)
+            models.Index(fields=['user', '-completed_at', '-id'], name='attempt_user_recent_idx'),
+            # A quiz's latest attempts, and the leaderboard's recent high scores
+            models.Index(fields=['quiz', '-completed_at', '-id'], name='attempt_quiz_recent_idx'),
+            models.Index(fields=['-completed_at', '-id'], name='attempt_recent_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.quiz.title} - {self.score}%"
@@ -83,7 +148,7 @@ class QuizAttempt(models.Model):
 
 class UserAnswer(models.Model):
     attempt = models.ForeignKey(QuizAttempt, on_delete=models.CASCADE, related_name='user_answers')
-    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_constraint=False)
     selected_answer = models.CharField(max_length=1, choices=[
         ('A', 'Option A'),
         ('B', 'Option B'),
@@ -97,3 +162,353 @@ class UserAnswer(models.Model):
     
     def __str__(self):
         return f"{self.attempt.user.username} - Q{self.question.id} - {self.selected_answer}"
+
+# Scope of the board ranked by UserQuizStats
+GLOBAL_SCOPE = 'global'
+
+class ScoreTotals(models.Model):
+    """Running totals over a set of attempts, ranked by average then best score."""
+    attempts = models.IntegerField(default=0)
+    score_sum = models.IntegerField(default=0)
+    best_score = models.IntegerField(default=0)
+    average_score = models.FloatField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+    
+    RANKING = ('-average_score', '-best_score', 'user_id')
+    
+    class Meta:
+        abstract = True
+    
+    @classmethod
+    def add_score(cls, lookup, score, completed_at):
+        """
+        Fold one attempt's score into the row matching ``lookup``, creating
+        it if needed. Returns whether the row was already there.
+        """
+        updated = cls.objects.filter(**lookup).update(
+            attempts=F('attempts') + 1,
+            score_sum=F('score_sum') + score,
+            best_score=Greatest('best_score', Value(score)),
+            average_score=ExpressionWrapper(
+                (F('score_sum') + score) * 1.0 / (F('attempts') + 1), output_field=models.FloatField()
+            ),
+            last_activity=completed_at
+        )
+        if updated:
+            return True
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    attempts=1,
+                    score_sum=score,
+                    best_score=score,
+                    average_score=score,
+                    last_activity=completed_at,
+                    **lookup
+                )
+        except IntegrityError:
+            # Another submission created the row first
+            return cls.add_score(lookup, score, completed_at)
+        return False
+    
+    @classmethod
+    def add_scores(cls, lookups, score, completed_at):
+        """
+        add_score() for each of ``lookups``, moving the rows between
+        RankBucket buckets: the rows that were there are read back together
+        once updated, as their old totals are one attempt fewer.
+        """
+        changes = Counter()
+        with transaction.atomic(savepoint=False):
+            updated = []
+            for lookup in lookups:
+                if cls.add_score(lookup, score, completed_at):
+                    updated.append(Q(**lookup))
+                else:
+                    changes[lookup.get('scope', GLOBAL_SCOPE), RankBucket.bucket_for(score, 1)] += 1
+            if updated:
+                # Under the row locks the updates took
+                for row in cls.objects.filter(reduce(operator.or_, updated)):
+                    scope = getattr(row, 'scope', GLOBAL_SCOPE)
+                    changes[scope, RankBucket.bucket_for(row.score_sum, row.attempts)] += 1
+                    changes[scope, RankBucket.bucket_for(row.score_sum - score, row.attempts - 1)] -= 1
+            RankBucket.apply(changes)
+    
+    @staticmethod
+    def rank_counts(rows):
+        """How many of ``rows`` fall in each ``(scope, bucket)`` of RankBucket."""
+        return Counter(
+            (getattr(row, 'scope', GLOBAL_SCOPE), RankBucket.bucket_for(row.score_sum, row.attempts))
+            for row in rows
+        )
+    
+    @classmethod
+    def totals(cls, attempts, *group_by):
+        """Aggregate ``attempts`` per user and ``group_by`` in every attempt database."""
+        return cls.combine(
+            (
+                row
+                for alias in attempt_databases()
+                for row in attempts.using(alias).order_by().values('user_id', *group_by).annotate(
+                    n=Count('id'),
+                    total=Sum('score'),
+                    best=Max('score'),
+                    last=Max('completed_at')
+                )
+            ),
+            'user_id', *group_by
+        )
+    
+    @staticmethod
+    def combine(rows, *keys):
+        """Merge the totals rows that agree on ``keys``."""
+        merged = {}
+        for row in rows:
+            key = tuple(row[name] for name in keys)
+            if key not in merged:
+                merged[key] = dict(row)
+                continue
+            into = merged[key]
+            into['n'] += row['n']
+            into['total'] += row['total']
+            into['best'] = max(into['best'], row['best'])
+            into['last'] = max(into['last'], row['last'])
+        return list(merged.values())
+    
+    @classmethod
+    def from_totals(cls, row, **fields):
+        return cls(
+            user_id=row['user_id'],
+            attempts=row['n'],
+            score_sum=row['total'],
+            best_score=row['best'],
+            average_score=row['total'] / row['n'],
+            last_activity=row['last'],
+            **fields
+        )
+
+class UserQuizStats(ScoreTotals):
+    """Per-user totals over all attempts, maintained incrementally for the leaderboard."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='quiz_stats')
+    
+    class Meta:
+        verbose_name_plural = "User quiz stats"
+        indexes = [
+            models.Index(fields=['-average_score', '-best_score', 'user'], name='stats_ranking_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.attempts} attempts"
+    
+    @classmethod
+    def record_attempt(cls, attempt):
+        cls.add_scores([{'user_id': attempt.user_id}], int(attempt.score), attempt.completed_at)
+    
+    @classmethod
+    def rebuild_for_users(cls, user_ids, rank_buckets=True):
+        """
+        Recompute the rows for ``user_ids`` from their attempts, moving them
+        between RankBucket buckets unless ``rank_buckets`` is false (for a
+        full rebuild, which recounts the buckets once at the end).
+        """
+        rows = [
+            cls.from_totals(row)
+            for row in cls.totals(QuizAttempt.objects.filter(user_id__in=user_ids))
+        ]
+        with transaction.atomic():
+            if rank_buckets:
+                counts = cls.rank_counts(rows)
+                counts.subtract(cls.rank_counts(cls.objects.filter(user_id__in=user_ids)))
+                RankBucket.apply(counts)
+            cls.objects.filter(user_id__in=user_ids).exclude(
+                user_id__in=[row.user_id for row in rows]
+            ).delete()
+            cls.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['attempts', 'score_sum', 'best_score', 'average_score', 'last_activity']
+            )
+        return len(rows)
+
+class LeaderboardEntry(ScoreTotals):
+    """
+    A user's totals within one leaderboard scope: a language, a single quiz
+    or a calendar window. Scope keys look like ``language:python``,
+    ``quiz:12``, ``week:2025-W37`` and ``month:2025-09``.
+    """
+    scope = models.CharField(max_length=40)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    
+    class Meta:
+        verbose_name_plural = "Leaderboard entries"
+        unique_together = ['scope', 'user']
+        indexes = [
+            models.Index(fields=['scope', '-average_score', '-best_score', 'user'], name='leaderboard_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} - {self.user.username}"
+    
+    @staticmethod
+    def scopes_for(language, quiz_id, completed_at):
+        iso_year, iso_week, _ = completed_at.isocalendar()
+        return [
+            f'language:{language}',
+            f'quiz:{quiz_id}',
+            f'week:{iso_year}-W{iso_week:02d}',
+            f'month:{completed_at:%Y-%m}',
+        ]
+    
+    @classmethod
+    def record_attempt(cls, attempt):
+        cls.add_scores(
+            [
+                {'scope': scope, 'user_id': attempt.user_id}
+                for scope in cls.scopes_for(attempt.quiz.language, attempt.quiz_id, attempt.completed_at)
+            ],
+            int(attempt.score),
+            attempt.completed_at
+        )
+    
+    @classmethod
+    def rebuild_for_users(cls, user_ids, rank_buckets=True):
+        """Recompute every scope's rows for ``user_ids`` from their attempts (see UserQuizStats)."""
+        attempts = QuizAttempt.objects.filter(user_id__in=user_ids)
+        rows = []
+        by_quiz = cls.totals(attempts, 'quiz_id')
+        for row in by_quiz:
+            rows.append(cls.from_totals(row, scope=f"quiz:{row['quiz_id']}"))
+        # Attempts may be in another database than quizzes, so no join
+        languages = dict(Quiz.objects.filter(pk__in={row['quiz_id'] for row in by_quiz}).values_list('id', 'language'))
+        for row in cls.combine(
+            ({**row, 'language': languages[row['quiz_id']]} for row in by_quiz if row['quiz_id'] in languages),
+            'user_id', 'language'
+        ):
+            rows.append(cls.from_totals(row, scope=f"language:{row['language']}"))
+        for row in cls.totals(attempts.annotate(window=TruncWeek('completed_at')), 'window'):
+            iso_year, iso_week, _ = row['window'].isocalendar()
+            rows.append(cls.from_totals(row, scope=f'week:{iso_year}-W{iso_week:02d}'))
+        for row in cls.totals(attempts.annotate(window=TruncMonth('completed_at')), 'window'):
+            rows.append(cls.from_totals(row, scope=f"month:{row['window']:%Y-%m}"))
+        
+        with transaction.atomic():
+            if rank_buckets:
+                counts = cls.rank_counts(rows)
+                counts.subtract(cls.rank_counts(cls.objects.filter(user_id__in=user_ids)))
+                RankBucket.apply(counts)
+            cls.objects.filter(user_id__in=user_ids).delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+class RankBucket(models.Model):
+    """
+    How many of a leaderboard's rows average within one tenth-of-a-point
+    bucket, so a user's rank is a sum over at most 1001 rows plus a count
+    within their own bucket, however far down the board they are. The
+    global board is ``scope='global'``; the others use LeaderboardEntry's
+    scope keys. Buckets are computed from the integer totals, never from
+    the float average, so they don't drift with rounding.
+    """
+    PER_POINT = 10
+    
+    scope = models.CharField(max_length=40)
+    bucket = models.IntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['scope', 'bucket']
+    
+    def __str__(self):
+        return f"{self.scope} - {self.bucket / self.PER_POINT:.1f}%: {self.count}"
+    
+    @classmethod
+    def bucket_for(cls, score_sum, attempts):
+        return score_sum * cls.PER_POINT // attempts
+    
+    @classmethod
+    def apply(cls, changes, sign=1):
+        """
+        Add ``changes``, a Counter of ``(scope, bucket)`` deltas such as
+        ScoreTotals.rank_counts() returns, times ``sign``: one upsert for
+        the lot, which ORM updates can't express as an increment.
+        """
+        rows = [(scope, bucket, sign * delta) for (scope, bucket), delta in changes.items() if delta]
+        if not rows:
+            return
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        table, scope, bucket, count = map(quote, (cls._meta.db_table, 'scope', 'bucket', 'count'))
+        sql = (
+            f'INSERT INTO {table} ({scope}, {bucket}, {count}) VALUES {{}} '
+            f'ON CONFLICT ({scope}, {bucket}) DO UPDATE SET {count} = {table}.{count} + excluded.{count}'
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), 300):
+                batch = rows[start:start + 300]
+                cursor.execute(
+                    sql.format(', '.join(['(%s, %s, %s)'] * len(batch))),
+                    [value for row in batch for value in row]
+                )
+    
+    @classmethod
+    def rebuild(cls):
+        """Recount every board's buckets from UserQuizStats and LeaderboardEntry."""
+        bucket = ExpressionWrapper(F('score_sum') * cls.PER_POINT / F('attempts'), output_field=IntegerField())
+        rows = [
+            cls(scope=GLOBAL_SCOPE, bucket=value, count=n)
+            for value, n in UserQuizStats.objects.order_by().annotate(value=bucket).values('value').annotate(
+                n=Count('id')
+            ).values_list('value', 'n')
+        ] + [
+            cls(scope=scope, bucket=value, count=n)
+            for scope, value, n in LeaderboardEntry.objects.order_by().annotate(value=bucket).values(
+                'scope', 'value'
+            ).annotate(n=Count('id')).values_list('scope', 'value', 'n')
+        ]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+class QuizScoreBucket(models.Model):
+    """
+    How many attempts on a quiz scored exactly ``score``. Scores are whole
+    percentages, so one-point buckets make percentiles exact while a whole
+    distribution is still at most 101 rows.
+    """
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='score_buckets')
+    score = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)])
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['quiz', 'score']
+    
+    def __str__(self):
+        return f"{self.quiz.title} - {self.score}%: {self.count}"
+    
+    @classmethod
+    def add(cls, quiz_id, score, delta=1):
+        updated = cls.objects.filter(quiz_id=quiz_id, score=score).update(count=F('count') + delta)
+        if not updated and delta > 0:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(quiz_id=quiz_id, score=score, count=delta)
+            except IntegrityError:
+                cls.add(quiz_id, score, delta)
+    
+    @classmethod
+    def rebuild_for_quizzes(cls, quiz_ids):
+        """Recompute the buckets for ``quiz_ids`` from their attempts."""
+        counts = Counter()
+        for alias in attempt_databases():
+            totals = QuizAttempt.objects.using(alias).filter(quiz_id__in=quiz_ids).order_by().values_list(
+                'quiz_id', 'score'
+            ).annotate(n=Count('id'))
+            for quiz_id, score, n in totals:
+                counts[quiz_id, score] += n
+        rows = [cls(quiz_id=quiz_id, score=score, count=n) for (quiz_id, score), n in counts.items()]
+        with transaction.atomic():
+            cls.objects.filter(quiz_id__in=quiz_ids).delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
@@ -0,0 +1,263 @@
+"""
+Full-text search over quizzes and their questions.
+
+Active quizzes and their questions are indexed in an SQLite FTS5 table,
+``quizzes_search``, kept in sync by quizzes.signals: one row per quiz
+(title and description) and one per question (its text and
+explanation). A row's rowid is its quiz's id negated, or its question's
+id, so single rows are replaced without scanning. Language and
+difficulty are indexed as columns of their own and filtered inside the
+MATCH, narrowing the posting lists rather than the ranked results.
+
+Results are ranked by bm25 with titles weighing most, and every term of
+two or more characters also matches as a prefix. Every match is scored,
+so the best ones are found wherever they are in the index, but only the
+best RANK_CANDIDATES are kept, in a bounded sort, and paged through.
+Matches past them can't be paged to; search() says when there are any,
+so the caller can ask for a narrower query.
+
+``manage.py rebuild_search_index`` refills the table after writes that
+bypass signals (bulk inserts, fixtures, raw SQL). Other databases have
+no FTS5; there the index is not maintained and search() falls back to
+matching words as substrings, scanning both tables.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
+
+from .models import Question, Quiz
+
+TABLE = 'quizzes_search'
+RANK_CANDIDATES = 2000
+MAX_TERMS = 8
+SNIPPET_TOKENS = 16
+
+# Highlight markers: control characters can't come from a query, so the
+# text around them can be escaped before they become <mark> tags
+START, END = '\x02', '\x03'
+TERM = re.compile(r'\w+')
+
+DIFFICULTIES = ('beginner', 'intermediate', 'advanced')
+
+
+def available(using=None):
+    return connections[using or router.db_for_write(Quiz)].vendor == 'sqlite'
+
+
+def match_expression(query, language=None, difficulty=None):
+    """The FTS5 query for ``query``'s words, or None when it has none."""
+    if language and language not in dict(Quiz.LANGUAGE_CHOICES):
+        raise ValueError(f'Unknown language: {language}')
+    if difficulty and difficulty not in DIFFICULTIES:
+        raise ValueError(f'Unknown difficulty: {difficulty}')
+    terms = TERM.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    # Quoted, so words like AND or NEAR are searched for, not operators
+    words = ' AND '.join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+    expression = f'{{title body}} : ({words})'
+    if language:
+        expression += f' AND language : "{language}"'
+    if difficulty:
+        expression += f' AND difficulty : "{difficulty}"'
+    return expression
+
+
+def search(query, language=None, difficulty=None, limit=20, offset=0):
+    """
+    Return ``(hits, has_more, truncated)`` for the best matches of
+    ``query``; ``truncated`` is true when there are matches beyond the
+    best RANK_CANDIDATES, which no page reaches. Each hit is a dict with
+    ``kind`` ('quiz' or 'question'), its ``quiz`` and ``question_id``, and
+    HTML-safe ``title`` and ``snippet`` with the matched words in <mark>
+    tags.
+    """
+    expression = match_expression(query, language, difficulty)
+    if expression is None:
+        return [], False, False
+    using = router.db_for_read(Quiz)
+    if not available(using):
+        hits, has_more = substring_search(
+            TERM.findall(query.lower())[:MAX_TERMS], language, difficulty, limit, offset, using
+        )
+        return hits, has_more, False
+
+    with connections[using].cursor() as cursor:
+        # One candidate past the cap is taken to tell whether there are
+        # more matches than are kept. FTS5 hands the candidates over best
+        # first and they are numbered in that order: reading rank again
+        # out here would score every match a second time
+        cursor.execute(
+            f'SELECT id, total FROM ('
+            f'SELECT id, ROW_NUMBER() OVER () AS n, COUNT(*) OVER () AS total FROM ('
+            f'SELECT rowid AS id FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY rank LIMIT %s'
+            f')) WHERE n <= %s LIMIT %s OFFSET %s',
+            [expression, RANK_CANDIDATES + 1, RANK_CANDIDATES, limit + 1, offset]
+        )
+        rows = cursor.fetchall()
+        ids = [row[0] for row in rows]
+        has_more = len(ids) > limit
+        ids = ids[:limit]
+        truncated = bool(rows) and rows[0][1] > RANK_CANDIDATES
+        if not rows and offset:
+            # A page past the end; found by skipping postings, without ranking them
+            cursor.execute(
+                f'SELECT 1 FROM {TABLE} WHERE {TABLE} MATCH %s LIMIT 1 OFFSET %s', [expression, RANK_CANDIDATES]
+            )
+            truncated = cursor.fetchone() is not None
+        rows = []
+        if ids:
+            # Snippets for this page only; a literal rowid list is looked
+            # up row by row, where a subquery would match everything again
+            cursor.execute(
+                f"SELECT rowid, quiz_id, highlight({TABLE}, 0, %s, %s), snippet({TABLE}, 1, %s, %s, '…', %s) "
+                f"FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid IN ({', '.join(['%s'] * len(ids))})",
+                [START, END, START, END, SNIPPET_TOKENS, expression, *ids]
+            )
+            position = {rowid: index for index, rowid in enumerate(ids)}
+            rows = sorted(cursor.fetchall(), key=lambda row: position[row[0]])
+
+    quizzes = Quiz.objects.using(using).order_by().in_bulk({quiz_id for _, quiz_id, _, _ in rows})
+    hits = []
+    for rowid, quiz_id, title, snippet in rows:
+        quiz = quizzes.get(quiz_id)
+        if quiz is None:
+            continue
+        hits.append({
+            'kind': 'quiz' if rowid < 0 else 'question',
+            'quiz': quiz,
+            'question_id': rowid if rowid > 0 else None,
+            'title': highlighted(title) if rowid < 0 else escape(quiz.title),
+            'snippet': highlighted(snippet),
+        })
+    return hits, has_more, truncated
+
+
+def substring_search(terms, language, difficulty, limit, offset, using):
+    """
+    search() without FTS5: quizzes with every term in their title or
+    description, newest first, then questions with every term in their text
+    or explanation. Nothing is ranked or highlighted.
+    """
+    quizzes = Quiz.objects.using(using).filter(is_active=True)
+    if language:
+        quizzes = quizzes.filter(language=language)
+    if difficulty:
+        quizzes = quizzes.filter(difficulty=difficulty)
+    questions = Question.objects.using(using).filter(quiz__in=quizzes)
+    for term in terms:
+        quizzes = quizzes.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        questions = questions.filter(Q(question_text__icontains=term) | Q(explanation__icontains=term))
+
+    end = offset + limit + 1
+    matches = [(quiz, None, quiz.description) for quiz in quizzes.order_by('-created_at', '-id')[:end]]
+    if len(matches) < end:
+        matches += [
+            (question.quiz, question.pk, question.question_text)
+            for question in questions.select_related('quiz').order_by('-id')[:end - len(matches)]
+        ]
+    page = matches[offset:end]
+    hits = [
+        {
+            'kind': 'quiz' if question_id is None else 'question',
+            'quiz': quiz,
+            'question_id': question_id,
+            'title': escape(quiz.title),
+            'snippet': escape(Truncator(text).words(SNIPPET_TOKENS, truncate='…')),
+        }
+        for quiz, question_id, text in page[:limit]
+    ]
+    return hits, len(page) > limit
+
+
+def highlighted(text):
+    return mark_safe(escape(text).replace(START, '<mark>').replace(END, '</mark>'))
+
+
+def rebuild(using=None):
+    """Refill the index from the quiz and question tables; returns the rows indexed."""
+    using = using or router.db_for_write(Quiz)
+    if not available(using):
+        raise ImproperlyConfigured('The quiz search index needs SQLite with FTS5.')
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, title, body, language, difficulty, quiz_id) '
+            f'SELECT -id, title, description, language, difficulty, id FROM {Quiz._meta.db_table} WHERE is_active'
+        )
+        quizzes = cursor.rowcount
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, title, body, language, difficulty, quiz_id) "
+            f"SELECT question.id, '', question.question_text || char(10) || question.explanation, "
+            f"quiz.language, quiz.difficulty, question.quiz_id "
+            f"FROM {Question._meta.db_table} question JOIN {Quiz._meta.db_table} quiz ON quiz.id = question.quiz_id "
+            f"WHERE quiz.is_active"
+        )
+        questions = cursor.rowcount
+        # Merge the index segments written above into one
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return quizzes, questions
+
+
+def index_quiz(quiz, using=None):
+    """Index an active quiz and all its questions afresh, or drop an inactive one."""
+    using = using or router.db_for_write(Quiz)
+    if not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        unindex_quiz(quiz.pk, using)
+        if not quiz.is_active:
+            return
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, title, body, language, difficulty, quiz_id) VALUES (%s, %s, %s, %s, %s, %s)',
+            [-quiz.pk, quiz.title, quiz.description, quiz.language, quiz.difficulty, quiz.pk]
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, title, body, language, difficulty, quiz_id) "
+            f"SELECT id, '', question_text || char(10) || explanation, %s, %s, quiz_id "
+            f"FROM {Question._meta.db_table} WHERE quiz_id = %s",
+            [quiz.language, quiz.difficulty, quiz.pk]
+        )
+
+
+def unindex_quiz(quiz_id, using=None):
+    using = using or router.db_for_write(Quiz)
+    if not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE rowid = %s OR rowid IN (SELECT id FROM {Question._meta.db_table} WHERE quiz_id = %s)',
+            [-quiz_id, quiz_id]
+        )
+
+
+def index_question(question, using=None):
+    """Index or re-index one question, if its quiz is active."""
+    using = using or router.db_for_write(Question)
+    if not available(using):
+        return
+    unindex_question(question.pk, using)
+    quiz = Quiz.objects.using(using).filter(pk=question.quiz_id, is_active=True).values(
+        'language', 'difficulty'
+    ).first()
+    if quiz is None:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, title, body, language, difficulty, quiz_id) VALUES (%s, %s, %s, %s, %s, %s)',
+            [question.pk, '', f'{question.question_text}\n{question.explanation}',
+             quiz['language'], quiz['difficulty'], question.quiz_id]
+        )
+
+
+def unindex_question(question_id, using=None):
+    using = using or router.db_for_write(Question)
+    if not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [question_id])
@@ -0,0 +1,274 @@
+import json
+import logging
+from collections import Counter
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from quizhub.db import retry_on_locked
+from quizhub.routers import attempt_databases, seed_attempt_ids
+
+from . import live, search
+from .answer_keys import answer_keys
+from .models import (
+    AnswerLayout, LeaderboardEntry, Question, Quiz, QuizAttempt, QuizScoreBucket, RankBucket, UserAnswer,
+    UserQuizStats,
+)
+
+User = get_user_model()
+
+logger = logging.getLogger('quizhub.db')
+
+
+@receiver(pre_save, sender=Question)
+def question_saving(sender, instance, using, **kwargs):
+    # The quiz it belonged to, in case the save moves it to another one
+    instance._saved_quiz_id = None
+    if not instance._state.adding:
+        instance._saved_quiz_id = Question.objects.using(using).filter(pk=instance.pk).values_list(
+            'quiz_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, created, using, **kwargs):
+    # Bumping updated_at changes the answer key version seen by every process
+    now = timezone.now()
+    changes = {'updated_at': now}
+    previous_quiz_id = getattr(instance, '_saved_quiz_id', None)
+    moved = previous_quiz_id is not None and previous_quiz_id != instance.quiz_id
+    if created or moved:
+        changes['question_count'] = F('question_count') + 1
+    Quiz.objects.filter(pk=instance.quiz_id).update(**changes)
+    answer_keys.invalidate(instance.quiz_id)
+    if moved:
+        Quiz.objects.filter(pk=previous_quiz_id).update(updated_at=now, question_count=F('question_count') - 1)
+        answer_keys.invalidate(previous_quiz_id)
+    search.index_question(instance, using)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, using, **kwargs):
+    Quiz.objects.filter(pk=instance.quiz_id).update(
+        updated_at=timezone.now(),
+        question_count=F('question_count') - 1
+    )
+    answer_keys.invalidate(instance.quiz_id)
+    search.unindex_question(instance.pk, using)
+
+
+@receiver(post_save, sender=Quiz)
+def quiz_saved(sender, instance, using, **kwargs):
+    # Its questions carry its language and difficulty, and go with it when it's deactivated
+    search.index_quiz(instance, using)
+
+
+@receiver(post_delete, sender=Quiz)
+def quiz_deleted(sender, instance, using, **kwargs):
+    search.unindex_quiz(instance.pk, using)
+
+
+def after_attempt_write(using, func, *args):
+    """
+    Run ``func``, which updates the main database, for an attempt written
+    on ``using``. On the main database it joins the attempt's transaction.
+    When attempts have a database of their own it runs once the attempt
+    has committed, in a transaction of its own, so the attempt's write
+    lock is never held while waiting for the main one.
+
+    A failure then can't undo the attempt, and must not reach the code
+    that wrote it: record_attempt would take it for its own and write the
+    attempt again. It is logged instead, leaving the drift to the
+    rebuild and reconcile commands.
+    """
+    if using == router.db_for_write(Quiz):
+        func(*args)
+    else:
+        transaction.on_commit(lambda: apply_derived(func, *args), using=using, robust=True)
+
+
+def apply_derived(func, *args):
+    try:
+        write_derived(func, *args)
+    except DatabaseError as exc:
+        logger.error(json.dumps({'event': 'derived_write_failed', 'function': func.__qualname__, 'error': str(exc)}))
+
+
+@retry_on_locked
+def write_derived(func, *args):
+    with transaction.atomic():
+        func(*args)
+
+
+def record_attempt_stats(attempt):
+    # update() leaves updated_at alone, so the answer key stays valid
+    Quiz.objects.filter(pk=attempt.quiz_id).update(attempt_count=F('attempt_count') + 1)
+    UserQuizStats.record_attempt(attempt)
+    LeaderboardEntry.record_attempt(attempt)
+    QuizScoreBucket.add(attempt.quiz_id, int(attempt.score))
+    # Pushed to leaderboard streams once the new totals are visible; robust,
+    # as by then the attempt is committed (see after_attempt_write)
+    transaction.on_commit(partial(live.attempt_recorded, attempt), robust=True)
+
+
+def remove_attempt_stats(attempt):
+    Quiz.objects.filter(pk=attempt.quiz_id).update(attempt_count=F('attempt_count') - 1)
+    QuizScoreBucket.add(attempt.quiz_id, int(attempt.score), -1)
+    # A best score can't be decremented, so recompute this user's rows
+    UserQuizStats.rebuild_for_users([attempt.user_id])
+    LeaderboardEntry.rebuild_for_users([attempt.user_id])
+
+
+@receiver(post_save, sender=QuizAttempt)
+def attempt_saved(sender, instance, created, using, **kwargs):
+    if created:
+        after_attempt_write(using, record_attempt_stats, instance)
+
+
+class AttemptRemovals:
+    """
+    The attempts deleted along with quizzes, users or answer layouts, whose
+    stats are fixed once the last of those is deleted rather than once per
+    attempt, each rebuilding its user's whole history. Quizzes and users
+    being deleted take their own counters and stats with them.
+
+    One batch is open per connection to the main database, in ``_removals``
+    (connections are per thread). It is applied and closed by the last
+    parent's post_delete. A delete that fails part way never gets there, so
+    the batch also registers ``committed`` with on_commit: Django discards
+    that callback when the transaction or savepoint rolls back, and a batch
+    whose callback is gone is dropped rather than reused.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.pending = 0
+        self.quiz_ids = set()
+        self.user_ids = set()
+        # (quiz_id, score) -> attempts deleted
+        self.scores = Counter()
+        self.affected_user_ids = set()
+
+    def add(self, attempt):
+        self.scores[attempt.quiz_id, int(attempt.score)] += 1
+        self.affected_user_ids.add(attempt.user_id)
+
+    def apply(self):
+        attempt_counts = Counter()
+        for (quiz_id, score), count in self.scores.items():
+            if quiz_id not in self.quiz_ids:
+                attempt_counts[quiz_id] += count
+                QuizScoreBucket.add(quiz_id, score, -count)
+        for quiz_id, count in attempt_counts.items():
+            Quiz.objects.filter(pk=quiz_id).update(attempt_count=F('attempt_count') - count)
+        user_ids = self.affected_user_ids - self.user_ids
+        if user_ids:
+            UserQuizStats.rebuild_for_users(user_ids)
+            LeaderboardEntry.rebuild_for_users(user_ids)
+
+    def committed(self):
+        # Normally closed already by the last post_delete
+        if _removals.get(self.connection) is self:
+            del _removals[self.connection]
+
+    def rolled_back(self):
+        return not any(func == self.committed for _, func, _ in self.connection.run_on_commit)
+
+
+# Main database connection -> its open AttemptRemovals
+_removals = {}
+
+
+def current_removals():
+    # Parents are deleted on the main database, wherever their attempts are
+    connection = connections[router.db_for_write(Quiz)]
+    removals = _removals.get(connection)
+    if removals is not None and removals.rolled_back():
+        del _removals[connection]
+        removals = None
+    return removals
+
+
+def removal_started(**deleting):
+    removals = current_removals()
+    if removals is None:
+        connection = connections[router.db_for_write(Quiz)]
+        removals = _removals[connection] = AttemptRemovals(connection)
+        transaction.on_commit(removals.committed, using=connection.alias)
+    removals.pending += 1
+    removals.quiz_ids.update(deleting.get('quiz_ids', ()))
+    removals.user_ids.update(deleting.get('user_ids', ()))
+
+
+def removal_finished():
+    removals = current_removals()
+    if removals is None:
+        return
+    removals.pending -= 1
+    if not removals.pending:
+        del _removals[removals.connection]
+        removals.apply()
+
+
+@receiver(post_delete, sender=QuizAttempt)
+def attempt_deleted(sender, instance, using, **kwargs):
+    removals = current_removals()
+    if removals is not None:
+        removals.add(instance)
+    else:
+        after_attempt_write(using, remove_attempt_stats, instance)
+
+
+def cascade_to_attempt_databases(model, using, **lookup):
+    # The ORM only cascades within the database it deletes from
+    for alias in attempt_databases():
+        if alias != using:
+            model.objects.using(alias).filter(**lookup).delete()
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, using, **kwargs):
+    removal_started(user_ids=[instance.pk])
+    # The user's stats rows go with the cascade; take them off the rank buckets first
+    for model in (UserQuizStats, LeaderboardEntry):
+        RankBucket.apply(model.rank_counts(model.objects.filter(user_id=instance.pk)), sign=-1)
+    cascade_to_attempt_databases(QuizAttempt, using, user_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Quiz)
+def quiz_deleting(sender, instance, using, **kwargs):
+    removal_started(quiz_ids=[instance.pk])
+    cascade_to_attempt_databases(QuizAttempt, using, quiz_id=instance.pk)
+
+
+@receiver(pre_delete, sender=AnswerLayout)
+def answer_layout_deleting(sender, instance, using, **kwargs):
+    removal_started()
+    cascade_to_attempt_databases(QuizAttempt, using, answer_layout_id=instance.pk)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Quiz)
+@receiver(post_delete, sender=AnswerLayout)
+def attempts_parent_deleted(sender, **kwargs):
+    # Every pre_delete of a delete comes before its post_deletes, so the
+    # last of these is the end of the delete
+    removal_finished()
+
+
+@receiver(pre_delete, sender=Question)
+def question_deleting(sender, instance, using, **kwargs):
+    cascade_to_attempt_databases(UserAnswer, using, question_id=instance.pk)
+
+
+@receiver(post_migrate)
+def attempt_database_migrated(sender, using, **kwargs):
+    # Before the split goes live, so new attempts can't take ids of the
+    # ones still to be moved in
+    if sender.name == 'quizzes' and using != DEFAULT_DB_ALIAS and using in attempt_databases():
+        seed_attempt_ids(using)
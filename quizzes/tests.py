@@ -1,3 +1,973 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from quizhub.broker import RESYNC, encode, get_broker
+from quizhub.routers import find_attempt, newest_attempts
+
+from . import leaderboards, live, search
+from .answer_keys import answer_keys
+from .histograms import ScoreDistribution
+from .management.commands import advise_indexes
+from .grading import attempt_answers, grade_submission, layout_question_ids, record_attempt
+from .models import (
+    AnswerLayout, LeaderboardEntry, Question, Quiz, QuizAttempt, QuizScoreBucket, RankBucket, UserAnswer,
+    UserQuizStats,
+)
+
+User = get_user_model()
+
+
+def make_quiz(author, correct_answers='ABC', **fields):
+    quiz = Quiz.objects.create(created_by=author, **{'title': 'Quiz', 'language': 'python', **fields})
+    for index, correct_answer in enumerate(correct_answers):
+        Question.objects.create(
+            quiz=quiz, question_text=f'Question {index}', option_a='a', option_b='b', option_c='c', option_d='d',
+            correct_answer=correct_answer
+        )
+    quiz.refresh_from_db()
+    return quiz
+
+
+# Once attempts have their own database, derived stats are only written when
+# it commits, which a TestCase never does; SplitAttemptsTests covers that.
+single_database_only = skipIf('attempts' in settings.DATABASES, 'needs attempts in the main database')
+
+
+class QuizTestCase(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        answer_keys.clear()
+        # Ids are reused once a test's rows are rolled back
+        layout_question_ids.cache_clear()
+        self.user = User.objects.create_user(username='taker', email='taker@example.com', password='secret')
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+
+    def answers(self, quiz, *selected):
+        question_ids = quiz.questions.order_by('id').values_list('id', flat=True)
+        return {str(question_id): answer for question_id, answer in zip(question_ids, selected) if answer is not None}
+
+
+class GradingTests(QuizTestCase):
+    def test_grades_correct_incorrect_and_missing_answers(self):
+        quiz = make_quiz(self.author, 'ABCD')
+        graded = grade_submission(quiz, self.answers(quiz, 'A', 'C', None, 'E'))
+
+        self.assertEqual(
+            [(selected, correct) for _, selected, correct in graded.answers],
+            [('A', True), ('C', False), ('', False), ('', False)]
+        )
+        self.assertEqual(graded.correct_count, 1)
+        self.assertEqual(graded.score_percentage, 25)
+        self.assertEqual(graded.packed(), 'AC--')
+
+    def test_records_the_attempt_and_its_answers_together(self):
+        quiz = make_quiz(self.author, 'ABC')
+        attempt = record_attempt(self.user, grade_submission(quiz, self.answers(quiz, 'A', 'B', 'D')), 42)
+
+        self.assertEqual((attempt.score, attempt.correct_answers, attempt.total_questions), (66, 2, 3))
+        self.assertEqual(attempt.time_taken.total_seconds(), 42)
+        self.assertEqual(
+            list(UserAnswer.objects.filter(attempt=attempt).order_by('question_id').values_list(
+                'selected_answer', 'is_correct'
+            )),
+            [('A', True), ('B', True), ('D', False)]
+        )
+
+    def test_failed_answer_write_leaves_no_attempt(self):
+        quiz = make_quiz(self.author, 'AB')
+        graded = grade_submission(quiz, self.answers(quiz, 'A', 'B'))
+        with mock.patch.object(UserAnswer.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                record_attempt(self.user, graded)
+        self.assertFalse(QuizAttempt.objects.exists())
+
+
+class AnswerKeyTests(QuizTestCase):
+    def grade(self, quiz, *selected):
+        quiz.refresh_from_db()
+        return grade_submission(quiz, self.answers(quiz, *selected)).correct_count
+
+    def test_editing_a_question_invalidates_the_key(self):
+        quiz = make_quiz(self.author, 'AB')
+        self.assertEqual(self.grade(quiz, 'A', 'B'), 2)
+
+        question = quiz.questions.order_by('id').first()
+        question.correct_answer = 'C'
+        question.save()
+
+        self.assertEqual(self.grade(quiz, 'A', 'B'), 1)
+        self.assertEqual(self.grade(quiz, 'C', 'B'), 2)
+
+    def test_adding_and_deleting_questions_invalidates_the_key(self):
+        quiz = make_quiz(self.author, 'AB')
+        self.assertEqual(len(answer_keys.get(quiz)), 2)
+
+        Question.objects.create(
+            quiz=quiz, question_text='New', option_a='a', option_b='b', option_c='c', option_d='d', correct_answer='D'
+        )
+        self.assertEqual(self.grade(quiz, 'A', 'B', 'D'), 3)
+
+        quiz.questions.order_by('id').first().delete()
+        self.assertEqual(self.grade(quiz, 'B', 'D'), 2)
+        self.assertEqual(len(answer_keys.get(quiz)), 2)
+
+    def test_stale_quiz_instances_see_the_new_key(self):
+        # The local copy is dropped too, not only left behind by the new version
+        quiz = make_quiz(self.author, 'AB')
+        answers = self.answers(quiz, 'A', 'B')
+        self.assertEqual(grade_submission(quiz, answers).correct_count, 2)
+
+        question = quiz.questions.order_by('id').last()
+        question.correct_answer = 'A'
+        question.save()
+
+        self.assertEqual(grade_submission(quiz, answers).correct_count, 1)
+
+    def test_cached_key_is_reused_while_the_quiz_is_unchanged(self):
+        quiz = make_quiz(self.author, 'AB')
+        answer_key = answer_keys.get(quiz)
+        with self.assertNumQueries(0):
+            self.assertIs(answer_keys.get(quiz), answer_key)
+
+
+@single_database_only
+class QuizCounterTests(QuizTestCase):
+    def counts(self, *quizzes):
+        return [
+            tuple(Quiz.objects.filter(pk=quiz.pk).values_list('question_count', 'attempt_count').get())
+            for quiz in quizzes
+        ]
+
+    def test_question_writes_keep_question_count(self):
+        quiz = make_quiz(self.author, 'ABC')
+        self.assertEqual(self.counts(quiz), [(3, 0)])
+
+        question = quiz.questions.first()
+        question.question_text = 'Edited'
+        question.save()
+        self.assertEqual(self.counts(quiz), [(3, 0)])
+
+        question.delete()
+        self.assertEqual(self.counts(quiz), [(2, 0)])
+
+    def test_moving_a_question_updates_both_quizzes(self):
+        source = make_quiz(self.author, 'AB')
+        target = make_quiz(self.author, 'C')
+        self.assertEqual(len(answer_keys.get(source)), 2)
+
+        question = source.questions.order_by('id').last()
+        question.quiz = target
+        question.save()
+
+        self.assertEqual(self.counts(source, target), [(1, 0), (2, 0)])
+        source.refresh_from_db()
+        target.refresh_from_db()
+        self.assertEqual(len(answer_keys.get(source)), 1)
+        self.assertEqual(answer_keys.get(target).correct_answers[question.pk], 'B')
+
+    def test_attempt_writes_keep_attempt_count(self):
+        quiz = make_quiz(self.author, 'AB')
+        attempts = [record_attempt(self.user, grade_submission(quiz, {})) for _ in range(2)]
+        self.assertEqual(self.counts(quiz), [(2, 2)])
+
+        attempts[0].delete()
+        self.assertEqual(self.counts(quiz), [(2, 1)])
+
+    def test_reconcile_repairs_drift(self):
+        quiz = make_quiz(self.author, 'AB')
+        record_attempt(self.user, grade_submission(quiz, {}))
+        Quiz.objects.filter(pk=quiz.pk).update(question_count=7, attempt_count=0)
+
+        call_command('reconcile_quiz_counters', stdout=StringIO())
+        self.assertEqual(self.counts(quiz), [(2, 1)])
+
+
+class PackedAnswerTests(QuizTestCase):
+    """Packed attempts read back the same answers as UserAnswer rows."""
+
+    def setUp(self):
+        super().setUp()
+        self.quiz = make_quiz(self.author, 'ABCD')
+        self.selections = [('A', 'B', 'C', 'D'), ('B', None, 'C', None), (None, None, None, None)]
+
+    def record(self, compact):
+        return [
+            record_attempt(self.user, grade_submission(self.quiz, self.answers(self.quiz, *selected)), compact=compact)
+            for selected in self.selections
+        ]
+
+    def read(self, attempt):
+        attempt = QuizAttempt.objects.get(pk=attempt.pk)
+        return [(answer.question.pk, answer.selected_answer, answer.is_correct) for answer in attempt_answers(attempt)]
+
+    def test_compact_and_row_storage_agree(self):
+        rows = self.record(compact=False)
+        packed = self.record(compact=True)
+
+        self.assertEqual([self.read(attempt) for attempt in packed], [self.read(attempt) for attempt in rows])
+        self.assertEqual(QuizAttempt.objects.get(pk=packed[1].pk).packed_answers, 'B-C-')
+        self.assertFalse(UserAnswer.objects.filter(attempt__in=packed).exists())
+        self.assertEqual(AnswerLayout.objects.filter(quiz=self.quiz).count(), 1)
+
+    def test_pack_user_answers_round_trip(self):
+        attempts = self.record(compact=False)
+        before = [self.read(attempt) for attempt in attempts]
+
+        call_command('pack_user_answers', chunk_size=2, stdout=StringIO())
+
+        self.assertEqual([self.read(attempt) for attempt in attempts], before)
+        self.assertFalse(UserAnswer.objects.exists())
+        self.assertEqual(
+            list(QuizAttempt.objects.order_by('id').values_list('packed_answers', flat=True)),
+            ['ABCD', 'B-C-', '----']
+        )
+        self.assertEqual(AnswerLayout.objects.filter(quiz=self.quiz).count(), 1)
+
+    def test_deleted_questions_are_skipped(self):
+        attempt = self.record(compact=True)[0]
+        self.quiz.questions.order_by('id').first().delete()
+
+        self.assertEqual([selected for _, selected, _ in self.read(attempt)], ['B', 'C', 'D'])
+
+    def test_result_page_shows_packed_answers(self):
+        attempt = self.record(compact=True)[1]
+        self.client.force_login(self.user)
+
+        response = self.client.get(f'/quiz/{self.quiz.pk}/result/{attempt.pk}/')
+        self.assertEqual(
+            [(answer.selected_answer, answer.is_correct) for answer in response.context['user_answers']],
+            [('B', False), ('', False), ('C', True), ('', False)]
+        )
+
+
+@single_database_only
+class CascadingDeleteTests(QuizTestCase):
+    """Deleting a user, quiz or answer layout fixes the stats of the attempts that go with it."""
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.first = make_quiz(self.author, 'AB')
+        self.second = make_quiz(self.author, 'AB')
+        self.attempt(self.user, self.first, 'A', 'B')
+        self.attempt(self.user, self.second, 'A', 'A')
+        self.attempt(self.other, self.first, 'B', 'A')
+
+    def attempt(self, user, quiz, *selected, compact=False):
+        return record_attempt(user, grade_submission(quiz, self.answers(quiz, *selected)), compact=compact)
+
+    def attempt_counts(self):
+        return list(Quiz.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('pk').values_list(
+            'attempt_count', flat=True
+        ))
+
+    def buckets(self, quiz):
+        return dict(QuizScoreBucket.objects.filter(quiz=quiz, count__gt=0).values_list('score', 'count'))
+
+    def stats(self, user):
+        return UserQuizStats.objects.filter(user=user).values_list('attempts', 'score_sum', 'best_score').first()
+
+    def scopes(self, user):
+        return set(LeaderboardEntry.objects.filter(user=user).values_list('scope', flat=True))
+
+    def test_deleting_a_user(self):
+        self.user.delete()
+
+        self.assertEqual(self.attempt_counts(), [1, 0])
+        self.assertEqual(self.buckets(self.first), {0: 1})
+        self.assertEqual(self.buckets(self.second), {})
+        self.assertFalse(LeaderboardEntry.objects.filter(user_id=self.user.pk).exists())
+        self.assertEqual(self.stats(self.other), (1, 0, 0))
+
+    def test_deleting_a_quiz(self):
+        self.first.delete()
+
+        self.assertEqual(self.attempt_counts(), [1])
+        self.assertEqual(self.buckets(self.second), {50: 1})
+        self.assertEqual(self.stats(self.user), (1, 50, 50))
+        self.assertNotIn(f'quiz:{self.first.pk}', self.scopes(self.user))
+        self.assertIsNone(self.stats(self.other))
+        self.assertEqual(self.scopes(self.other), set())
+
+    def test_deleting_an_answer_layout(self):
+        self.attempt(self.other, self.second, 'A', 'B', compact=True)
+        self.assertEqual(self.stats(self.other), (2, 100, 100))
+
+        AnswerLayout.objects.get(quiz=self.second).delete()
+
+        self.assertEqual(self.attempt_counts(), [2, 1])
+        self.assertEqual(self.buckets(self.second), {50: 1})
+        self.assertEqual(self.stats(self.other), (1, 0, 0))
+        self.assertNotIn(f'quiz:{self.second.pk}', self.scopes(self.other))
+
+    def test_delete_after_one_that_rolled_back(self):
+        def fail_on_attempts(model, using, **lookup):
+            # After the quiz's pre_delete has opened its batch
+            if model is QuizAttempt:
+                raise RuntimeError('cascade failed')
+
+        with mock.patch('quizzes.signals.cascade_to_attempt_databases', side_effect=fail_on_attempts):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.first.delete()
+        self.assertEqual(self.attempt_counts(), [2, 1])
+
+        self.user.delete()
+
+        self.assertEqual(self.attempt_counts(), [1, 0])
+        self.assertEqual(self.buckets(self.first), {0: 1})
+        self.assertEqual(self.stats(self.other), (1, 0, 0))
+
+
+@single_database_only
+class ScoreDistributionTests(QuizTestCase):
+    """The incrementally kept histogram agrees with counting the attempts."""
+
+    def setUp(self):
+        super().setUp()
+        self.quiz = make_quiz(self.author, 'A')
+        rng = random.Random(7)
+        self.scores = [0, 100, 100, 50, 9, 10] + [rng.randint(0, 100) for _ in range(60)]
+        users = [self.user, self.author]
+        self.attempts = [
+            QuizAttempt.objects.create(
+                user=users[index % 2], quiz=self.quiz, score=score, total_questions=1, correct_answers=0
+            )
+            for index, score in enumerate(self.scores)
+        ]
+
+    def assert_matches_attempts(self):
+        scores = list(QuizAttempt.objects.filter(quiz=self.quiz).values_list('score', flat=True))
+        distribution = ScoreDistribution.for_quiz(self.quiz)
+
+        self.assertEqual(distribution.total, len(scores))
+        for score in range(101):
+            expected = round(sum(1 for s in scores if s < score) / len(scores) * 100) if scores else 0
+            self.assertEqual(distribution.percentile(score), expected, score)
+        for width in (1, 10, 25, 100):
+            bins = distribution.binned(width)
+            self.assertEqual(sum(b['count'] for b in bins), len(scores))
+            for b in bins:
+                self.assertEqual(b['count'], sum(1 for s in scores if b['min'] <= s <= b['max']), (width, b))
+
+    def test_matches_a_brute_force_count(self):
+        self.assert_matches_attempts()
+        bins = ScoreDistribution.for_quiz(self.quiz).binned(10)
+        self.assertEqual((bins[0]['min'], bins[0]['max'], bins[-1]['min'], bins[-1]['max']), (0, 9, 90, 100))
+
+    def test_follows_deletes_and_rebuilds(self):
+        for attempt in self.attempts[::3]:
+            attempt.delete()
+        self.assert_matches_attempts()
+
+        QuizScoreBucket.objects.filter(quiz=self.quiz).update(count=0)
+        call_command('rebuild_score_histograms', stdout=StringIO())
+        self.assert_matches_attempts()
+
+    def test_empty_quiz(self):
+        distribution = ScoreDistribution.for_quiz(make_quiz(self.author, 'A'))
+        self.assertEqual((distribution.total, distribution.percentile(50)), (0, 0))
+        self.assertEqual({b['count'] for b in distribution.binned()}, {0})
+
+    def test_endpoint(self):
+        data = self.client.get(f'/quiz/{self.quiz.pk}/distribution/', {'width': 25, 'score': 50}).json()
+
+        self.assertEqual(data['total_attempts'], len(self.scores))
+        self.assertEqual(len(data['buckets']), 4)
+        self.assertEqual(data['percentile'], ScoreDistribution.for_quiz(self.quiz).percentile(50))
+        response = self.client.get(f'/quiz/{self.quiz.pk}/distribution/', {'width': 7})
+        self.assertEqual(response.status_code, 400)
+
+
+class SubmitQuizTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def submit(self, quiz, body):
+        response = self.client.post(f'/quiz/{quiz.pk}/submit/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_submission(self):
+        quiz = make_quiz(self.author, 'ABC')
+        data = self.submit(quiz, json.dumps({'answers': self.answers(quiz, 'A', 'D'), 'time_taken': 30}))
+
+        attempt = QuizAttempt.objects.get()
+        self.assertEqual(data, {
+            'success': True, 'attempt_id': attempt.pk, 'score': 33.33, 'correct_answers': 1, 'total_questions': 3,
+        })
+        self.assertEqual(attempt.user, self.user)
+        self.assertEqual(attempt.user_answers.count(), 3)
+
+    def test_quiz_without_questions(self):
+        quiz = make_quiz(self.author, '')
+        data = self.submit(quiz, json.dumps({'answers': {}}))
+
+        self.assertEqual(data, {'success': False, 'message': 'No questions in this quiz'})
+        self.assertFalse(QuizAttempt.objects.exists())
+
+    def test_invalid_json(self):
+        quiz = make_quiz(self.author, 'A')
+        data = self.submit(quiz, '{"answers": ')
+
+        self.assertEqual(data, {'success': False, 'message': 'Invalid data format'})
+        self.assertFalse(QuizAttempt.objects.exists())
+
+    def test_inactive_quiz(self):
+        quiz = make_quiz(self.author, 'A', is_active=False)
+        response = self.client.post(f'/quiz/{quiz.pk}/submit/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ROOT_URLCONF='quizhub.asgi_urls')
+class AsyncSubmitQuizTests(QuizTestCase):
+    """submit_quiz as served over ASGI (see quizhub.asgi_urls)."""
+
+    def setUp(self):
+        super().setUp()
+        self.quiz = make_quiz(self.author, 'AB')
+        self.selected = self.answers(self.quiz, 'A', 'C')
+
+    async def submit(self, quiz, body):
+        response = await self.async_client.post(f'/quiz/{quiz.pk}/submit/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_submission(self):
+        await self.async_client.aforce_login(self.user)
+        data = await self.submit(self.quiz, json.dumps({'answers': self.selected, 'time_taken': 12}))
+
+        attempt = await QuizAttempt.objects.aget()
+        self.assertEqual(data, {
+            'success': True, 'attempt_id': attempt.pk, 'score': 50.0, 'correct_answers': 1, 'total_questions': 2,
+        })
+        self.assertEqual((attempt.user_id, attempt.time_taken.total_seconds()), (self.user.pk, 12))
+        self.assertEqual(await attempt.user_answers.acount(), 2)
+
+    async def test_rejected_submissions(self):
+        empty = await Quiz.objects.acreate(title='Empty', language='python', created_by=self.author)
+        await self.async_client.aforce_login(self.user)
+
+        self.assertEqual(
+            await self.submit(self.quiz, '{"answers": '), {'success': False, 'message': 'Invalid data format'}
+        )
+        self.assertEqual(
+            await self.submit(empty, '{"answers": {}}'), {'success': False, 'message': 'No questions in this quiz'}
+        )
+        self.assertFalse(await QuizAttempt.objects.aexists())
+
+    async def test_needs_login(self):
+        response = await self.async_client.post(
+            f'/quiz/{self.quiz.pk}/submit/', '{}', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await QuizAttempt.objects.aexists())
+
+
+@single_database_only
+class LeaderboardTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quiz = make_quiz(self.author, 'ABCD')
+        self.users = {}
+
+    def take(self, username, *scores):
+        """Record an attempt scoring each of ``scores`` (a multiple of 25) for ``username``."""
+        user = self.users.get(username)
+        if user is None:
+            user = self.users[username] = User.objects.create(username=username, email=f'{username}@example.com')
+        for score in scores:
+            correct = score // 25
+            selected = ['ABCD'[index] if index < correct else 'X' for index in range(4)]
+            record_attempt(user, grade_submission(self.quiz, self.answers(self.quiz, *selected)))
+        return user
+
+    def ranked(self, scope=leaderboards.GLOBAL_SCOPE):
+        return [entry.user.username for entry in leaderboards.top(scope, limit=100)]
+
+    def assert_buckets_counted(self):
+        buckets = set(RankBucket.objects.filter(count__gt=0).values_list('scope', 'bucket', 'count'))
+        RankBucket.rebuild()
+        self.assertEqual(buckets, set(RankBucket.objects.values_list('scope', 'bucket', 'count')))
+
+    def test_scope_for(self):
+        when = datetime(2025, 1, 1, 12)
+        self.assertEqual(leaderboards.scope_for(), leaderboards.GLOBAL_SCOPE)
+        self.assertEqual(leaderboards.scope_for(language='python', quiz_id='7'), 'quiz:7')
+        self.assertEqual(leaderboards.scope_for(language='python', window='week'), 'language:python')
+        self.assertEqual(leaderboards.scope_for(window='week', when=when), 'week:2025-W01')
+        self.assertEqual(leaderboards.scope_for(window='month', when=when), 'month:2025-01')
+        for kwargs in ({'language': 'cobol'}, {'window': 'year'}, {'quiz_id': 'seven'}):
+            with self.subTest(**kwargs), self.assertRaises(ValueError):
+                leaderboards.scope_for(**kwargs)
+
+    def test_ties_break_on_best_score_then_user_id(self):
+        self.take('steady', 50, 50)
+        self.take('swingy', 25, 75)
+        self.take('later', 50)
+        self.take('ace', 100)
+        self.take('zero', 0)
+
+        order = ['ace', 'swingy', 'steady', 'later', 'zero']
+        self.assertEqual(self.ranked(), order)
+        self.assertEqual(self.ranked('language:python'), order)
+        self.assertEqual(
+            [leaderboards.rank_of(leaderboards.GLOBAL_SCOPE, self.users[name])[0] for name in order], [1, 2, 3, 4, 5]
+        )
+        self.assertEqual([entry.user.username for entry in leaderboards.top(leaderboards.GLOBAL_SCOPE, 2, 2)],
+                         ['steady', 'later'])
+
+    def test_ranks_and_neighbours_match_a_sorted_board(self):
+        scores = random.Random(5)
+        for index in range(40):
+            self.take(f'user{index:02d}', *scores.choices([0, 25, 50, 75, 100], k=scores.randint(1, 4)))
+        self.users['user07'].delete()
+        self.take('user08', 100)
+        self.assert_buckets_counted()
+
+        for scope in (leaderboards.GLOBAL_SCOPE, f'quiz:{self.quiz.pk}'):
+            expected = list(leaderboards.board(scope).order_by('-average_score', '-best_score', 'user_id').values_list(
+                'user__username', flat=True
+            ))
+            self.assertEqual(self.ranked(scope), expected)
+            for index, username in enumerate(expected):
+                with self.subTest(scope=scope, username=username):
+                    rank, entry = leaderboards.rank_of(scope, self.users[username])
+                    self.assertEqual((rank, entry.user.username), (index + 1, username))
+                    rank, offset, entries = leaderboards.around(scope, self.users[username], radius=3)
+                    self.assertEqual(rank, index + 1)
+                    self.assertEqual(offset, max(0, index - 3))
+                    self.assertEqual([entry.user.username for entry in entries], expected[offset:index + 4])
+
+    def test_rank_lookups_dont_walk_the_board(self):
+        for index in range(30):
+            self.take(f'user{index:02d}', 25 * (index % 4))
+        leader, last = self.users['user03'], self.users['user28']
+
+        for user, rank in ((leader, 1), (last, 30)):
+            with self.subTest(rank=rank):
+                # The entry, the bucket sums and one count within the bucket
+                with self.assertNumQueries(3):
+                    self.assertEqual(leaderboards.rank_of(leaderboards.GLOBAL_SCOPE, user)[0], rank)
+                # Plus one seek to the side with neighbours, who share the user's average
+                with self.assertNumQueries(4):
+                    leaderboards.around(leaderboards.GLOBAL_SCOPE, user, radius=1)
+
+        plan = ' '.join(row[-1] for row in connection.cursor().execute(
+            'EXPLAIN QUERY PLAN ' + str(leaderboards.board(leaderboards.GLOBAL_SCOPE).filter(
+                average_score__gte=0, average_score__lt=0.1
+            ).only('id').query)
+        ))
+        self.assertIn('stats_ranking_idx', plan)
+
+    def test_user_without_a_ranking(self):
+        self.take('ace', 100)
+        nobody = self.take('nobody')
+
+        self.assertEqual(leaderboards.rank_of(leaderboards.GLOBAL_SCOPE, nobody), (None, None))
+        self.assertEqual(leaderboards.around('language:java', self.users['ace']), (None, 0, []))
+        self.client.force_login(nobody)
+        data = self.client.get('/leaderboard/data/').json()
+        self.assertEqual([entry['username'] for entry in data['entries']], ['ace'])
+        self.assertIsNone(data['me'])
+
+    def test_leaderboard_data(self):
+        for index, score in enumerate([100, 75, 75, 50, 25, 0]):
+            self.take(f'user{index}', score)
+        self.client.force_login(self.users['user4'])
+
+        data = self.client.get('/leaderboard/data/', {'language': 'python', 'page': 2, 'size': 2}).json()
+        self.assertEqual(data['scope'], 'language:python')
+        self.assertEqual(
+            [(entry['rank'], entry['username'], entry['best_score']) for entry in data['entries']],
+            [(3, 'user2', 75), (4, 'user3', 50)]
+        )
+        self.assertEqual(data['me']['rank'], 5)
+        self.assertEqual([entry['rank'] for entry in data['me']['around']], [1, 2, 3, 4, 5, 6])
+
+        response = self.client.get('/leaderboard/data/', {'language': 'cobol'})
+        self.assertEqual((response.status_code, response.json()['success']), (400, False))
+        self.assertEqual(self.client.get('/leaderboard/data/', {'window': 'decade'}).status_code, 400)
+
+
+class Stream:
+    """A client of the leaderboard stream, driving quizhub.asgi's application with a raw ASGI scope."""
+
+    def __init__(self, query):
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/leaderboard/stream/', 'raw_path': b'/leaderboard/stream/', 'root_path': '',
+            'query_string': query.encode(), 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 5000), 'server': ('testserver', 80),
+        }
+        self.requested = False
+        self.disconnected = asyncio.Event()
+        # Cleared to stop reading, as a stalled tab would
+        self.reading = asyncio.Event()
+        self.reading.set()
+        self.sent = asyncio.Queue()
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        await self.sent.put(message)
+        if message['type'] == 'http.response.body':
+            await self.reading.wait()
+
+    async def start(self):
+        from quizhub.asgi import application
+
+        self.task = asyncio.create_task(application(self.scope, self.receive, self.send))
+        start = await asyncio.wait_for(self.sent.get(), 5)
+        self.status = start['status']
+        await self.body()
+
+    async def body(self):
+        while True:
+            message = await asyncio.wait_for(self.sent.get(), 5)
+            if message['type'] == 'http.response.body':
+                return message['body']
+
+    async def close(self):
+        self.reading.set()
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, 5)
+
+
+@single_database_only
+@override_settings(LIVE_UPDATES={'QUEUE_SIZE': 2, 'KEEPALIVE': 60})
+class LiveLeaderboardTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        # As the test client does, so the request doesn't close the test's connection
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        self.broker = get_broker()
+        python, java = make_quiz(self.author, 'AB'), make_quiz(self.author, 'AB', language='java')
+        self.python_attempt = record_attempt(self.user, grade_submission(python, self.answers(python, 'C', 'C')))
+        self.java_attempt = record_attempt(self.user, grade_submission(java, self.answers(java, 'A', 'C')))
+
+    async def test_streams_get_events_for_their_own_board(self):
+        stream = await self.open('language=java')
+        try:
+            await sync_to_async(live.attempt_recorded)(self.python_attempt)
+            await sync_to_async(live.attempt_recorded)(self.java_attempt)
+            event = await stream.body()
+        finally:
+            await stream.close()
+        self.assertTrue(event.startswith(b'event: rank\n'))
+        self.assertEqual(json.loads(event.split(b'data: ')[1])['average_score'], 50)
+        self.assertIn(b'"username":"taker"', event)
+
+    async def test_slow_client_is_sent_a_resync(self):
+        stream = await self.open('language=python')
+        topic = live.board_topic('language:python')
+        try:
+            stream.reading.clear()
+            self.broker.publish(topic, 'rank', {'rank': 1})
+            # The first is being written to the stalled client; two fill the queue
+            self.assertEqual((await stream.sent.get())['body'], encode('rank', {'rank': 1}))
+            for rank in range(2, 6):
+                self.broker.publish(topic, 'rank', {'rank': rank})
+            await asyncio.sleep(0.05)
+            stream.reading.set()
+            self.assertEqual(await stream.body(), RESYNC)
+            # Events flow again once the resync is read
+            self.broker.publish(topic, 'rank', {'rank': 6})
+            self.assertEqual(await stream.body(), encode('rank', {'rank': 6}))
+        finally:
+            await stream.close()
+
+    async def test_disconnecting_unsubscribes(self):
+        topic = live.board_topic(f'quiz:{self.python_attempt.quiz_id}')
+        stream = await self.open(f'quiz={self.python_attempt.quiz_id}')
+        self.assertTrue(self.broker.has_subscribers(topic))
+
+        await stream.close()
+        self.assertFalse(self.broker.has_subscribers(topic))
+        await sync_to_async(self.assert_nothing_ranked)()
+
+    async def test_unknown_board(self):
+        stream = Stream('language=cobol')
+        await stream.start()
+        self.assertEqual(stream.status, 400)
+        await stream.close()
+
+    def test_wsgi_gets_no_content(self):
+        response = self.client.get('/leaderboard/stream/', {'language': 'python'})
+        self.assertEqual(response.status_code, 204)
+
+    def assert_nothing_ranked(self):
+        # Nobody watches the board, so nothing is read for it
+        with self.assertNumQueries(0):
+            live.attempt_recorded(self.python_attempt)
+
+    async def open(self, query):
+        stream = Stream(query)
+        await stream.start()
+        self.assertEqual(stream.status, 200)
+        return stream
+
+
+class SearchTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        self.loops = Quiz.objects.create(
+            title='Python loops', description='for and while <b>loops</b>', language='python', created_by=self.author
+        )
+        self.java = Quiz.objects.create(
+            title='Java generics', description='Type parameters', language='java', difficulty='advanced',
+            created_by=self.author
+        )
+        Question.objects.create(
+            quiz=self.java, question_text='What does NEAR "mean" in a loop?', option_a='a', option_b='b',
+            option_c='c', option_d='d', correct_answer='A'
+        )
+
+    def kinds(self, *args, **kwargs):
+        hits, _, _ = search.search(*args, **kwargs)
+        return [(hit['kind'], hit['quiz']) for hit in hits]
+
+    def test_matches_prefixes_and_highlights_escaped_text(self):
+        hits, has_more, truncated = search.search('loop')
+
+        self.assertEqual([(hit['kind'], hit['quiz']) for hit in hits], [('quiz', self.loops), ('question', self.java)])
+        self.assertEqual((has_more, truncated), (False, False))
+        self.assertEqual(hits[0]['title'], 'Python <mark>loops</mark>')
+        self.assertIn('&lt;b&gt;<mark>loops</mark>&lt;/b&gt;', hits[0]['snippet'])
+
+    def test_operators_and_quotes_are_searched_as_words(self):
+        self.assertEqual(self.kinds('NEAR'), [('question', self.java)])
+        self.assertEqual(self.kinds('"mean" near'), [('question', self.java)])
+        self.assertEqual(self.kinds('mean AND'), [])
+        self.assertEqual(self.kinds('OR loops'), [])
+        self.assertEqual(self.kinds('*^():'), [])
+
+    def test_filters(self):
+        self.assertEqual(self.kinds('loop', language='java'), [('question', self.java)])
+        self.assertEqual(self.kinds('loop', difficulty='beginner'), [('quiz', self.loops)])
+        with self.assertRaises(ValueError):
+            search.search('loop', language='cobol')
+
+    def test_inactive_quizzes_and_their_questions_are_left_out(self):
+        self.java.is_active = False
+        self.java.save()
+        self.assertEqual(self.kinds('loop'), [('quiz', self.loops)])
+
+    def test_paging(self):
+        first, has_more, _ = search.search('loop', limit=1)
+        second, more_after, _ = search.search('loop', limit=1, offset=1)
+
+        self.assertEqual([hit['kind'] for hit in first + second], ['quiz', 'question'])
+        self.assertEqual((has_more, more_after), (True, False))
+
+    def test_reports_matches_past_the_ranked_candidates(self):
+        with mock.patch.object(search, 'RANK_CANDIDATES', 1):
+            hits, has_more, truncated = search.search('loop')
+            past_the_end = search.search('loop', offset=1)
+        self.assertEqual((len(hits), has_more, truncated), (1, False, True))
+        self.assertEqual(past_the_end, ([], False, True))
+
+        with mock.patch.object(search, 'RANK_CANDIDATES', 2):
+            self.assertFalse(search.search('loop')[2])
+
+    def test_the_best_matches_are_kept_wherever_they_are_indexed(self):
+        # Quizzes are indexed under their negated id, so this one comes first
+        Quiz.objects.create(
+            title='Java streams', description='Mapping and filtering a stream rather than writing a loop',
+            language='java', created_by=self.author
+        )
+        with mock.patch.object(search, 'RANK_CANDIDATES', 1):
+            hits, has_more, truncated = search.search('loop')
+        self.assertEqual([(hit['kind'], hit['quiz']) for hit in hits], [('quiz', self.loops)])
+        self.assertEqual((has_more, truncated), (False, True))
+
+    def test_substring_fallback(self):
+        with mock.patch.object(search, 'available', return_value=False):
+            hits, has_more, truncated = search.search('oop', language='python')
+        self.assertEqual([(hit['kind'], hit['quiz']) for hit in hits], [('quiz', self.loops)])
+        self.assertEqual((has_more, truncated), (False, False))
+
+    def test_data_endpoint(self):
+        data = self.client.get('/search/data/', {'q': 'generics', 'size': 5}).json()
+        self.assertEqual(data['results'][0]['quiz_id'], self.java.pk)
+        self.assertEqual((data['has_more'], data['truncated']), (False, False))
+
+        response = self.client.get('/search/data/', {'q': 'loop', 'difficulty': 'expert'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdviseIndexesTests(TransactionTestCase):
+    """The plans are read and the proposals tried on the test database itself."""
+
+    def advise(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        out = StringIO()
+        advise_indexes.Command(stdout=out).report({('default', sql): {'params': params, 'views': ['example']}}, False)
+        return out.getvalue()
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            return {
+                name for name, info in connection.introspection.get_constraints(cursor, Quiz._meta.db_table).items()
+                if info['index']
+            }
+
+    def test_proposes_an_index_for_a_scan_and_sort(self):
+        before = self.indexes()
+
+        report = self.advise(Quiz.objects.filter(difficulty='advanced').order_by('-created_at'))
+
+        self.assertIn("-> quizzes.Quiz: models.Index(fields=['difficulty', '-created_at']) (confirmed)", report)
+        self.assertIn('1 with table scans or temporary sorts', report)
+        # Only tried, never left behind
+        self.assertEqual(self.indexes(), before)
+
+    def test_existing_indexes_arent_proposed(self):
+        recent = Quiz.objects.filter(is_active=True).order_by('-created_at')
+        report = self.advise(recent)
+        self.assertIn('0 with table scans or temporary sorts', report)
+        self.assertNotIn('models.Index', report)
+
+        sql, params = recent.query.sql_with_params()
+        proposal = advise_indexes.Proposal(Quiz, sql, params)
+        self.assertIsNone(proposal.index)
+        self.assertEqual(proposal.notes, [
+            "quizzes.Quiz: models.Index(fields=['-created_at'], condition=Q(is_active=True)) already exists; "
+            "the planner prefers another plan"
+        ])
+
+    def test_leading_wildcards_are_reported_as_unindexable(self):
+        report = self.advise(Quiz.objects.filter(title__icontains='loop').order_by())
+        self.assertIn('title LIKE with a leading wildcard: no B-tree index can serve it', report)
+        self.assertNotIn('models.Index', report)
+
+
+@skipUnless(
+    'attempts' in settings.DATABASES and settings.ATTEMPT_ARCHIVES,
+    'needs QUIZHUB_SPLIT_ATTEMPTS=1 and QUIZHUB_ATTEMPT_ARCHIVES set'
+)
+class SplitAttemptsTests(TransactionTestCase):
+    """Attempts in their own database and an archive, with stats on the main one."""
+
+    databases = '__all__'
+    answers = QuizTestCase.answers
+
+    def setUp(self):
+        answer_keys.clear()
+        layout_question_ids.cache_clear()
+        self.archive = settings.ATTEMPT_ARCHIVES[0]
+        self.user = User.objects.create_user(username='taker', email='taker@example.com', password='secret')
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        self.quiz = make_quiz(self.author, 'AB')
+
+    def submit(self, user, *selected, using=None):
+        graded = grade_submission(self.quiz, self.answers(self.quiz, *selected))
+        if using is None:
+            return record_attempt(user, graded)
+        # As written before the split, on the main database
+        attempt = QuizAttempt.objects.using(using).create(
+            user=user, quiz=self.quiz, score=int(graded.score_percentage),
+            total_questions=graded.total_questions, correct_answers=graded.correct_count
+        )
+        UserAnswer.objects.using(using).bulk_create([
+            UserAnswer(attempt=attempt, question=question, selected_answer=answer, is_correct=correct)
+            for question, answer, correct in graded.answers
+        ])
+        return attempt
+
+    def located(self, attempt):
+        return [alias for alias in ('default', 'attempts', self.archive)
+                if QuizAttempt.objects.using(alias).filter(pk=attempt.pk).exists()]
+
+    def test_submissions_go_to_the_attempts_database(self):
+        attempt = self.submit(self.user, 'A', 'B')
+
+        self.assertEqual(self.located(attempt), ['attempts'])
+        self.assertEqual(UserAnswer.objects.using('attempts').filter(attempt_id=attempt.pk).count(), 2)
+        # Derived stats are written on the main database once the attempt commits
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).attempt_count, 1)
+        self.assertEqual(UserQuizStats.objects.get(user=self.user).best_score, 100)
+
+    def test_move_attempt_data_keeps_ids_and_can_be_repeated(self):
+        old = [self.submit(self.user, 'A', None, using='default') for _ in range(3)]
+        new = self.submit(self.user, 'B', 'B')
+        self.assertTrue(all(attempt.pk < new.pk for attempt in old))
+
+        call_command('move_attempt_data', batch_size=2, stdout=StringIO())
+        call_command('move_attempt_data', stdout=StringIO())
+
+        self.assertEqual([self.located(attempt) for attempt in old + [new]], [['attempts']] * 4)
+        moved = QuizAttempt.objects.using('attempts').get(pk=old[0].pk)
+        self.assertEqual(moved.completed_at, old[0].completed_at)
+        self.assertEqual(UserAnswer.objects.using('attempts').filter(attempt_id=old[0].pk).count(), 2)
+        self.assertFalse(UserAnswer.objects.using('default').exists())
+        # Moving doesn't count the attempts again, or take them off
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).attempt_count, 4)
+
+    def test_move_stops_on_an_id_taken_by_another_attempt(self):
+        attempt = self.submit(self.user, 'A', 'B', using='default')
+        QuizAttempt.objects.using('attempts').create(
+            id=attempt.pk, user=self.author, quiz=self.quiz, score=0, total_questions=2, correct_answers=0
+        )
+
+        with self.assertRaises(CommandError):
+            call_command('move_attempt_data', stdout=StringIO())
+        self.assertEqual(self.located(attempt), ['default', 'attempts'])
+        self.assertEqual(QuizAttempt.objects.using('default').get(pk=attempt.pk).user, self.user)
+
+    def test_archived_attempts_are_still_found(self):
+        archived = self.submit(self.user, 'A', 'B')
+        current = self.submit(self.user, 'A', None)
+        QuizAttempt.objects.using('attempts').filter(pk=current.pk).update(
+            completed_at=timezone.now() + timedelta(days=2)
+        )
+
+        call_command('move_attempt_data', to=self.archive, before=date.today() + timedelta(days=1), stdout=StringIO())
+
+        self.assertEqual(self.located(archived), [self.archive])
+        self.assertEqual(find_attempt(QuizAttempt.objects.all(), id=archived.pk), archived)
+        self.assertEqual(
+            newest_attempts(QuizAttempt.objects.filter(user=self.user), 5), [current, archived]
+        )
+        self.client.force_login(self.user)
+        response = self.client.get(f'/quiz/{self.quiz.pk}/result/{archived.pk}/')
+        self.assertEqual([answer.is_correct for answer in response.context['user_answers']], [True, True])
+
+    def test_deletes_cascade_into_every_attempt_database(self):
+        archived = self.submit(self.user, 'A', 'B')
+        call_command('move_attempt_data', to=self.archive, before=date.today() + timedelta(days=1), stdout=StringIO())
+        current = self.submit(self.user, 'A', None)
+        kept = self.submit(self.author, 'B', 'B')
+
+        self.quiz.questions.order_by('id').first().delete()
+        self.assertEqual(UserAnswer.objects.using(self.archive).filter(attempt_id=archived.pk).count(), 1)
+        self.assertEqual(UserAnswer.objects.using('attempts').filter(attempt_id=current.pk).count(), 1)
+
+        self.user.delete()
+
+        self.assertEqual([self.located(archived), self.located(current), self.located(kept)], [[], [], ['attempts']])
+        self.assertFalse(UserAnswer.objects.using(self.archive).exists())
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).attempt_count, 1)
+        buckets = QuizScoreBucket.objects.filter(quiz=self.quiz, count__gt=0).values_list('score', 'count')
+        self.assertEqual(dict(buckets), {50: 1})
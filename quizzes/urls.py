@@ -5,9 +5,14 @@ app_name = 'quizzes'
 
 urlpatterns = [
     path('', views.home_view, name='home'),
+    path('search/', views.quiz_search, name='search'),
+    path('search/data/', views.quiz_search_data, name='search_data'),
     path('quiz/<int:quiz_id>/', views.quiz_detail, name='quiz_detail'),
     path('quiz/<int:quiz_id>/take/', views.take_quiz, name='take_quiz'),
     path('quiz/<int:quiz_id>/submit/', views.submit_quiz, name='submit_quiz'),
     path('quiz/<int:quiz_id>/result/<int:attempt_id>/', views.quiz_result, name='quiz_result'),
+    path('quiz/<int:quiz_id>/distribution/', views.score_distribution, name='score_distribution'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('leaderboard/data/', views.leaderboard_data, name='leaderboard_data'),
+    path('leaderboard/stream/', views.leaderboard_stream, name='leaderboard_stream'),
 ]
\ No newline at end of file
@@ -1,23 +1,30 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
-from django.db.models import Count, Avg, Max
-from django.core.paginator import Paginator
-from django.utils import timezone
-from datetime import timedelta
+from django.urls import reverse
+import asyncio
 import json
-from .models import Quiz, Question, QuizAttempt, UserAnswer
+from .models import Quiz, QuizAttempt, UserQuizStats
+from .answer_keys import get_answer_key
+from .grading import attempt_answers, grade_submission, record_attempt
+from .histograms import ScoreDistribution
+from . import leaderboards, live, search
+from quizhub.broker import KEEPALIVE, config as live_config, get_broker
+from quizhub.db import awrite
+from quizhub.routers import attempts_database, find_attempt, join_or_prefetch, newest_attempts
 
 User = get_user_model()
 
+SEARCH_PAGE_SIZE = 20
+
 def home_view(request):
-    quizzes = Quiz.objects.filter(is_active=True).annotate(
-        total_questions=Count('questions'),
-        total_attempts=Count('attempts')
-    ).order_by('-created_at')
+    # Question and attempt counts are denormalized onto Quiz
+    quizzes = Quiz.objects.filter(is_active=True).order_by('-created_at')
     
     # Filter by language if specified
     language = request.GET.get('language')
@@ -27,22 +34,88 @@ def home_view(request):
     context = {
         'quizzes': quizzes,
         'languages': Quiz.LANGUAGE_CHOICES,
-        'selected_language': language
+        'selected_language': language,
+        'my_stats': get_my_stats(request)
     }
     return render(request, 'quizzes/home.html', context)
 
+def quiz_search(request):
+    query = request.GET.get('q', '').strip()
+    language = request.GET.get('language') or None
+    difficulty = request.GET.get('difficulty') or None
+    # Unknown filters are dropped rather than failing the page
+    if language not in dict(Quiz.LANGUAGE_CHOICES):
+        language = None
+    if difficulty not in search.DIFFICULTIES:
+        difficulty = None
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    
+    hits, has_more, truncated = search.search(
+        query, language, difficulty, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE
+    )
+    context = {
+        'query': query,
+        'hits': hits,
+        'page': page,
+        'has_more': has_more,
+        'truncated': truncated,
+        'languages': Quiz.LANGUAGE_CHOICES,
+        'difficulties': search.DIFFICULTIES,
+        'selected_language': language,
+        'selected_difficulty': difficulty
+    }
+    return render(request, 'quizzes/search.html', context)
+
+def quiz_search_data(request):
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        size = min(50, max(1, int(request.GET.get('size', SEARCH_PAGE_SIZE))))
+        hits, has_more, truncated = search.search(
+            request.GET.get('q', ''),
+            language=request.GET.get('language') or None,
+            difficulty=request.GET.get('difficulty') or None,
+            limit=size,
+            offset=(page - 1) * size
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'page': page,
+        'has_more': has_more,
+        'truncated': truncated,
+        'results': [
+            {
+                'kind': hit['kind'],
+                'quiz_id': hit['quiz'].id,
+                'question_id': hit['question_id'],
+                'language': hit['quiz'].language,
+                'difficulty': hit['quiz'].difficulty,
+                'title': hit['title'],
+                'snippet': hit['snippet'],
+                'url': reverse('quizzes:quiz_detail', args=[hit['quiz'].id])
+            }
+            for hit in hits
+        ]
+    })
+
 def quiz_detail(request, quiz_id):
     quiz = get_object_or_404(Quiz, id=quiz_id, is_active=True)
     user_attempts = []
     
     if request.user.is_authenticated:
-        user_attempts = QuizAttempt.objects.filter(
-            user=request.user, quiz=quiz
-        ).order_by('-completed_at')[:5]
+        user_attempts = newest_attempts(QuizAttempt.objects.filter(user=request.user, quiz=quiz), 5)
+    
+    top_attempts = newest_attempts(join_or_prefetch(quiz.attempts.all(), 'user'), 5)
     
     context = {
         'quiz': quiz,
         'user_attempts': user_attempts,
+        'top_attempts': top_attempts,
         'total_questions': quiz.get_total_questions()
     }
     return render(request, 'quizzes/quiz_detail.html', context)
@@ -68,98 +141,229 @@ def take_quiz(request, quiz_id):
 @require_POST
 def submit_quiz(request, quiz_id):
     quiz = get_object_or_404(Quiz, id=quiz_id, is_active=True)
-    questions = quiz.questions.all()
-    
-    if questions.count() == 0:
-        return JsonResponse({'success': False, 'message': 'No questions in this quiz'})
-    
+    return submission_response(request.user, quiz, request.body)
+
+@login_required
+@require_POST
+async def asubmit_quiz(request, quiz_id):
+    # submit_quiz under ASGI (see quizhub.asgi_urls)
+    quiz = await aget_object_or_404(Quiz, id=quiz_id, is_active=True)
+    user = await request.auser()
     try:
         answers_data = json.loads(request.body)
-        answers = answers_data.get('answers', {})
-        time_taken_seconds = answers_data.get('time_taken', 0)
-        
-        correct_count = 0
-        total_questions = questions.count()
+        graded = await sync_to_async(grade_submission)(quiz, answers_data.get('answers', {}))
+        if graded.total_questions == 0:
+            return JsonResponse({'success': False, 'message': 'No questions in this quiz'})
         
-        # Create quiz attempt
-        time_taken = timedelta(seconds=time_taken_seconds)
-        attempt = QuizAttempt.objects.create(
-            user=request.user,
-            quiz=quiz,
-            score=0,  # Will update after calculating
-            total_questions=total_questions,
-            correct_answers=0,  # Will update after calculating
-            time_taken=time_taken
+        # Recording is one transaction, which the async ORM can't run; awrite
+        # lets it out of the event loop one write at a time (see quizhub.db)
+        attempt = await awrite(
+            record_attempt, user, graded, answers_data.get('time_taken', 0), using=attempts_database
         )
+        return submission_recorded(attempt, graded)
         
-        # Process answers
-        for question in questions:
-            question_id = str(question.id)
-            selected_answer = answers.get(question_id, '')
-            
-            is_correct = selected_answer == question.correct_answer
-            if is_correct:
-                correct_count += 1
-            
-            UserAnswer.objects.create(
-                attempt=attempt,
-                question=question,
-                selected_answer=selected_answer,
-                is_correct=is_correct
-            )
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': 'Invalid data format'})
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
+def submission_response(user, quiz, body):
+    try:
+        answers_data = json.loads(body)
+        answers = answers_data.get('answers', {})
+        time_taken_seconds = answers_data.get('time_taken', 0)
         
-        # Update attempt with final scores
-        score_percentage = round((correct_count / total_questions) * 100, 2)
-        attempt.correct_answers = correct_count
-        attempt.score = score_percentage
-        attempt.save()
+        # Score everything in memory, then write the attempt in one transaction
+        graded = grade_submission(quiz, answers)
+        if graded.total_questions == 0:
+            return JsonResponse({'success': False, 'message': 'No questions in this quiz'})
         
-        return JsonResponse({
-            'success': True,
-            'attempt_id': attempt.id,
-            'score': score_percentage,
-            'correct_answers': correct_count,
-            'total_questions': total_questions
-        })
+        attempt = record_attempt(user, graded, time_taken_seconds)
+        return submission_recorded(attempt, graded)
         
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'message': 'Invalid data format'})
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
 
+def submission_recorded(attempt, graded):
+    return JsonResponse({
+        'success': True,
+        'attempt_id': attempt.id,
+        'score': graded.score_percentage,
+        'correct_answers': graded.correct_count,
+        'total_questions': graded.total_questions
+    })
+
 def quiz_result(request, quiz_id, attempt_id):
     quiz = get_object_or_404(Quiz, id=quiz_id)
-    attempt = get_object_or_404(QuizAttempt, id=attempt_id, quiz=quiz)
+    # The attempt may have been archived to another database
+    attempt = find_attempt(QuizAttempt.objects.all(), id=attempt_id, quiz=quiz)
+    if attempt is None:
+        raise Http404('No QuizAttempt matches the given query.')
     
     # Only allow viewing own results unless it's admin
     if request.user != attempt.user and not request.user.is_staff:
         messages.error(request, 'You can only view your own quiz results.')
         return redirect('quizzes:quiz_detail', quiz_id=quiz.id)
     
-    user_answers = attempt.user_answers.select_related('question').order_by('question__id')
+    user_answers = attempt_answers(attempt, get_answer_key(quiz))
+    
+    distribution = ScoreDistribution.for_quiz(quiz)
     
     context = {
         'quiz': quiz,
         'attempt': attempt,
-        'user_answers': user_answers
+        'user_answers': user_answers,
+        'percentile': distribution.percentile(attempt.score),
+        'distribution': distribution.binned(10),
+        'distribution_total': distribution.total
     }
     return render(request, 'quizzes/quiz_result.html', context)
 
+def score_distribution(request, quiz_id):
+    quiz = get_object_or_404(Quiz, id=quiz_id)
+    try:
+        width = int(request.GET.get('width', 10))
+        if width < 1 or 100 % width:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'width must divide 100'}, status=400)
+    
+    distribution = ScoreDistribution.for_quiz(quiz)
+    data = {
+        'success': True,
+        'total_attempts': distribution.total,
+        'buckets': [
+            {'min': b['min'], 'max': b['max'], 'count': b['count']}
+            for b in distribution.binned(width)
+        ]
+    }
+    if 'score' in request.GET:
+        try:
+            data['percentile'] = distribution.percentile(min(100, max(0, int(request.GET['score']))))
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'score must be a number'}, status=400)
+    return JsonResponse(data)
+
 def leaderboard(request):
-    # Get top scorers across all quizzes
-    top_users = User.objects.annotate(
-        total_attempts=Count('quiz_attempts'),
-        avg_score=Avg('quiz_attempts__score'),
-        best_score=Max('quiz_attempts__score')
-    ).filter(total_attempts__gt=0).order_by('-avg_score', '-best_score')[:20]
+    # Boards are read from precomputed, indexed orderings
+    try:
+        scope = leaderboards.scope_for(
+            language=request.GET.get('language'),
+            window=request.GET.get('window')
+        )
+    except ValueError:
+        scope = leaderboards.GLOBAL_SCOPE
+    # As many as live updates keep ranked
+    top_size = live_config()['TOP']
+    top_stats = leaderboards.top(scope, limit=top_size)
+    
+    my_rank = my_stats = None
+    if request.user.is_authenticated:
+        my_rank, my_entry = leaderboards.rank_of(scope, request.user)
+        my_stats = my_entry if scope == leaderboards.GLOBAL_SCOPE else get_my_stats(request)
     
     # Get recent high scores
-    recent_attempts = QuizAttempt.objects.select_related('user', 'quiz').filter(
-        score__gte=80
-    ).order_by('-completed_at')[:10]
+    recent_attempts = newest_attempts(
+        join_or_prefetch(QuizAttempt.objects.filter(score__gte=80), 'user', 'quiz'), 10
+    )
     
     context = {
-        'top_users': top_users,
-        'recent_attempts': recent_attempts
+        'top_stats': top_stats,
+        'top_size': top_size,
+        'recent_attempts': recent_attempts,
+        'my_stats': my_stats,
+        'my_rank': my_rank,
+        'languages': Quiz.LANGUAGE_CHOICES,
+        'selected_language': request.GET.get('language'),
+        'selected_window': request.GET.get('window')
     }
     return render(request, 'quizzes/leaderboard.html', context)
+
+def leaderboard_data(request):
+    try:
+        scope = leaderboards.scope_for(
+            language=request.GET.get('language'),
+            quiz_id=request.GET.get('quiz'),
+            window=request.GET.get('window')
+        )
+        page = max(1, int(request.GET.get('page', 1)))
+        size = min(100, max(1, int(request.GET.get('size', 20))))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    offset = (page - 1) * size
+    data = {
+        'success': True,
+        'scope': scope,
+        'entries': serialize_entries(leaderboards.top(scope, limit=size, offset=offset), offset),
+        'me': None
+    }
+    
+    if request.user.is_authenticated:
+        rank, around_offset, entries = leaderboards.around(scope, request.user, radius=5)
+        if rank is not None:
+            data['me'] = {
+                'rank': rank,
+                'around': serialize_entries(entries, around_offset)
+            }
+    return JsonResponse(data)
+
+async def leaderboard_stream(request):
+    """
+    Server-sent events for the leaderboard page: ``rank`` and ``score``
+    events from quizzes.live. Neither the session nor the user is read, so
+    a stream runs no queries however long it stays open.
+    """
+    # A WSGI worker would be held for as long as the stream stays open;
+    # 204 tells EventSource not to reconnect
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        scope = leaderboards.scope_for(
+            language=request.GET.get('language'),
+            quiz_id=request.GET.get('quiz'),
+            window=request.GET.get('window')
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    options = live_config()
+    
+    async def events():
+        broker = get_broker()
+        subscription = broker.subscribe(live.board_topic(scope), live.SCORES_TOPIC)
+        try:
+            yield f"retry: {options['RETRY']}\n\n".encode()
+            while True:
+                try:
+                    yield await subscription.get(options['KEEPALIVE'])
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def serialize_entries(entries, offset):
+    return [
+        {
+            'rank': offset + i + 1,
+            'username': entry.user.username,
+            'name': entry.user.get_full_name(),
+            'attempts': entry.attempts,
+            'average_score': round(entry.average_score, 2),
+            'best_score': entry.best_score
+        }
+        for i, entry in enumerate(entries)
+    ]
+
+def get_my_stats(request):
+    if not request.user.is_authenticated:
+        return None
+    return UserQuizStats.objects.filter(user=request.user).first()
@@ -0,0 +1,261 @@
+"""
+Activity feed: quiz attempts, new quizzes and comments from followed users.
+
+Events are fanned out on write. When one happens, an ActivityEvent is
+stored and a FeedEntry copied into the timeline of each of the actor's
+followers, in the transaction that caused it (or once it has committed,
+for attempts kept in a database of their own). Reading a feed is then a
+range scan of the reader's own entries over ``(owner, created_at,
+event)``, with no join across Follow, QuizAttempt and Comment.
+
+Timelines are capped at TIMELINE_LENGTH entries. Trimming one reads it
+whole, so each fan-out only trims a 1/TRIM_EVERY share of the timelines
+it writes to, and a timeline runs over its cap by about TRIM_EVERY
+entries between trims.
+
+An account with more than FANOUT_LIMIT followers would write that many
+rows per event. Its events are marked ``fanned_out=False`` instead, and
+readers pull them in while reading, newest first, from a partial index
+holding only such events. A page is the newest of both sources.
+
+Following someone copies their latest BACKFILL fanned-out events into
+the follower's timeline, and unfollowing removes them. Toggles write
+follows without the ORM and call follow_switched() themselves.
+``manage.py rebuild_feeds`` refills every timeline from the events.
+"""
+import heapq
+import json
+import logging
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Q
+
+from profiles.models import UserProfile
+from quizhub.db import retry_on_locked
+from quizhub.pagination import KeysetPage, decode_cursor, encode_cursor
+from quizzes.models import Quiz
+
+from .models import ActivityEvent, FeedEntry, Follow
+
+User = get_user_model()
+
+logger = logging.getLogger('quizhub.social')
+
+DEFAULTS = {
+    'TIMELINE_LENGTH': 500,
+    'FANOUT_LIMIT': 2000,
+    'TRIM_EVERY': 20,
+    'BACKFILL': 50,
+}
+
+KEY = ('created_at', 'id')
+EXCERPT_LENGTH = 140
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'SOCIAL_FEED', {})}
+
+
+def publish_after(kind, actor_id, object_id, data, using):
+    """
+    Publish an event for a write on ``using``: within that write's
+    transaction when it is on the feed's database, sparing a second
+    commit, and once it has committed otherwise. A failure then is logged
+    rather than raised to the code that wrote, which may retry the whole
+    write (see quizzes.grading.record_attempt).
+    """
+    if using == router.db_for_write(ActivityEvent):
+        publish(kind, actor_id, object_id, data)
+    else:
+        transaction.on_commit(
+            partial(publish_committed, kind, actor_id, object_id, data), using=using, robust=True
+        )
+
+
+def publish_committed(kind, actor_id, object_id, data):
+    try:
+        publish(kind, actor_id, object_id, data)
+    except DatabaseError as exc:
+        logger.error(json.dumps({
+            'event': 'feed_publish_failed', 'kind': kind, 'actor_id': actor_id, 'object_id': object_id,
+            'error': str(exc),
+        }))
+
+
+@retry_on_locked
+def publish(kind, actor_id, object_id, data):
+    """Store an event and fan it out to the actor's followers' timelines."""
+    options = config()
+    followers_count = UserProfile.objects.filter(user_id=actor_id).values_list('followers_count', flat=True).first()
+    fan_out = (followers_count or 0) <= options['FANOUT_LIMIT']
+    using = router.db_for_write(ActivityEvent)
+    # Joins the caller's transaction, if any, without a savepoint
+    with transaction.atomic(using=using, savepoint=False):
+        event = ActivityEvent.objects.using(using).create(
+            actor_id=actor_id, kind=kind, object_id=object_id, data=data, fanned_out=fan_out
+        )
+        if fan_out:
+            connection = connections[using]
+            with connection.cursor() as cursor:
+                # Straight from the follow table, without loading the followers
+                cursor.execute(
+                    f'INSERT INTO {FeedEntry._meta.db_table} (owner_id, event_id, actor_id, created_at) '
+                    f'SELECT follower_id, %s, %s, %s FROM {Follow._meta.db_table} WHERE following_id = %s',
+                    [event.pk, actor_id, FeedEntry._meta.get_field('created_at').get_db_prep_save(
+                        event.created_at, connection), actor_id]
+                )
+                # A different share of the followers each time, by event id
+                cursor.execute(
+                    f'DELETE FROM {FeedEntry._meta.db_table} WHERE id IN ('
+                    f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+                    f'PARTITION BY owner_id ORDER BY created_at DESC, event_id DESC) AS position '
+                    f'FROM {FeedEntry._meta.db_table} WHERE owner_id IN ('
+                    f'SELECT follower_id FROM {Follow._meta.db_table} '
+                    f'WHERE following_id = %s AND (follower_id + %s) %% %s = 0)'
+                    f') timeline WHERE position > %s)',
+                    [actor_id, event.pk, options['TRIM_EVERY'], options['TIMELINE_LENGTH']]
+                )
+    return event
+
+
+def unpublish(kind, object_id):
+    # Timeline entries go with the event
+    ActivityEvent.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def follow_switched(follower_id, following_id, active):
+    """Fill in or clear a timeline after a follow is created or deleted, in the same transaction."""
+    if not active:
+        FeedEntry.objects.filter(owner_id=follower_id, actor_id=following_id).delete()
+        return
+    # Pulled events are found on read already
+    events = ActivityEvent.objects.filter(actor_id=following_id, fanned_out=True).order_by('-created_at', '-id')
+    FeedEntry.objects.bulk_create([
+        FeedEntry(owner_id=follower_id, event_id=pk, actor_id=following_id, created_at=created_at)
+        for pk, created_at in events.values_list('pk', 'created_at')[:config()['BACKFILL']]
+    ])
+
+
+def attempt_data(attempt):
+    return {'quiz': attempt.quiz_id, 'score': attempt.score}
+
+
+def quiz_data(quiz):
+    return {'quiz': quiz.pk}
+
+
+def comment_data(comment):
+    return {'profile': comment.profile_owner_id, 'excerpt': comment.content[:EXCERPT_LENGTH]}
+
+
+def after(queryset, cursor, fields):
+    if cursor is None:
+        return queryset
+    created_at, pk = cursor
+    timestamp, key = fields
+    return queryset.filter(Q(**{f'{timestamp}__lt': created_at}) | Q(**{timestamp: created_at, f'{key}__lt': pk}))
+
+
+def pulled_actors(user_id):
+    """Followed users whose events weren't fanned out, found through the partial index holding only theirs."""
+    return list(
+        ActivityEvent.objects.filter(
+            fanned_out=False,
+            actor_id__in=Follow.objects.filter(follower_id=user_id).values('following_id')
+        ).order_by().values_list('actor_id', flat=True).distinct()
+    )
+
+
+def timeline(user_id, cursor=None, per_page=20):
+    """
+    The page of ``user_id``'s feed after ``cursor``, newest first, as a
+    KeysetPage of ActivityEvents with ``actor``, ``quiz`` and ``profile``
+    (the commented profile's user) loaded. Events describe() leaves out
+    are read past, so pages stay full. Raises InvalidCursor for a cursor
+    that can't be decoded.
+    """
+    position = decode_cursor(cursor, ActivityEvent, KEY) if cursor else None
+    pulled = pulled_actors(user_id)
+    events = []
+    while True:
+        batch = newest(user_id, pulled, position, per_page + 1)
+        events.extend(describe(batch))
+        if len(events) > per_page or len(batch) <= per_page:
+            break
+        position = (batch[-1].created_at, batch[-1].pk)
+
+    next_cursor = None
+    if len(events) > per_page:
+        events = events[:per_page]
+        next_cursor = encode_cursor([events[-1].created_at, events[-1].pk])
+    return KeysetPage(events, next_cursor)
+
+
+def newest(user_id, pulled, position, limit):
+    """The ``limit`` newest events after ``position`` from the timeline and the ``pulled`` actors."""
+    entries = after(FeedEntry.objects.filter(owner_id=user_id), position, ('created_at', 'event'))
+    sources = [[
+        entry.event
+        for entry in entries.select_related('event').order_by('-created_at', '-event')[:limit]
+    ]]
+    for actor_id in pulled:
+        events = after(ActivityEvent.objects.filter(actor_id=actor_id, fanned_out=False), position, KEY)
+        sources.append(list(events.order_by('-created_at', '-id')[:limit]))
+
+    events = []
+    seen = set()
+    # A follow racing a fan-out can copy an event into a timeline twice
+    for event in heapq.merge(*sources, key=lambda event: (event.created_at, event.pk), reverse=True):
+        if event.pk not in seen:
+            seen.add(event.pk)
+            events.append(event)
+            if len(events) == limit:
+                break
+    return events
+
+
+def describe(events):
+    """Load what ``events`` show, leaving out those about quizzes gone or deactivated since."""
+    users = User.objects.in_bulk(
+        {event.actor_id for event in events} | {event.data['profile'] for event in events if 'profile' in event.data}
+    )
+    quizzes = Quiz.objects.filter(is_active=True).order_by().in_bulk(
+        {event.data['quiz'] for event in events if 'quiz' in event.data}
+    )
+    described = []
+    for event in events:
+        actor = users.get(event.actor_id)
+        quiz = quizzes.get(event.data.get('quiz'))
+        if actor is None or ('quiz' in event.data and quiz is None):
+            continue
+        event.actor = actor
+        event.quiz = quiz
+        event.profile = users.get(event.data.get('profile'))
+        described.append(event)
+    return described
+
+
+def rebuild_range(first_id, last_id):
+    """
+    Refill the timelines of the users with ids in ``(first_id, last_id]``
+    with the newest fanned-out events of the users they follow. Returns
+    the entries written.
+    """
+    using = router.db_for_write(FeedEntry)
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        FeedEntry.objects.using(using).filter(owner_id__gt=first_id, owner_id__lte=last_id).delete()
+        cursor.execute(
+            f"INSERT INTO {FeedEntry._meta.db_table} (owner_id, event_id, actor_id, created_at) "
+            f"SELECT owner_id, event_id, actor_id, created_at FROM ("
+            f"SELECT follow.follower_id AS owner_id, event.id AS event_id, event.actor_id, event.created_at, "
+            f"ROW_NUMBER() OVER (PARTITION BY follow.follower_id ORDER BY event.created_at DESC, event.id DESC) AS position "
+            f"FROM {Follow._meta.db_table} follow "
+            f"JOIN {ActivityEvent._meta.db_table} event ON event.actor_id = follow.following_id "
+            f"WHERE follow.follower_id > %s AND follow.follower_id <= %s AND event.fanned_out"
+            f") newest WHERE position <= %s",
+            [first_id, last_id, config()['TIMELINE_LENGTH']]
+        )
+        return cursor.rowcount
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from social import writebehind
+
+
+class Command(BaseCommand):
+    help = 'Apply queued follow and upvote toggles (SOCIAL_WRITE_BEHIND) to the database in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Seconds to wait when the queue is empty (defaults to FLUSH_INTERVAL)')
+        parser.add_argument('--batch-size', type=int, help='Toggles applied per transaction (defaults to BATCH_SIZE)')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit instead of running forever')
+
+    def handle(self, *args, **options):
+        config = writebehind.config()
+        interval = options['interval'] if options['interval'] is not None else config['FLUSH_INTERVAL']
+        batch_size = options['batch_size'] or config['BATCH_SIZE']
+        queue = writebehind.get_queue()
+        flushed = 0
+
+        try:
+            while True:
+                stats = queue.flush(batch_size)
+                if stats:
+                    flushed += stats['entries']
+                    self.stdout.write(
+                        f"Flushed {stats['entries']} toggles ({stats['rows_changed']} rows changed) "
+                        f"in {stats['seconds'] * 1000:.1f}ms, lag {stats['max_lag']:.2f}s"
+                    )
+                # A full batch means more is waiting; otherwise let toggles accumulate
+                if stats and stats['entries'] >= batch_size:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} toggles.'))
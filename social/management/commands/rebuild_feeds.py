@@ -0,0 +1,34 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from social import feed
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Refill every activity feed timeline (social.feed) from the stored events and follows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of timelines refilled per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        written = 0
+        last_id = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            written += feed.rebuild_range(last_id, user_ids[-1])
+            last_id = user_ids[-1]
+        # Entries of deleted users past the last one left
+        feed.rebuild_range(last_id, sys.maxsize)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} feed entries.'))
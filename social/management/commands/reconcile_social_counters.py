@@ -0,0 +1,76 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from profiles.models import UserProfile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Repair drift in the denormalized upvote and follower counts on UserProfile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of users checked per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = list(UserProfile.COUNTERS)
+        checked = repaired = created = 0
+        last_id = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            with transaction.atomic():
+                # Lock the rows before counting, so increments that land
+                # meanwhile are applied on top of the repaired value
+                profiles = {
+                    profile.user_id: profile
+                    for profile in UserProfile.objects.select_for_update().filter(user_id__in=user_ids)
+                    .only('id', 'user_id', *fields)
+                }
+                counts = {
+                    field: self.count(model_label, user_field, user_ids)
+                    for field, (model_label, user_field) in UserProfile.COUNTERS.items()
+                }
+                drifted = []
+                missing = []
+                for user_id in user_ids:
+                    expected = {field: counts[field].get(user_id, 0) for field in fields}
+                    profile = profiles.get(user_id)
+                    if profile is None:
+                        # Users who were upvoted or followed before ever getting a profile row
+                        if any(expected.values()):
+                            missing.append(UserProfile(user_id=user_id, **expected))
+                    elif any(getattr(profile, field) != value for field, value in expected.items()):
+                        for field, value in expected.items():
+                            setattr(profile, field, value)
+                        drifted.append(profile)
+
+                if drifted:
+                    UserProfile.objects.bulk_update(drifted, fields)
+                if missing:
+                    UserProfile.objects.bulk_create(missing, ignore_conflicts=True)
+
+            checked += len(user_ids)
+            repaired += len(drifted)
+            created += len(missing)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} users, repaired {repaired} profiles, created {created}.'
+        ))
+
+    def count(self, model_label, user_field, user_ids):
+        return dict(
+            apps.get_model(model_label).objects.filter(**{f'{user_field}__in': user_ids}).order_by()
+            .values_list(user_field).annotate(n=Count('id'))
+        )
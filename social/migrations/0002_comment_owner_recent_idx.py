@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['profile_owner', '-created_at', '-id'], name='comment_owner_recent_idx'),
+        ),
+    ]
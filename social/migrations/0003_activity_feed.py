@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0002_comment_owner_recent_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'attempt'), (1, 'quiz'), (2, 'comment')])),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('fanned_out', models.BooleanField(default=True)),
+                ('actor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='activity_events', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('actor', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='social.activityevent')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(fields=['kind', 'object_id'], name='activity_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(fields=['actor', '-created_at', '-id'], name='activity_actor_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['actor', '-created_at', '-id'], name='activity_pulled_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['owner', '-created_at', '-event'], name='feed_owner_recent_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -17,25 +18,11 @@ class Upvote(models.Model):
     
     def save(self, *args, **kwargs):
         # Prevent self-upvoting
-        if self.upvoter == self.upvoted_user:
+        if self.upvoter_id == self.upvoted_user_id:
             raise ValueError("Users cannot upvote themselves")
-        super().save(*args, **kwargs)
-        
-        # Update the upvoted user's profile total_upvotes
-        from profiles.models import UserProfile
-        profile, created = UserProfile.objects.get_or_create(user=self.upvoted_user)
-        profile.total_upvotes = self.upvoted_user.received_upvotes.count()
-        profile.save()
-    
-    def delete(self, *args, **kwargs):
-        user = self.upvoted_user
-        super().delete(*args, **kwargs)
-        
-        # Update the upvoted user's profile total_upvotes after deletion
-        from profiles.models import UserProfile
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        profile.total_upvotes = user.received_upvotes.count()
-        profile.save()
+        # social.signals bumps the profile's total_upvotes inside this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 class Comment(models.Model):
     commenter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='given_comments')
@@ -47,6 +34,10 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a profile's comments (see quizhub.pagination)
+            models.Index(fields=['profile_owner', '-created_at', '-id'], name='comment_owner_recent_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.commenter.username} on {self.profile_owner.username}'s profile"
@@ -71,6 +62,58 @@ class Follow(models.Model):
     
     def save(self, *args, **kwargs):
         # Prevent self-following
-        if self.follower == self.following:
+        if self.follower_id == self.following_id:
             raise ValueError("Users cannot follow themselves")
-        super().save(*args, **kwargs)
+        # social.signals bumps the profile's followers_count inside this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+class ActivityEvent(models.Model):
+    """Something a user did that shows up in their followers' feeds (see social.feed)."""
+    ATTEMPT = 0
+    QUIZ = 1
+    COMMENT = 2
+    KIND_CHOICES = [
+        (ATTEMPT, 'attempt'),
+        (QUIZ, 'quiz'),
+        (COMMENT, 'comment'),
+    ]
+    
+    # Indexed by the composite indexes below
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_events', db_index=False)
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    # The attempt, quiz or comment; not a foreign key, as attempts may live
+    # in another database
+    object_id = models.PositiveBigIntegerField()
+    # What the feed shows: quiz id and score, or profile id and excerpt
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Copied into the followers' timelines, rather than pulled on read
+    fanned_out = models.BooleanField(default=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'object_id'], name='activity_object_idx'),
+            # Backfilling a new follower's timeline
+            models.Index(fields=['actor', '-created_at', '-id'], name='activity_actor_recent_idx'),
+            # Pulling the events of accounts with too many followers to fan out
+            models.Index(fields=['actor', '-created_at', '-id'], condition=models.Q(fanned_out=False),
+                         name='activity_pulled_recent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.actor_id} {self.get_kind_display()} {self.object_id}"
+
+class FeedEntry(models.Model):
+    """One event in one follower's timeline, sorted like the event."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    event = models.ForeignKey(ActivityEvent, on_delete=models.CASCADE, related_name='+')
+    # Copied from the event, so an unfollow needs no join; entries are
+    # deleted with their event
+    actor = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False, db_index=False)
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-event'], name='feed_owner_recent_idx'),
+        ]
@@ -0,0 +1,86 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from profiles.models import UserProfile
+from quizzes.models import Quiz, QuizAttempt
+
+from . import feed, writebehind
+from .models import ActivityEvent, Comment, Follow, Upvote
+
+
+# The new totals are left on the instance for the caller to return. The
+# delete receivers also run for cascaded deletes, inside that transaction.
+
+@receiver(post_save, sender=Upvote)
+def upvote_saved(sender, instance, created, **kwargs):
+    if created:
+        instance.total_upvotes = UserProfile.adjust_counter(instance.upvoted_user_id, 'total_upvotes', 1)
+
+
+@receiver(post_delete, sender=Upvote)
+def upvote_deleted(sender, instance, **kwargs):
+    instance.total_upvotes = UserProfile.adjust_counter(instance.upvoted_user_id, 'total_upvotes', -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        instance.followers_count = UserProfile.adjust_counter(instance.following_id, 'followers_count', 1)
+        feed.follow_switched(instance.follower_id, instance.following_id, True)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    instance.followers_count = UserProfile.adjust_counter(instance.following_id, 'followers_count', -1)
+    feed.follow_switched(instance.follower_id, instance.following_id, False)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, using, **kwargs):
+    # Queued toggles for the user can never be applied once the delete commits
+    if writebehind.enabled():
+        transaction.on_commit(partial(writebehind.get_queue().discard_user, instance.pk), using=using)
+
+
+# Feed events are fanned out along with the write behind them (see
+# social.feed); an attempt may have been written to its own database.
+
+@receiver(post_save, sender=QuizAttempt)
+def attempt_saved(sender, instance, created, using, **kwargs):
+    if created:
+        feed.publish_after(ActivityEvent.ATTEMPT, instance.user_id, instance.pk, feed.attempt_data(instance), using)
+
+
+@receiver(post_delete, sender=QuizAttempt)
+def attempt_deleted(sender, instance, **kwargs):
+    feed.unpublish(ActivityEvent.ATTEMPT, instance.pk)
+
+
+@receiver(post_save, sender=Quiz)
+def quiz_saved(sender, instance, created, using, **kwargs):
+    if created and instance.is_active:
+        feed.publish_after(ActivityEvent.QUIZ, instance.created_by_id, instance.pk, feed.quiz_data(instance), using)
+
+
+@receiver(post_delete, sender=Quiz)
+def quiz_deleted(sender, instance, **kwargs):
+    feed.unpublish(ActivityEvent.QUIZ, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, using, **kwargs):
+    if created:
+        feed.publish_after(ActivityEvent.COMMENT, instance.commenter_id, instance.pk, feed.comment_data(instance), using)
+    else:
+        ActivityEvent.objects.filter(kind=ActivityEvent.COMMENT, object_id=instance.pk).update(
+            data=feed.comment_data(instance)
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    feed.unpublish(ActivityEvent.COMMENT, instance.pk)
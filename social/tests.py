@@ -1,3 +1,230 @@
-from django.test import TestCase
+import tempfile
+import threading
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from profiles.models import UserProfile
+from quizzes.models import Quiz
+
+from . import feed, writebehind
+from .models import Comment, Follow, Upvote
+from .toggles import toggle_follow, toggle_upvote
+
+User = get_user_model()
+
+
+class ToggleConcurrencyTests(TransactionTestCase):
+    """Many users toggling the same target at once must leave the counters exact."""
+
+    THREADS = 8
+    TOGGLES = 5
+
+    def setUp(self):
+        self.target = User.objects.create(username='target', email='target@example.com')
+        self.users = [
+            User.objects.create(username=f'user{index}', email=f'user{index}@example.com')
+            for index in range(self.THREADS)
+        ]
+
+    def hammer(self, toggle, users):
+        errors = []
+        start = threading.Barrier(len(users))
+
+        def run(user):
+            try:
+                start.wait()
+                for _ in range(self.TOGGLES):
+                    toggle(user, self.target)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_follows(self):
+        self.hammer(toggle_follow, self.users)
+        # An odd number of toggles each leaves every user following
+        self.assertEqual(Follow.objects.filter(following=self.target).count(), self.THREADS)
+        self.assertEqual(UserProfile.objects.get(user=self.target).followers_count, self.THREADS)
+
+    def test_concurrent_upvotes(self):
+        self.hammer(toggle_upvote, self.users)
+        self.assertEqual(Upvote.objects.filter(upvoted_user=self.target).count(), self.THREADS)
+        self.assertEqual(UserProfile.objects.get(user=self.target).total_upvotes, self.THREADS)
+
+    def test_concurrent_toggles_of_one_pair(self):
+        # Racing clicks by the same user serialize instead of colliding
+        self.hammer(toggle_upvote, [self.users[0]] * self.THREADS)
+        upvotes = Upvote.objects.filter(upvoted_user=self.target).count()
+        self.assertEqual(upvotes, self.THREADS * self.TOGGLES % 2)
+        self.assertEqual(UserProfile.objects.get(user=self.target).total_upvotes, upvotes)
+
+    def test_double_click_toggles_on_then_off(self):
+        user = self.users[0]
+        self.assertEqual(toggle_follow(user, self.target), (True, 1))
+        self.assertEqual(toggle_follow(user, self.target), (False, 0))
+        self.assertFalse(Follow.objects.exists())
+
+
+class WriteBehindTests(TestCase):
+    """Queued toggles involving a deleted user must not wedge the queue."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(SOCIAL_WRITE_BEHIND={
+            'ENABLED': True, 'PATH': Path(directory.name) / 'queue.sqlite3',
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.queue = writebehind.get_queue()
+        self.a, self.b, self.c = (
+            User.objects.create(username=name, email=f'{name}@example.com') for name in 'abc'
+        )
+
+    def test_flush_skips_toggles_queued_for_a_deleted_user(self):
+        toggle_follow(self.a, self.b)
+        toggle_follow(self.a, self.c)
+        # Deleted without the purge, as if it raced the enqueue
+        with override_settings(SOCIAL_WRITE_BEHIND={'ENABLED': False}):
+            self.b.delete()
+
+        stats = self.queue.flush()
+
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['rows_changed'], 1)
+        self.assertEqual(self.queue.metrics()['depth'], 0)
+        self.assertEqual(list(Follow.objects.values_list('follower', 'following')), [(self.a.pk, self.c.pk)])
+        self.assertEqual(UserProfile.objects.get(user=self.c).followers_count, 1)
+
+    def test_deleting_a_user_purges_their_queued_toggles(self):
+        toggle_follow(self.a, self.b)
+        toggle_upvote(self.b, self.c)
+        toggle_upvote(self.a, self.c)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.delete()
+
+        self.assertEqual(self.queue.metrics()['depth'], 1)
+        self.assertEqual(self.queue.flush()['rows_changed'], 1)
+        self.assertEqual(UserProfile.objects.get(user=self.c).total_upvotes, 1)
+
+
+class ReconcileCountersTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d = (
+            User.objects.create(username=name, email=f'{name}@example.com') for name in 'abcd'
+        )
+        for fan in (self.b, self.c):
+            Upvote.objects.create(upvoter=fan, upvoted_user=self.a)
+            Follow.objects.create(follower=fan, following=self.a)
+        Follow.objects.create(follower=self.a, following=self.d)
+
+    def reconcile(self):
+        out = StringIO()
+        # Batches of two, so the users span several
+        call_command('reconcile_social_counters', batch_size=2, stdout=out)
+        return out.getvalue().strip()
+
+    def counters(self):
+        rows = UserProfile.objects.values_list('user_id', 'total_upvotes', 'followers_count')
+        return {user_id: (upvotes, followers) for user_id, upvotes, followers in rows}
+
+    def test_repairs_drifted_and_missing_counters(self):
+        UserProfile.objects.filter(user=self.a).update(total_upvotes=7, followers_count=0)
+        UserProfile.objects.update_or_create(user=self.c, defaults={'total_upvotes': 3, 'followers_count': -1})
+        UserProfile.objects.filter(user=self.d).delete()
+
+        self.assertEqual(self.reconcile(), 'Checked 4 users, repaired 2 profiles, created 1.')
+        self.assertEqual(self.counters(), {self.a.pk: (2, 2), self.c.pk: (0, 0), self.d.pk: (0, 1)})
+
+        self.assertEqual(self.reconcile(), 'Checked 4 users, repaired 0 profiles, created 0.')
+
+
+class FeedTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.reader = User.objects.create(username='reader', email='reader@example.com')
+        self.author = User.objects.create(username='author', email='author@example.com')
+        toggle_follow(self.reader, self.author)
+        self.quizzes = [
+            Quiz.objects.create(title=f'Quiz {index}', language='python', created_by=self.author)
+            for index in range(6)
+        ]
+
+    def read_all(self, per_page):
+        pages, cursor = [], None
+        while True:
+            page = feed.timeline(self.reader.pk, cursor, per_page)
+            pages.append([event.quiz for event in page.items])
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_pages_stay_full_past_events_left_out(self):
+        # The newest quiz, then three gone, then the two oldest
+        Quiz.objects.filter(pk__in=[quiz.pk for quiz in self.quizzes[2:5]]).update(is_active=False)
+        first, *_, last = self.quizzes
+
+        self.assertEqual(self.read_all(per_page=2), [[last, self.quizzes[1]], [first]])
+
+    def test_no_cursor_after_a_page_of_only_events_left_out(self):
+        Quiz.objects.filter(pk__in=[quiz.pk for quiz in self.quizzes[:3]]).update(is_active=False)
+
+        self.assertEqual(self.read_all(per_page=3), [self.quizzes[:2:-1]])
+
+
+@override_settings(ROOT_URLCONF='quizhub.asgi_urls')
+class AsyncViewTests(TestCase):
+    """The social endpoints as served over ASGI (see quizhub.asgi_urls)."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='secret')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='secret')
+
+    async def post(self, path, data=None):
+        response = await self.async_client.post(path, data or {}, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_add_comment(self):
+        await self.async_client.aforce_login(self.a)
+
+        data = await self.post('/social/comment/b/', {'content': ' Nice profile '})
+
+        comment = await Comment.objects.aget()
+        self.assertEqual(
+            (comment.commenter_id, comment.profile_owner_id, comment.content), (self.a.pk, self.b.pk, 'Nice profile')
+        )
+        self.assertEqual(data['comment']['id'], comment.pk)
+        self.assertEqual(data['comment']['commenter_username'], 'a')
+        self.assertEqual(await self.post('/social/comment/b/', {'content': '  '}), {
+            'success': False, 'message': 'Comment cannot be empty'
+        })
+
+    async def test_toggles(self):
+        await self.async_client.aforce_login(self.a)
+
+        followed = await self.post('/social/follow/b/')
+        upvoted = await self.post('/social/upvote/b/')
+        unfollowed = await self.post('/social/follow/b/')
+
+        self.assertEqual(followed, {'success': True, 'following': True, 'followers_count': 1})
+        self.assertEqual(upvoted, {'success': True, 'upvoted': True, 'total_upvotes': 1})
+        self.assertEqual(unfollowed, {'success': True, 'following': False, 'followers_count': 0})
+        self.assertTrue(await Upvote.objects.filter(upvoter=self.a, upvoted_user=self.b).aexists())
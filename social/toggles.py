@@ -0,0 +1,124 @@
+"""
+Race-free on/off toggles for follows and upvotes.
+
+A toggle is one short transaction of plain writes: DELETE the pair, and
+if nothing was deleted, INSERT it with the backend's ignore-on-conflict
+form. The row counts say what happened, so there is no read beforehand,
+no savepoint and no IntegrityError to catch when two clicks race: on
+SQLite the first DELETE takes the write lock and the clicks serialize
+into on then off; on PostgreSQL the losing INSERT waits for the winner
+and then does nothing, leaving the relation on.
+
+Starting with a write also matters on SQLite, where a transaction that
+reads first and then writes can't wait for a concurrent writer and fails
+with "database is locked" instead.
+
+The rows are written without the ORM, so no post_save/post_delete
+signals are sent; the target's denormalized counter on UserProfile is
+adjusted here, in the same transaction, and returned in place of a COUNT.
+A follow also fills in or clears the follower's feed (see social.feed).
+
+With SOCIAL_WRITE_BEHIND enabled, toggles are queued instead and applied
+later in batches (see social.writebehind).
+"""
+from django.db import connections, router, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from profiles.models import UserProfile
+from quizhub.db import retry_on_locked
+
+from . import feed
+from .models import Follow, Upvote
+
+
+class Relation:
+    """One kind of user-to-user row that can be switched on and off."""
+
+    def __init__(self, model, actor_field, target_field, counter, switched=None):
+        self.model = model
+        self.actor_field = actor_field
+        self.target_field = target_field
+        self.counter = counter
+        # Called with (actor_id, target_id, active) after the row changed
+        self.switched = switched
+
+    @property
+    def using(self):
+        return router.db_for_write(self.model)
+
+    def switch(self, cursor, actor_id, target_id, active):
+        """
+        Insert or delete the pair on ``cursor`` and return whether a row
+        changed; switching on a pair that exists or off one that doesn't
+        is a no-op.
+        """
+        connection = connections[self.using]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        columns = [opts.get_field(name).column for name in (self.actor_field, self.target_field)]
+        if active:
+            created_at = opts.get_field('created_at')
+            sql = '{} {} ({}, {}, {}) VALUES (%s, %s, %s) {}'.format(
+                connection.ops.insert_statement(on_conflict=OnConflict.IGNORE),
+                quote(opts.db_table), *map(quote, columns), quote(created_at.column),
+                connection.ops.on_conflict_suffix_sql(None, OnConflict.IGNORE, None, None),
+            )
+            params = [actor_id, target_id, created_at.get_db_prep_save(timezone.now(), connection)]
+        else:
+            sql = 'DELETE FROM {} WHERE {} = %s AND {} = %s'.format(quote(opts.db_table), *map(quote, columns))
+            params = [actor_id, target_id]
+        cursor.execute(sql, params)
+        changed = cursor.rowcount > 0
+        if changed and self.switched:
+            self.switched(actor_id, target_id, active)
+        return changed
+
+    def exists(self, actor_id, target_id):
+        return self.model.objects.filter(
+            **{f'{self.actor_field}_id': actor_id, f'{self.target_field}_id': target_id}
+        ).exists()
+
+    def count(self, target_id):
+        count = UserProfile.objects.filter(user_id=target_id).values_list(self.counter, flat=True).first()
+        return count or 0
+
+
+RELATIONS = {
+    'follow': Relation(Follow, 'follower', 'following', 'followers_count', switched=feed.follow_switched),
+    'upvote': Relation(Upvote, 'upvoter', 'upvoted_user', 'total_upvotes'),
+}
+
+
+@retry_on_locked
+def toggle(relation, actor_id, target_id):
+    """
+    Flip ``relation`` between the two users and return ``(active, count)``:
+    whether the row now exists, and the target's counter after the change.
+    """
+    with transaction.atomic(using=relation.using), connections[relation.using].cursor() as cursor:
+        if relation.switch(cursor, actor_id, target_id, active=False):
+            return False, UserProfile.adjust_counter(target_id, relation.counter, -1)
+        if relation.switch(cursor, actor_id, target_id, active=True):
+            return True, UserProfile.adjust_counter(target_id, relation.counter, 1)
+    # A concurrent toggle inserted the same pair first and it stands
+    return True, relation.count(target_id)
+
+
+def toggle_follow(follower, following):
+    if follower.pk == following.pk:
+        raise ValueError("Users cannot follow themselves")
+    return _toggle('follow', follower.pk, following.pk)
+
+
+def toggle_upvote(upvoter, upvoted_user):
+    if upvoter.pk == upvoted_user.pk:
+        raise ValueError("Users cannot upvote themselves")
+    return _toggle('upvote', upvoter.pk, upvoted_user.pk)
+
+
+def _toggle(kind, actor_id, target_id):
+    from . import writebehind
+    if writebehind.enabled():
+        return writebehind.enqueue(kind, actor_id, target_id)
+    return toggle(RELATIONS[kind], actor_id, target_id)
@@ -8,4 +8,7 @@ urlpatterns = [
     path('comment/<str:username>/', views.add_comment, name='add_comment'),
     path('comment/delete/<int:comment_id>/', views.delete_comment, name='delete_comment'),
     path('follow/<str:username>/', views.toggle_follow, name='toggle_follow'),
+    path('feed/', views.activity_feed, name='feed'),
+    path('feed/data/', views.activity_feed_data, name='feed_data'),
+    path('write-behind/metrics/', views.write_behind_metrics, name='write_behind_metrics'),
 ]
\ No newline at end of file
@@ -1,13 +1,19 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 from django.contrib import messages
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.http import require_POST
-from .models import Upvote, Comment, Follow
+from quizhub.db import awrite
+from quizhub.pagination import InvalidCursor
+from . import feed, toggles, writebehind
+from .models import Comment
 
 User = get_user_model()
 
+FEED_PAGE_SIZE = 20
+
 @login_required
 @require_POST
 def toggle_upvote(request, username):
@@ -16,18 +22,27 @@ def toggle_upvote(request, username):
     if request.user == target_user:
         return JsonResponse({'success': False, 'message': 'You cannot upvote yourself'})
     
-    upvote, created = Upvote.objects.get_or_create(
-        upvoter=request.user,
-        upvoted_user=target_user
-    )
+    upvoted, total_upvotes = toggles.toggle_upvote(request.user, target_user)
+    
+    return JsonResponse({
+        'success': True,
+        'upvoted': upvoted,
+        'total_upvotes': total_upvotes
+    })
+
+@login_required
+@require_POST
+async def atoggle_upvote(request, username):
+    # toggle_upvote under ASGI (see quizhub.asgi_urls)
+    target_user = await aget_object_or_404(User, username=username)
+    user = await request.auser()
     
-    if not created:
-        upvote.delete()
-        upvoted = False
-    else:
-        upvoted = True
+    if user == target_user:
+        return JsonResponse({'success': False, 'message': 'You cannot upvote yourself'})
     
-    total_upvotes = target_user.received_upvotes.count()
+    # A toggle is one transaction, which the async ORM can't run; awrite
+    # queues it in the event loop rather than on SQLite's lock
+    upvoted, total_upvotes = await awrite(toggles.toggle_upvote, user, target_user)
     
     return JsonResponse({
         'success': True,
@@ -42,17 +57,40 @@ def add_comment(request, username):
     content = request.POST.get('content', '').strip()
     
     if not content:
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return JsonResponse({'success': False, 'message': 'Comment cannot be empty'})
-        messages.error(request, 'Comment cannot be empty')
-        return redirect('profiles:profile', username=username)
+        return comment_rejected(request, username)
     
     comment = Comment.objects.create(
         commenter=request.user,
         profile_owner=target_user,
         content=content
     )
+    return comment_added(request, username, comment)
+
+@login_required
+@require_POST
+async def aadd_comment(request, username):
+    # add_comment under ASGI (see quizhub.asgi_urls)
+    target_user = await aget_object_or_404(User, username=username)
+    content = request.POST.get('content', '').strip()
     
+    if not content:
+        return comment_rejected(request, username)
+    
+    # Not a transaction of our own, so the async ORM can write it
+    comment = await Comment.objects.acreate(
+        commenter=await request.auser(),
+        profile_owner=target_user,
+        content=content
+    )
+    return comment_added(request, username, comment)
+
+def comment_rejected(request, username):
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': False, 'message': 'Comment cannot be empty'})
+    messages.error(request, 'Comment cannot be empty')
+    return redirect('profiles:profile', username=username)
+
+def comment_added(request, username, comment):
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
@@ -96,21 +134,80 @@ def toggle_follow(request, username):
     if request.user == target_user:
         return JsonResponse({'success': False, 'message': 'You cannot follow yourself'})
     
-    follow, created = Follow.objects.get_or_create(
-        follower=request.user,
-        following=target_user
-    )
+    following, followers_count = toggles.toggle_follow(request.user, target_user)
     
-    if not created:
-        follow.delete()
-        following = False
-    else:
-        following = True
+    return JsonResponse({
+        'success': True,
+        'following': following,
+        'followers_count': followers_count
+    })
+
+@login_required
+@require_POST
+async def atoggle_follow(request, username):
+    # toggle_follow under ASGI (see quizhub.asgi_urls)
+    target_user = await aget_object_or_404(User, username=username)
+    user = await request.auser()
+    
+    if user == target_user:
+        return JsonResponse({'success': False, 'message': 'You cannot follow yourself'})
     
-    followers_count = target_user.followers.count()
+    following, followers_count = await awrite(toggles.toggle_follow, user, target_user)
     
     return JsonResponse({
         'success': True,
         'following': following,
         'followers_count': followers_count
     })
+
+@login_required
+def write_behind_metrics(request):
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Permission denied'}, status=403)
+    
+    return JsonResponse({
+        'success': True,
+        'enabled': writebehind.enabled(),
+        'metrics': writebehind.get_queue().metrics()
+    })
+
+@login_required
+def activity_feed(request):
+    try:
+        page = feed.timeline(request.user.id, request.GET.get('after'), FEED_PAGE_SIZE)
+    except InvalidCursor:
+        page = feed.timeline(request.user.id, None, FEED_PAGE_SIZE)
+    
+    return render(request, 'social/feed.html', {'events': page, 'paginated': 'after' in request.GET})
+
+@login_required
+def activity_feed_data(request):
+    try:
+        size = min(100, max(1, int(request.GET.get('size', FEED_PAGE_SIZE))))
+        page = feed.timeline(request.user.id, request.GET.get('cursor'), size)
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'success': False, 'message': 'Invalid cursor or size'}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'events': [
+            {
+                'id': event.id,
+                'kind': event.get_kind_display(),
+                'actor_username': event.actor.username,
+                'created_at': event.created_at.isoformat(),
+                'quiz_id': event.quiz.id if event.quiz else None,
+                'quiz_title': event.quiz.title if event.quiz else None,
+                'score': event.data.get('score'),
+                'profile_username': event.profile.username if event.profile else None,
+                'excerpt': event.data.get('excerpt'),
+                'url': (
+                    reverse('quizzes:quiz_detail', args=[event.quiz.id]) if event.quiz
+                    else reverse('profiles:profile', args=[event.profile.username]) if event.profile
+                    else None
+                )
+            }
+            for event in page
+        ],
+        'next_cursor': page.next_cursor
+    })
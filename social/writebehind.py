@@ -0,0 +1,247 @@
+"""
+Write-behind queue for follow and upvote toggles.
+
+Every toggle is a write transaction on the main database, and during
+bursts of social activity they compete with quiz submissions for SQLite's
+single writer lock. With SOCIAL_WRITE_BEHIND enabled, toggles are appended
+to a queue in a separate SQLite file instead, and ``manage.py
+flush_social_writes`` applies them in batched transactions: one writer
+lock and one commit per batch rather than per click. A batch collapses
+each pair to its final state, so on/off/on clicks cost a single row write.
+
+The response still reflects the click. enqueue() takes the pair's current
+state from its newest queued entry, falling back to the main database,
+and the target's count from the stored counter plus the deltas still
+queued for it. The queue's write lock is held while it reads those and
+while a batch is applied and removed, so a flush can't land in between.
+
+Toggles whose actor or target has since been deleted are dropped: a
+user's entries are purged along with the user, and a batch skips any
+that were queued while the delete was in flight.
+
+Applying a batch is idempotent: counters move by the rows that actually
+changed, so a batch replayed after a crash between the main commit and
+its removal from the queue changes nothing. Pages other than the toggle
+responses catch up once the batch is flushed.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+
+from profiles.models import UserProfile
+from quizhub.db import retry_on_locked
+
+from .toggles import RELATIONS
+
+logger = logging.getLogger('quizhub.social')
+
+DEFAULTS = {
+    'ENABLED': False,
+    # The queue's SQLite file; keep it on local disk next to the app
+    'PATH': None,
+    # Seconds flush_social_writes waits between batches when idle
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 1000,
+}
+
+# Flush history kept for the throughput metrics
+HISTORY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    actor_id INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    active INTEGER NOT NULL,
+    delta INTEGER NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_pair ON pending (kind, actor_id, target_id);
+CREATE INDEX IF NOT EXISTS pending_target ON pending (kind, target_id);
+CREATE TABLE IF NOT EXISTS flushes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished_at REAL NOT NULL,
+    entries INTEGER NOT NULL,
+    rows_changed INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    max_lag REAL NOT NULL
+);
+"""
+
+
+def config():
+    options = {**DEFAULTS, **getattr(settings, 'SOCIAL_WRITE_BEHIND', {})}
+    if options['PATH'] is None:
+        options['PATH'] = settings.BASE_DIR / 'social_queue.sqlite3'
+    return options
+
+
+def enabled():
+    return config()['ENABLED']
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue():
+    path = str(config()['PATH'])
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = WriteBehindQueue(path)
+        return _queues[path]
+
+
+def enqueue(kind, actor_id, target_id):
+    return get_queue().enqueue(kind, actor_id, target_id)
+
+
+class WriteBehindQueue:
+    """A durable FIFO of toggles in its own SQLite file, shared by all processes on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # Autocommit mode, with transactions opened explicitly below
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = FULL')
+            db.executescript(SCHEMA)
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def locked(self):
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def enqueue(self, kind, actor_id, target_id):
+        """Queue a toggle and return ``(active, count)`` as it will be once flushed."""
+        relation = RELATIONS[kind]
+        with self.locked() as db:
+            newest = db.execute(
+                'SELECT active FROM pending WHERE kind = ? AND actor_id = ? AND target_id = ? '
+                'ORDER BY id DESC LIMIT 1',
+                (kind, actor_id, target_id)
+            ).fetchone()
+            current = bool(newest[0]) if newest else relation.exists(actor_id, target_id)
+            active = not current
+            delta = 1 if active else -1
+            queued = db.execute(
+                'SELECT COALESCE(SUM(delta), 0) FROM pending WHERE kind = ? AND target_id = ?',
+                (kind, target_id)
+            ).fetchone()[0]
+            count = relation.count(target_id) + queued + delta
+            db.execute(
+                'INSERT INTO pending (kind, actor_id, target_id, active, delta, enqueued_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, actor_id, target_id, active, delta, time.time())
+            )
+        return active, max(count, 0)
+
+    @retry_on_locked
+    def flush(self, batch_size=None):
+        """
+        Apply the oldest ``batch_size`` queued toggles in one transaction
+        and return the flush's stats, or None if the queue was empty.
+        """
+        batch_size = batch_size or config()['BATCH_SIZE']
+        started = time.perf_counter()
+        with self.locked() as db:
+            entries = db.execute(
+                'SELECT id, kind, actor_id, target_id, active, enqueued_at FROM pending ORDER BY id LIMIT ?',
+                (batch_size,)
+            ).fetchall()
+            if not entries:
+                return None
+
+            final = {}
+            for _, kind, actor_id, target_id, active, _ in entries:
+                # Later entries win
+                final[kind, actor_id, target_id] = bool(active)
+
+            deltas = Counter()
+            changed = 0
+            with ExitStack() as stack:
+                existing = {}
+                for using in {relation.using for relation in RELATIONS.values()}:
+                    stack.enter_context(transaction.atomic(using=using))
+                    existing[using] = self.existing_users(using, final)
+                for (kind, actor_id, target_id), active in final.items():
+                    relation = RELATIONS[kind]
+                    if not {actor_id, target_id} <= existing[relation.using]:
+                        # A deleted user's row would fail the foreign key at commit
+                        continue
+                    with connections[relation.using].cursor() as cursor:
+                        if relation.switch(cursor, actor_id, target_id, active):
+                            changed += 1
+                            deltas[kind, target_id] += 1 if active else -1
+                for (kind, target_id), delta in deltas.items():
+                    if delta:
+                        UserProfile.adjust_counter(target_id, RELATIONS[kind].counter, delta)
+
+            db.execute('DELETE FROM pending WHERE id <= ?', (entries[-1][0],))
+            finished_at = time.time()
+            stats = {
+                'entries': len(entries),
+                'rows_changed': changed,
+                'seconds': time.perf_counter() - started,
+                'max_lag': finished_at - entries[0][5],
+            }
+            db.execute(
+                'INSERT INTO flushes (finished_at, entries, rows_changed, seconds, max_lag) VALUES (?, ?, ?, ?, ?)',
+                (finished_at, stats['entries'], stats['rows_changed'], stats['seconds'], stats['max_lag'])
+            )
+            db.execute('DELETE FROM flushes WHERE id <= (SELECT MAX(id) FROM flushes) - ?', (HISTORY,))
+
+        logger.info(json.dumps({'event': 'social_flush', **{key: round(value, 4) for key, value in stats.items()}}))
+        return stats
+
+    @staticmethod
+    def existing_users(using, pairs):
+        """The ids among ``pairs``' actors and targets whose users still exist."""
+        user_ids = {user_id for _, actor_id, target_id in pairs for user_id in (actor_id, target_id)}
+        return set(get_user_model().objects.using(using).filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    def discard_user(self, user_id):
+        """Drop the queued toggles made by or aimed at a deleted user."""
+        with self.locked() as db:
+            db.execute('DELETE FROM pending WHERE actor_id = ? OR target_id = ?', (user_id, user_id))
+
+    def metrics(self):
+        """Queue depth and lag, and throughput over the recent flushes."""
+        db = self.db
+        depth, oldest = db.execute('SELECT COUNT(*), MIN(enqueued_at) FROM pending').fetchone()
+        flushes, entries, seconds, max_lag, last_flush = db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(entries), 0), COALESCE(SUM(seconds), 0), '
+            'COALESCE(MAX(max_lag), 0), MAX(finished_at) FROM flushes'
+        ).fetchone()
+        return {
+            'depth': depth,
+            'lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'recent_flushes': flushes,
+            'recent_entries': entries,
+            'throughput_per_second': round(entries / seconds, 1) if seconds else 0.0,
+            'max_flush_lag_seconds': round(max_lag, 3),
+            'last_flush_at': last_flush,
+        }